@@ -1,13 +1,23 @@
-from cytoolz import merge, curry
+import os
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from textwrap import dedent
-from typing import List, Callable
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 from bretel import corrected_color_distances
 from color import average_color_distances_from_target, Color, hex_list
+from moves import Moves, RGBMoves
+from objective import (DEFAULT_WEIGHTS, LARGE_PALETTE_SAMPLE, LARGE_PALETTE_SIZE, VISION_SPACES,
+                       FunctionObjective, IncrementalObjective, Timings)
+from palette import Palette
 
+# a metric_schedule for anneal: CIE76 distances while nearly every move is accepted, CIEDE2000 after
+COARSE_TO_FINE = [(10., 'cie76')]
 
-def obj_fn(state: List[Color], target_colors: List[Color]) -> float:
+
+def obj_fn(state: List[Color], target_colors: List[Color], weights: Optional[Dict[str, float]] = None) -> float:
     """
     An objective function that measures the distance between the current state (list of colors)
     and the target state (target_colors). Tweak the weights to change the output.
@@ -25,27 +35,23 @@ def obj_fn(state: List[Color], target_colors: List[Color]) -> float:
     Args:
         state: A list of colors representing the current iteration of the state of your optimization function
         target_colors: A list of colors representing the goal to work towards for your optimization function
+        weights: Overrides for objective.DEFAULT_WEIGHTS
 
     Returns:
         A float representing the 'score' of the current state
     """
-    weights = {'Normal': 1,
-               'Range': 1,
-               'Target': 1,
-               'Protanopia': 0.33,
-               'Deuteranopia': 0.33,
-               'Tritanopia': 0.33}
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
 
     # get distances of state from target w.r.t each of the different color blindness measures
     distances = {n: corrected_color_distances(state, n)
-                 for n in ['Normal', 'Protanopia', 'Deuteranopia', 'Tritanopia']}
+                 for n in VISION_SPACES}
 
     # generate the 'scores'
-    scores = merge(
-        {n: 100 - np.average(distances[n])
-         for n in ['Normal', 'Protanopia', 'Deuteranopia', 'Tritanopia']},
-        {'Range': np.max(distances['Normal']) - np.min(distances['Normal']),
-         'Target': average_color_distances_from_target(state, target_colors)})
+    scores = {
+        **{n: 100 - np.average(distances[n])
+           for n in VISION_SPACES},
+        'Range': np.max(distances['Normal']) - np.min(distances['Normal']),
+        'Target': average_color_distances_from_target(state, target_colors)}
 
     return (weights['Normal'] * scores['Normal'] +
             weights['Target'] * scores['Target'] +
@@ -55,10 +61,211 @@ def obj_fn(state: List[Color], target_colors: List[Color]) -> float:
             weights['Tritanopia'] * scores['Tritanopia'])
 
 
+def make_objective(state: Palette, input_colors: List[Color], objective_function: Callable = obj_fn,
+                   timings: Optional[Timings] = None, weights: Optional[Dict[str, float]] = None,
+                   metric: str = 'ciede2000', large_palette: Optional[bool] = None,
+                   rng: Optional[np.random.RandomState] = None):
+    """
+    The propose / commit / rollback objective anneal optimizes. obj_fn only needs the moved color re-scored
+
+    Args:
+        state: The starting colors
+        input_colors: A list of target colors to optimize toward
+        objective_function: the objective function with which to measure success
+        timings: Collects the time spent in each stage of obj_fn, see objective.Timings
+        weights: Overrides for the obj_fn weights, see objective.DEFAULT_WEIGHTS
+        metric: The color difference obj_fn starts out measuring with, see metrics.METRICS
+        large_palette: Measure obj_fn in the large palette mode, with float32 distances and sampled proposals.
+                       Defaults to palettes of objective.LARGE_PALETTE_SIZE colors or more
+        rng: The random state the large palette mode draws its samples from
+
+    Returns:
+        An IncrementalObjective for obj_fn, otherwise a FunctionObjective
+    """
+    if objective_function is obj_fn:
+        if large_palette is None:
+            large_palette = len(state) >= LARGE_PALETTE_SIZE
+        large = {'dtype': np.float32, 'sample_size': LARGE_PALETTE_SAMPLE, 'rng': rng} if large_palette else {}
+        return IncrementalObjective(state, input_colors, weights=weights, timings=timings, metric=metric, **large)
+    if metric != 'ciede2000':
+        raise ValueError('Only obj_fn can be measured with other metrics than ciede2000')
+    return FunctionObjective(state, partial(objective_function, target_colors=input_colors))
+
+
+class SweepStats(NamedTuple):
+    """
+    What run_schedule reports to its callback after every sweep. All values are already at hand in the loop
+    """
+    sweep: int
+    temperature: float
+    cost: float
+    best_cost: float
+    acceptance_rate: float
+    evaluations: int
+    elapsed: float
+    timings: Dict[str, float]  # seconds per objective stage so far, if the objective is timed
+    best_state: np.ndarray  # the best colors so far, not a copy: don't modify it
+
+
+class ScheduleResult(NamedTuple):
+    """
+    Where run_schedule stopped, and the best state it saw on the way
+    """
+    temperature: float
+    sweeps: int
+    evaluations: int
+    best_state: np.ndarray
+    best_cost: float
+    stop_reason: str  # one of 'cutoff', 'max_sweeps', 'max_seconds', 'max_evaluations', 'plateau', 'callback'
+
+
+def run_schedule(objective, temperature: float, cooling_rate: float, cutoff: float,
+                 rng: Optional[np.random.RandomState] = None, verbose: bool = False,
+                 max_sweeps: Optional[int] = None, batch_size: int = 1,
+                 max_seconds: Optional[float] = None, max_evaluations: Optional[int] = None,
+                 plateau_sweeps: Optional[int] = None, plateau_tolerance: float = 1e-3,
+                 adaptive_cooling: bool = False,
+                 callback: Optional[Callable[[SweepStats], Optional[bool]]] = None,
+                 moves: Optional[Moves] = None, indices: Optional[Sequence[int]] = None,
+                 bounds: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> ScheduleResult:
+    """
+    The annealing loop: sweeps over the colors of the objective's state, moving each one in turn,
+    and cools down after every sweep. Updates the objective in place.
+
+    Besides reaching the cutoff temperature, the loop stops as soon as any of the given budgets runs out
+
+    Args:
+        objective: An objective from make_objective
+        temperature: starting point temperature of the schedule
+        cooling_rate: decrease in temperature at each sweep
+        cutoff: temperature at which the schedule ends
+        rng: The random state to draw from. Defaults to the global numpy one
+        verbose: print out the current temperature and cost?
+        max_sweeps: stop after this many sweeps, even if the cutoff hasn't been reached
+        batch_size: How many candidate moves to score at once for each color. The first candidate
+                    to pass the acceptance test is taken, i.e. it's batch_size tries from the same state
+        max_seconds: stop once this much wall-clock time has passed
+        max_evaluations: stop before scoring more than this many candidate states
+        plateau_sweeps: stop once the best cost has improved by no more than plateau_tolerance
+                        over this many sweeps
+        plateau_tolerance: see plateau_sweeps
+        adaptive_cooling: cool down faster (cooling_rate ** 4 per sweep) while more than 80% of the moves
+                          are accepted, as the state is still essentially random then
+        callback: Called with the SweepStats of every sweep. Returning True stops the schedule
+        moves: Draws the candidate moves and counts how many are accepted, see moves.py.
+               Defaults to moves.RGBMoves
+        indices: Only move the colors at these indices, the others stay as they are. Defaults to all of them
+        bounds: (low, high) arrays of the same shape as the state. Each color only moves within its box,
+                e.g. to let colors drift no further than a few channel values from where they are
+
+    Returns:
+        A ScheduleResult
+    """
+    rng = np.random if rng is None else rng
+    moves = RGBMoves() if moves is None else moves
+    indices = range(len(objective.rgb)) if indices is None else indices
+    start = time.perf_counter()
+    deadline = None if max_seconds is None else start + max_seconds
+    sweeps = evaluations = 0
+    best_cost, best_state = objective.cost, objective.rgb.copy()
+    best_costs = [best_cost]
+    stop_reason = None
+
+    while stop_reason is None:
+        if temperature <= cutoff:
+            stop_reason = 'cutoff'
+            break
+        if max_sweeps is not None and sweeps >= max_sweeps:
+            stop_reason = 'max_sweeps'
+            break
+
+        accepted_moves = 0
+        for i in indices:
+            if max_evaluations is not None and evaluations + batch_size > max_evaluations:
+                stop_reason = 'max_evaluations'
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                stop_reason = 'max_seconds'
+                break
+
+            # move the current color randomly. Channels stay whole numbers, as in the integer
+            # arrays Color.random_color starts from
+            new_rgbs = moves.propose(objective.rgb[i], batch_size, temperature, rng)
+            if bounds is not None:
+                new_rgbs = np.clip(new_rgbs, bounds[0][i], bounds[1][i])
+            new_rgbs = np.trunc(new_rgbs)
+            # get objective function differences
+            deltas = objective.propose_many(i, new_rgbs) - objective.cost
+            evaluations += batch_size
+            # choose between current and new states
+            draws = rng.rand(batch_size)
+            errors = getattr(objective, 'bounds', None)
+            if errors is not None and np.any(errors):
+                # estimated deltas within their error bound of the acceptance threshold are confirmed exactly
+                with np.errstate(divide='ignore'):
+                    thresholds = -temperature * np.log(draws)
+                for candidate in np.flatnonzero(np.abs(deltas - thresholds) <= errors):
+                    if np.any(deltas[:candidate] < thresholds[:candidate]):
+                        break  # an earlier candidate is taken already
+                    deltas[candidate] = objective.confirm(candidate) - objective.cost
+            probabilities = np.exp(np.minimum(-deltas / temperature, 0))
+            accepted = np.flatnonzero(draws < probabilities)
+            # the candidates after the first accepted one count as not tried
+            moves.record(accepted[0] + 1 if len(accepted) else batch_size, len(accepted) > 0)
+            if len(accepted):
+                objective.commit(accepted[0])
+                accepted_moves += 1
+                if objective.cost < best_cost:
+                    best_cost, best_state = objective.cost, objective.rgb.copy()
+            else:
+                objective.rollback()
+
+        if verbose:
+            print(f"current cost:\t\t{objective.cost}")
+            print(f"current temperature:\t{temperature}")
+
+        if callback is not None:
+            timings = {} if objective.timings is None else dict(objective.timings.seconds)
+            stats = SweepStats(sweeps, temperature, float(objective.cost), float(best_cost),
+                               accepted_moves / max(len(indices), 1),
+                               evaluations, time.perf_counter() - start, timings, best_state)
+            if callback(stats) and stop_reason is None:
+                stop_reason = 'callback'
+
+        if stop_reason is not None:
+            break
+
+        sweeps += 1
+        best_costs.append(best_cost)
+        if plateau_sweeps is not None and len(best_costs) > plateau_sweeps and \
+                best_costs[-plateau_sweeps - 1] - best_cost <= plateau_tolerance:
+            stop_reason = 'plateau'
+
+        if adaptive_cooling and accepted_moves > 0.8 * len(indices):
+            temperature *= cooling_rate ** 4
+        else:
+            temperature *= cooling_rate
+
+    return ScheduleResult(temperature, sweeps, evaluations, best_state, best_cost, stop_reason)
+
+
 def anneal(input_colors: List[Color], result_count: int = 5,
            temperature: float = 1000., cooling_rate: float = 0.99, cutoff: float = .0001,
            objective_function: Callable = obj_fn,
-           verbose: bool = True) -> List[Color]:
+           verbose: bool = True,
+           rng: Optional[np.random.RandomState] = None,
+           initial_colors: Optional[List[Color]] = None,
+           batch_size: int = 1,
+           max_seconds: Optional[float] = None, max_evaluations: Optional[int] = None,
+           plateau_sweeps: Optional[int] = None, plateau_tolerance: float = 1e-3,
+           adaptive_cooling: bool = False,
+           callback: Optional[Callable[[SweepStats], Optional[bool]]] = None,
+           timings: Optional[Timings] = None,
+           weights: Optional[Dict[str, float]] = None,
+           metric_schedule: Optional[List[Tuple[float, str]]] = None,
+           polish_sweeps: int = 0,
+           large_palette: Optional[bool] = None,
+           moves: Optional[Moves] = None) -> List[Color]:
     """
     A simulated annealing hill climbing algorithm that attempts to minimize the distance from
     the input colors and random set of colors as measured by the objective_function
@@ -71,50 +278,94 @@ def anneal(input_colors: List[Color], result_count: int = 5,
         cooling_rate: decrease in temperature at each iteration. A lower cooling rate will result in more iterations.
         cutoff:       temperature at which the algorithm will stop optimizing and return results
         objective_function: the objective function with which to measure success. Defaults to obj_fn
-                            requires a target_colors parameter to accept the goal state
+                            requires a target_colors parameter to accept the goal state.
+                            obj_fn itself is evaluated incrementally, see objective.IncrementalObjective
         verbose: print out the current temperature and cost?
                  Also prints out the (target, starting, final) color lists and (starting, final, difference) costs
+        rng: The random state to draw from, e.g. np.random.RandomState(seed). Defaults to the global numpy one
+        initial_colors: start from these colors instead of result_count random ones
+        batch_size: How many candidate moves to score in one vectorized objective call for each color,
+                    trading sweeps for batch width. See run_schedule
+        max_seconds: wall-clock budget in seconds
+        max_evaluations: budget of objective evaluations
+        plateau_sweeps: stop early once the best cost has improved by no more than plateau_tolerance
+                        over this many sweeps
+        plateau_tolerance: see plateau_sweeps
+        adaptive_cooling: cool down faster while nearly every move is accepted. See run_schedule
+        callback: Called with the SweepStats (temperature, cost, acceptance rate, evaluations, timings)
+                  of every sweep. Returning True stops the run early
+        timings: An objective.Timings to collect the time spent in the Brettel simulation, the Lab
+                 conversion and ΔE into. Leave out to run without the timing overhead
+        weights: Overrides for the obj_fn weights, see objective.DEFAULT_WEIGHTS
+        metric_schedule: Cheaper color differences to measure obj_fn with while it's hot, as
+                         (temperature, metric) pairs: measure with metric until the temperature has fallen
+                         to temperature, e.g. [(1., 'oklab')]. Below the lowest one, CIEDE2000 is used.
+                         See metrics.METRICS and COARSE_TO_FINE
+        polish_sweeps: Finish with this many greedy sweeps from the best state, measured with CIEDE2000
+        large_palette: Estimate moves from a sample of the other colors, for palettes of hundreds of colors.
+                       See make_objective. Defaults to result_count >= objective.LARGE_PALETTE_SIZE
+        moves: How colors are moved, e.g. moves.OKLabMoves() for perceptually even, gamut-aware steps.
+               Defaults to moves.RGBMoves. Its acceptance statistics are kept up to date
 
     Side Effect:
         If verbose, prints to the console
 
     Returns:
-        A list of the final resulting colors (in Color objects)
+        A list of the best colors found (in Color objects). Stops early, returning the best so far,
+        when a budget runs out or the cost plateaus
     """
     # get a random set of initial colors
-    colors = [Color.random_color() for _ in range(result_count)]
+    if initial_colors is None:
+        colors = Palette.random(result_count, rng)
+    else:
+        colors = Palette.from_colors(initial_colors)
 
-    # set the objective function
-    obj_fn = curry(objective_function, target_colors=input_colors)
+    # (cutoff, metric) phases, hottest first
+    phases = sorted(metric_schedule or [], key=lambda phase: -phase[0]) + [(cutoff, 'ciede2000')]
+    objective = make_objective(colors, input_colors, objective_function, timings, weights, phases[0][1],
+                               large_palette, rng)
 
     start_colors = colors.copy()
-    start_cost = obj_fn(colors)
-
-    while temperature > cutoff:
-        for i in range(len(colors)):
-            # copy colors
-            new_colors = colors.copy()
-            # move the current color randomly
-            new_colors[i] = new_colors[i].nearby_color()
-            # get objective function difference
-            delta = obj_fn(new_colors) - obj_fn(colors)
-            # choose between current and new state
-            probability = np.exp(-delta / temperature)
-            if np.random.rand() < probability:
-                colors[i] = new_colors[i]
+    start_cost = objective.cost
 
-        if verbose:
-            print(f"current cost:\t\t{obj_fn(colors)}")
-            print(f"current temperature:\t{temperature}")
+    start = time.perf_counter()
+    evaluations = 0
 
-        temperature *= cooling_rate
+    def budgets():
+        # what's left of the budgets, shared by all phases
+        return {'max_seconds': None if max_seconds is None else max_seconds - (time.perf_counter() - start),
+                'max_evaluations': None if max_evaluations is None else max_evaluations - evaluations}
 
-    final_cost = obj_fn(colors)
+    for phase_cutoff, metric in phases:
+        if objective.metric != metric:
+            objective.set_metric(metric)
+        result = run_schedule(objective, temperature, cooling_rate, max(phase_cutoff, cutoff), rng, verbose,
+                              batch_size=batch_size, plateau_sweeps=plateau_sweeps,
+                              plateau_tolerance=plateau_tolerance, adaptive_cooling=adaptive_cooling,
+                              callback=callback, moves=moves, **budgets())
+        temperature = result.temperature
+        evaluations += result.evaluations
+        # a cheaper metric's plateau moves on to the next one
+        if result.stop_reason not in ('cutoff', 'plateau'):
+            break
+
+    best_state, final_cost = result.best_state, result.best_cost
+    if objective.metric != 'ciede2000' or polish_sweeps:
+        objective = make_objective(Palette(best_state), input_colors, objective_function, timings, weights,
+                                   large_palette=large_palette, rng=rng)
+        best_state, final_cost = objective.rgb.copy(), objective.cost
+
+    if polish_sweeps and result.stop_reason in ('cutoff', 'plateau'):
+        result = run_schedule(objective, cutoff, 1., 0., rng, verbose, max_sweeps=polish_sweeps,
+                              batch_size=batch_size, callback=callback, moves=moves, **budgets())
+        best_state, final_cost = result.best_state, result.best_cost
+
+    colors = Palette(best_state).to_colors()
 
     if verbose:
         print(dedent(f"""
                       Original Colors:\t{hex_list(input_colors)}
-                      Starting Colors:\t{hex_list(start_colors)}
+                      Starting Colors:\t{start_colors.hex}
                       Final Colors:\t\t{hex_list(colors)}
                       Starting Cost:\t\t{start_cost}
                       Final Cost:\t\t{final_cost}
@@ -122,3 +373,101 @@ def anneal(input_colors: List[Color], result_count: int = 5,
                       """))
 
     return colors
+
+
+def _anneal_segment(input_colors: List[Color], state: np.ndarray, objective_function: Callable,
+                    temperature: float, cooling_rate: float, cutoff: float,
+                    rng: np.random.RandomState, max_sweeps: Optional[int], batch_size: int,
+                    weights: Optional[Dict[str, float]], max_seconds: Optional[float] = None,
+                    max_evaluations: Optional[int] = None) -> Tuple[np.ndarray, float, np.random.RandomState, int, bool,
+                                                                    np.ndarray, float]:
+    """
+    Runs (part of) an annealing schedule in a worker process for anneal_many
+
+    Returns:
+        The (state, temperature, rng) to continue from, the evaluations made, whether a budget ran out and the
+        (state, cost) of the best state the segment saw
+    """
+    objective = make_objective(Palette(state), input_colors, objective_function, weights=weights, rng=rng)
+    result = run_schedule(objective, temperature, cooling_rate, cutoff, rng,
+                          max_sweeps=max_sweeps, batch_size=batch_size, max_seconds=max_seconds,
+                          max_evaluations=max_evaluations)
+    exhausted = result.stop_reason in ('max_seconds', 'max_evaluations')
+    return (objective.rgb, result.temperature, rng, result.evaluations, exhausted, result.best_state,
+            float(result.best_cost))
+
+
+def anneal_many(input_colors: List[Color], result_count: int = 5, restarts: Optional[int] = None,
+                top_k: int = 1, seed: Optional[int] = None, workers: Optional[int] = None,
+                cull_margin: Optional[float] = None, cull_every: int = 100,
+                temperature: float = 1000., cooling_rate: float = 0.99, cutoff: float = .0001,
+                objective_function: Callable = obj_fn, batch_size: int = 1,
+                weights: Optional[Dict[str, float]] = None, max_seconds: Optional[float] = None,
+                max_evaluations: Optional[int] = None) -> List[Tuple[float, List[Color]]]:
+    """
+    Runs independent anneal restarts on a process pool and keeps the best results.
+    Each restart draws from its own random stream, spawned from seed
+
+    Usage:
+        > cost, colors = anneal_many(target_colors, restarts=8, seed=0)[0]
+
+    Args:
+        input_colors: A list of target colors to optimize toward
+        result_count: How many colors each result has
+        restarts: How many independent runs to make. Defaults to the number of cores
+        top_k: How many of the best results to return
+        seed: Seeds the random streams of the restarts, for reproducible results
+        workers: The number of worker processes. Defaults to the number of cores
+        cull_margin: If given, every cull_every sweeps drop the restarts whose cost trails the best by more than this
+        cull_every: How many sweeps the restarts run between culls
+        temperature, cooling_rate, cutoff: The annealing schedule, see anneal
+        objective_function: see anneal. Has to be picklable (i.e. a module level function)
+        batch_size: see anneal
+        weights: see anneal
+        max_seconds: wall-clock budget in seconds for the whole call
+        max_evaluations: budget of objective evaluations for each restart
+
+    Returns:
+        Up to top_k (cost, colors) tuples, best first
+    """
+    restarts = os.cpu_count() if restarts is None else restarts
+    streams = np.random.SeedSequence(seed).spawn(restarts)
+    rngs = [np.random.RandomState(np.random.MT19937(s)) for s in streams]
+
+    # (state, temperature, rng, evaluations, exhausted) to continue each restart from, and the (cost, state) of
+    # the best state it has seen, which is what it is ranked and returned by
+    runs = [(Palette.random(result_count, rng).srgb, temperature, rng, 0, False) for rng in rngs]
+    best = [(np.inf, None)] * restarts
+    max_sweeps = None if cull_margin is None else cull_every
+    deadline = None if max_seconds is None else time.perf_counter() + max_seconds
+
+    finished, culled = set(), set()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        active = list(range(restarts))
+        while active:
+            # what's left of the budgets: the time for all restarts, the evaluations for each one
+            seconds = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            futures = {i: executor.submit(_anneal_segment, input_colors, runs[i][0], objective_function,
+                                          runs[i][1], cooling_rate, cutoff, runs[i][2], max_sweeps, batch_size,
+                                          weights, seconds,
+                                          None if max_evaluations is None else max_evaluations - runs[i][3])
+                       for i in active}
+            for i, future in futures.items():
+                state, segment_temperature, rng, evaluations, exhausted, best_state, best_cost = future.result()
+                runs[i] = (state, segment_temperature, rng, runs[i][3] + evaluations, exhausted)
+                if best_cost < best[i][0]:
+                    best[i] = (best_cost, best_state)
+
+            finished |= {i for i in active if runs[i][1] <= cutoff or runs[i][4]}
+            active = [i for i in active if i not in finished]
+
+            if cull_margin is not None and active:
+                ranked = sorted((i for i in range(restarts) if i not in culled), key=lambda i: best[i][0])
+                best_cost = best[ranked[0]][0]
+                # never cull below the number of results asked for
+                keep = set(ranked[:top_k])
+                culled |= {i for i in active if i not in keep and best[i][0] > best_cost + cull_margin}
+                active = [i for i in active if i not in culled]
+
+    results = [(best[i][0], Palette(best[i][1]).to_colors()) for i in range(restarts) if i not in culled]
+    return sorted(results, key=lambda result: result[0])[:top_k]
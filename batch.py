@@ -0,0 +1,137 @@
+# Batch mode: extends a stream of palettes, one JSON object per line, on a pool of worker processes.
+#
+# Each job line looks like
+#
+#     {"id": "customer-42", "colors": ["#00798c", "#d1495b"], "result_count": 5, "seed": 0,
+#      "weights": {"Target": 2}, "max_evaluations": 20000}
+#
+# where only "colors" is required. Results are written as soon as they finish, so in completion rather than
+# input order, one line per job: {"id", "line", "input", "colors", "cost"}, or {"id", "line", "error"} for a job
+# that failed. Only a bounded number of jobs is read ahead, so memory stays flat for any number of jobs.
+#
+#     > python cli.py batch jobs.jsonl --output results.jsonl
+#     > cat jobs.jsonl | python cli.py batch --workers 8 --lut ~/.cache/color_generator/lut
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, IO, Iterable, Iterator, Optional, Set, Tuple
+
+from cli import extend_palette
+
+# the worker's cache.ResultCache and whether to warm start from it, set up by _init_worker
+_cache = None
+_warm_start = False
+
+# the job keys passed on to cli.extend_palette. restarts are left out: jobs already run in parallel
+JOB_KEYS = ('result_count', 'seed', 'weights', 'batch_size', 'max_seconds', 'max_evaluations')
+
+
+def _init_worker(lut_directory: Optional[str], cache_directory: Optional[str] = None, warm_start: bool = False):
+    """
+    Runs once in each worker process, so shared state is loaded per worker instead of per job
+    """
+    global _cache, _warm_start
+    if lut_directory:
+        import lut
+        lut.enable(lut_directory)
+    if cache_directory:
+        from cache import ResultCache
+        _cache, _warm_start = ResultCache(cache_directory), warm_start
+
+
+def run_job(job: Dict) -> Dict:
+    """
+    Extends a single palette
+
+    Args:
+        job: A parsed job line, see the top of this module
+
+    Returns:
+        The result line for the job
+    """
+    unknown = set(job) - set(JOB_KEYS) - {'id', 'line', 'colors'}
+    if unknown:
+        raise ValueError(f"Unknown job keys: {', '.join(sorted(unknown))}")
+    if not job.get('colors'):
+        raise ValueError("A job needs a non-empty list of 'colors'")
+
+    result = extend_palette(job['colors'], cache=_cache, warm_start=_warm_start,
+                            **{key: job[key] for key in JOB_KEYS if key in job})
+    return {'id': job.get('id'), 'line': job.get('line'), **result}
+
+
+def _error(job: Dict, error: BaseException) -> Dict:
+    return {'id': job.get('id'), 'line': job.get('line'), 'error': f'{type(error).__name__}: {error}'}
+
+
+def _jobs(lines: Iterable[str]) -> Iterator[Tuple[Dict, Optional[ValueError]]]:
+    """
+    Parses job lines lazily, numbering them from 1. Lines that aren't a JSON object come with their error,
+    so they get reported rather than stopping the batch
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError('A job must be a JSON object')
+        except ValueError as e:
+            yield {'line': number}, e
+            continue
+        yield {**job, 'line': number}, None
+
+
+def run_batch(lines: Iterable[str], output: IO[str], workers: Optional[int] = None,
+              max_pending: Optional[int] = None, lut_directory: Optional[str] = None,
+              cache_directory: Optional[str] = None, warm_start: bool = False) -> int:
+    """
+    Runs every job in lines and writes the results to output as they finish
+
+    Args:
+        lines: The job lines, e.g. an open file or sys.stdin
+        output: Where to write the result lines
+        workers: How many worker processes to run, defaults to the number of CPUs
+        max_pending: How many jobs to have read ahead at most, defaults to twice the workers
+        lut_directory: If given, each worker uses the lookup tables in this directory, see lut.py
+        cache_directory: If given, each worker reuses and stores results in this directory, see cache.py
+        warm_start: see cli.extend_palette
+
+    Returns:
+        The number of jobs that failed
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max(max_pending or 2 * workers, 1)
+    failures = 0
+
+    def write(result: Dict):
+        nonlocal failures
+        failures += 'error' in result
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+
+    def drain(pending: Set[Future], jobs: Dict[Future, Dict], until: int) -> Set[Future]:
+        while len(pending) > until:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = jobs.pop(future)
+                try:
+                    write(future.result())
+                except Exception as e:
+                    write(_error(job, e))
+        return pending
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(lut_directory, cache_directory, warm_start)) as executor:
+        pending, jobs = set(), {}
+        for job, error in _jobs(lines):
+            if error is not None:
+                write(_error(job, error))
+                continue
+            future = executor.submit(run_job, job)
+            pending.add(future)
+            jobs[future] = job
+            pending = drain(pending, jobs, max_pending - 1)
+        drain(pending, jobs, 0)
+
+    return failures
@@ -0,0 +1,301 @@
+# Benchmarks for the color conversion, CVD simulation, ΔE and annealing hot paths.
+#
+# Runs headless and offline (plotting is never imported). Prints one JSON object per (case, size) so runs on
+# different versions can be compared:
+#
+#     > python benchmark.py --output before.jsonl
+#     > python benchmark.py --output after.jsonl
+#     > python benchmark.py --compare before.jsonl after.jsonl
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from typing import Callable, Dict, Iterator, List
+
+from annealing import COARSE_TO_FINE, anneal, obj_fn
+from bretel import Brettel, corrected_color_distances, simulate
+from color import Color, average_color_distances_from_target
+from moves import OKLabMoves, RGBMoves
+from target_index import TargetIndex
+
+DEFAULT_SIZES = [5, 10, 20, 50, 100, 200]
+TARGET_HEX = ['#00798c', '#d1495b', '#edae49', '#66a182', '#2e4057']
+
+
+def _random_rgb(size: int, seed: int) -> np.ndarray:
+    return np.random.RandomState(seed).choice(range(1, 256), (size, 3))
+
+
+def color_construction(size: int, seed: int) -> Callable:
+    rgb = _random_rgb(size, seed)
+    return lambda: [Color(*c) for c in rgb]
+
+
+def brettel_scalar(size: int, seed: int) -> Callable:
+    rgb = _random_rgb(size, seed)
+    return lambda: [Brettel(c) for c in rgb]
+
+
+def brettel_vectorized(size: int, seed: int) -> Callable:
+    rgb = _random_rgb(size, seed)
+    return lambda: simulate(rgb, ['Protanopia', 'Deuteranopia', 'Tritanopia'])
+
+
+def corrected_distances(size: int, seed: int) -> Callable:
+    colors = [Color(*c) for c in _random_rgb(size, seed)]
+    return lambda: corrected_color_distances(colors, 'Protanopia')
+
+
+def target_distances(size: int, seed: int) -> Callable:
+    colors = [Color(*c) for c in _random_rgb(size, seed)]
+    targets = [Color.from_hex(h) for h in TARGET_HEX]
+    return lambda: average_color_distances_from_target(colors, targets)
+
+
+def large_targets(size: int, seed: int) -> Callable:
+    # size is the number of targets here. The index is built once, like IncrementalObjective does, and only
+    # queried in the loop. It scans exactly up to target_index.INDEX_THRESHOLD targets
+    lab = np.array([Color(*c).lab for c in _random_rgb(16, seed)])
+    index = TargetIndex([Color(*c).lab for c in _random_rgb(size, seed + 1)])
+    return lambda: index.distances(lab)
+
+
+def objective(size: int, seed: int) -> Callable:
+    colors = [Color(*c) for c in _random_rgb(size, seed)]
+    targets = [Color.from_hex(h) for h in TARGET_HEX]
+    return lambda: obj_fn(colors, targets)
+
+
+def anneal_run(size: int, seed: int, evaluations: int = 500) -> Callable:
+    targets = [Color.from_hex(h) for h in TARGET_HEX]
+    return lambda: anneal(targets, result_count=size, verbose=False,
+                          rng=np.random.RandomState(seed), max_evaluations=evaluations)
+
+
+def startup(repeats: int = 5) -> Dict[str, float]:
+    """
+    Measures how long a fresh interpreter takes to import the command-line entry point, best of repeats
+
+    Returns:
+        A dict of seconds, the target from cli.py and whether it was met
+    """
+    from cli import STARTUP_TARGET_SECONDS
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import cli'], cwd=here, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {'seconds': best, 'target_seconds': STARTUP_TARGET_SECONDS, 'within_target': best <= STARTUP_TARGET_SECONDS}
+
+
+def metric_schedule(seeds: int = 8, cooling_rate: float = 0.95) -> Iterator[Dict]:
+    """
+    Runs full anneal schedules measured with CIEDE2000 throughout and with COARSE_TO_FINE, from the same seeds
+
+    Yields:
+        A dict per schedule of the mean seconds per run and the mean and median final CIEDE2000 cost
+    """
+    targets = [Color.from_hex(h) for h in TARGET_HEX]
+    for name, metric_schedule in [('ciede2000', None), ('coarse_to_fine', COARSE_TO_FINE)]:
+        seconds, costs = [], []
+        for seed in range(seeds):
+            start = time.perf_counter()
+            colors = anneal(targets, verbose=False, rng=np.random.RandomState(seed), cooling_rate=cooling_rate,
+                            metric_schedule=metric_schedule)
+            seconds.append(time.perf_counter() - start)
+            costs.append(obj_fn(colors, targets))
+        yield {'schedule': name, 'seconds': float(np.mean(seconds)), 'cost': float(np.mean(costs)),
+               'median_cost': float(np.median(costs)), 'seeds': seeds}
+
+
+def move_generators(seeds: int = 4) -> Iterator[Dict]:
+    """
+    Runs full anneal schedules with RGB moves and with OKLab moves, the latter also cooling three times as fast,
+    from the same seeds
+
+    Yields:
+        A dict per (moves, cooling rate) of the mean seconds and evaluations per run, the mean and median
+        final cost and the acceptance rate
+    """
+    targets = [Color.from_hex(h) for h in TARGET_HEX]
+    for name, make_moves, cooling_rate in [('rgb', RGBMoves, 0.99), ('oklab', OKLabMoves, 0.99),
+                                           ('oklab', OKLabMoves, 0.97)]:
+        seconds, evaluations, costs, acceptance = [], [], [], []
+        for seed in range(seeds):
+            moves = make_moves()
+            start = time.perf_counter()
+            colors = anneal(targets, verbose=False, rng=np.random.RandomState(seed), cooling_rate=cooling_rate,
+                            moves=moves)
+            seconds.append(time.perf_counter() - start)
+            evaluations.append(moves.proposals)
+            costs.append(obj_fn(colors, targets))
+            acceptance.append(moves.acceptance_rate)
+        yield {'moves': name, 'cooling_rate': cooling_rate, 'seconds': float(np.mean(seconds)),
+               'evaluations': float(np.mean(evaluations)),
+               'cost': float(np.mean(costs)), 'median_cost': float(np.median(costs)),
+               'acceptance_rate': float(np.mean(acceptance)), 'seeds': seeds}
+
+
+def tempering(seeds: int = 4) -> Iterator[Dict]:
+    """
+    Runs anneal (one chain, OKLab moves, cooling three times as fast) and temper (16 replicas) from the same seeds
+
+    Yields:
+        A dict per engine of the mean seconds and evaluations per run, evaluations per second and the mean
+        and median final cost
+    """
+    from tempering import temper
+
+    targets = [Color.from_hex(h) for h in TARGET_HEX]
+    engines = [('anneal', lambda rng, moves: anneal(targets, verbose=False, rng=rng, cooling_rate=0.97, moves=moves)),
+               ('temper', lambda rng, moves: temper(targets, verbose=False, rng=rng, moves=moves))]
+    for name, engine in engines:
+        evaluations, seconds, costs = [], [], []
+        for seed in range(seeds):
+            moves = OKLabMoves()
+            start = time.perf_counter()
+            colors = engine(np.random.RandomState(seed), moves)
+            seconds.append(time.perf_counter() - start)
+            evaluations.append(moves.proposals)
+            costs.append(obj_fn(colors, targets))
+        yield {'engine': name, 'seconds': float(np.mean(seconds)), 'evaluations': float(np.mean(evaluations)),
+               'evaluations_per_second': float(np.sum(evaluations) / np.sum(seconds)),
+               'cost': float(np.mean(costs)), 'median_cost': float(np.median(costs)), 'seeds': seeds}
+
+
+CASES = {
+    'color_construction': color_construction,
+    'brettel_scalar': brettel_scalar,
+    'brettel_vectorized': brettel_vectorized,
+    'corrected_color_distances': corrected_distances,
+    'average_color_distances_from_target': target_distances,
+    'large_target_palettes': large_targets,
+    'obj_fn': objective,
+    'anneal': anneal_run,
+    'startup': None,  # measured once, see startup
+    'metric_schedule': None,  # measured once, see metric_schedule
+    'moves': None,  # measured once, see move_generators
+    'tempering': None,  # measured once, see tempering
+}
+
+
+def measure(function: Callable, min_time: float = 0.2, repeats: int = 3) -> Dict[str, float]:
+    """
+    Times function like timeit: enough calls to fill min_time, best of repeats. Then measures the
+    peak memory traced during a single call
+
+    Returns:
+        A dict of seconds per call, calls per second and peak memory in bytes
+    """
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or calls >= 1 << 16:
+            break
+        calls *= 2
+
+    best = elapsed / calls
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        best = min(best, (time.perf_counter() - start) / calls)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': best, 'per_second': 1 / best, 'peak_bytes': peak}
+
+
+def run(cases: List[str], sizes: List[int], seed: int = 0, min_time: float = 0.2) -> Iterator[Dict]:
+    """
+    Runs the benchmark cases at every size
+
+    Yields:
+        One result dict per (case, size)
+    """
+    environment = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine()}
+    for case in cases:
+        if case == 'startup':
+            yield {'case': case, 'size': 0, **startup(), **environment}
+            continue
+        if case == 'metric_schedule':
+            for result in metric_schedule():
+                yield {'case': f"{case}[{result['schedule']}]", 'size': 0, **result, **environment}
+            continue
+        if case == 'moves':
+            for result in move_generators():
+                yield {'case': f"{case}[{result['moves']}@{result['cooling_rate']}]", 'size': 0, **result,
+                       **environment}
+            continue
+        if case == 'tempering':
+            for result in tempering():
+                yield {'case': f"{case}[{result['engine']}]", 'size': 0, **result, **environment}
+            continue
+        for size in sizes:
+            result = measure(CASES[case](size, seed), min_time=min_time)
+            yield {'case': case, 'size': size, 'seed': seed, **result,
+                   'colors_per_second': size * result['per_second'], **environment}
+
+
+def compare(before_path: str, after_path: str):
+    """
+    Prints the speedup and memory change of every (case, size) found in both result files, and the difference in
+    final cost of the cases that measure one. A column is left blank where either file lacks its metric, e.g.
+    rows written before a case recorded seconds
+    """
+    def load(path):
+        with open(path) as f:
+            return {(r['case'], r['size']): r for r in map(json.loads, f) if r}
+
+    def ratio(numerator, denominator):
+        if numerator is None or denominator is None:
+            return f"{'-':>10}"
+        return f"{numerator / max(denominator, 1e-12):>9.2f}x"
+
+    before, after = load(before_path), load(after_path)
+    print(f"{'case':<40}{'size':>6}{'speedup':>10}{'memory':>10}{'cost':>10}")
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        speedup = ratio(old.get('seconds'), new.get('seconds'))
+        memory = ratio(new.get('peak_bytes'), old.get('peak_bytes'))
+        # costs can be negative, so their change is a difference rather than a ratio
+        cost = f"{new['cost'] - old['cost']:>+10.2f}" if 'cost' in old and 'cost' in new else f"{'-':>10}"
+        print(f"{key[0]:<40}{key[1]:>6}{speedup}{memory}{cost}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the color generator hot paths')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds to fill per timing repeat')
+    parser.add_argument('--output', help='write the JSON lines here as well as to stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    output = open(args.output, 'w') if args.output else None
+    for result in run(args.cases, args.sizes, args.seed, args.min_time):
+        line = json.dumps(result)
+        print(line, flush=True)
+        if output:
+            output.write(line + '\n')
+    if output:
+        output.close()
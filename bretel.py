@@ -4,10 +4,10 @@
 # In turn adapted from libDaltonLens https://daltonlens.org (public domain)
 import logging
 import numpy as np
-from itertools import combinations
-from typing import List
+from typing import Dict, Iterable, List, Optional, Union
 
-from color import Color, color_distance
+from color import Color, rgb_key, rgb_to_lab
+from color_diff import delta_e_cie2000_matrix
 
 
 def sRGB_to_lRGB(sRGB: float) -> float:
@@ -51,6 +51,41 @@ def lRGB_to_sRGB(lRGB: float) -> float:
         return 255 * (lRGB ** (1.0 / 2.4))
 
 
+def sRGB_to_lRGB_array(sRGB: np.ndarray) -> np.ndarray:
+    """
+    Vectorized sRGB_to_lRGB. Applies the same curve element-wise to an array of any shape
+
+    Args:
+        sRGB: An array of sRGB values in [0, 255], e.g. an (N, 3) array of colors
+
+    Returns:
+        An array of the same shape in lRGB format in [0, 1]
+    """
+    fv = np.asarray(sRGB, dtype=float) / 255.
+    return np.where(fv < 0.0404482362771082,
+                    fv / 12.92,
+                    ((np.maximum(fv, 0.0404482362771082) + 0.055) / 1.055) ** 2.4)
+
+
+def lRGB_to_sRGB_array(lRGB: np.ndarray) -> np.ndarray:
+    """
+    Vectorized lRGB_to_sRGB. Applies the same curve element-wise to an array of any shape
+
+    Args:
+        lRGB: An array of lRGB values in [0, 1], e.g. an (N, 3) array of colors
+
+    Returns:
+        An array of the same shape in sRGB format in [0, 255]
+    """
+    lRGB = np.asarray(lRGB, dtype=float)
+    sRGB = np.where(lRGB <= 0.00313066844250063,
+                    0.5 + lRGB * 12.92 * 255,
+                    255 * np.clip(lRGB, 0, 1) ** (1.0 / 2.4))
+    sRGB[lRGB <= 0] = 0
+    sRGB[lRGB >= 1] = 255
+    return sRGB
+
+
 def monochrome_with_severity(sRGB: List[float], severity: float) -> List[float]:
     """
     Adjusts given sRGB R, G, B values to account for monochrome color blindness
@@ -69,6 +104,22 @@ def monochrome_with_severity(sRGB: List[float], severity: float) -> List[float]:
     return [r, g, b]
 
 
+def monochrome_with_severity_array(sRGB: np.ndarray, severity: float) -> np.ndarray:
+    """
+    Vectorized monochrome_with_severity
+
+    Args:
+        sRGB: An (..., 3) array of colors in sRGB format [0, 255]
+        severity: A float in [0, 1] representing the severity of condition to account for
+
+    Returns:
+        An (..., 3) array of updated colors in sRGB space [0, 255]
+    """
+    sRGB = np.asarray(sRGB, dtype=float)
+    z = np.round(sRGB @ np.array([0.299, 0.587, 0.114]))
+    return z[..., None] * severity + (1. - severity) * sRGB
+
+
 class Brettel:
 
     BRETTEL_PARAMS = {
@@ -146,6 +197,108 @@ class Brettel:
         return [lRGB_to_sRGB(v) for v in rgb_cvd]
 
 
+# the deficiency type and severity behind each of the Brettel vision space attributes
+VISION_SPACES = {
+    'Normal': (None, 0.),
+    'Protanopia': ('protan', 1.0),
+    'Protanomaly': ('protan', 0.6),
+    'Deuteranopia': ('deutan', 1.0),
+    'Deuteranomaly': ('deutan', 0.6),
+    'Tritanopia': ('tritan', 1.0),
+    'Tritanomaly': ('tritan', 0.6),
+    'Achromatopsia': ('achroma', 1.0),
+    'Achromatomaly': ('achroma', 0.6),
+    }
+
+# BRETTEL_PARAMS as arrays: (projection matrix 1, projection matrix 2, separation plane normal)
+_BRETTEL_MATRICES = {
+    cb_type: (np.reshape(params['rgb_cvd_from_rgb1'], (3, 3)),
+              np.reshape(params['rgb_cvd_from_rgb2'], (3, 3)),
+              np.array(params['separation_plane_normal']))
+    for cb_type, params in Brettel.BRETTEL_PARAMS.items()}
+
+
+def brettel_array(lRGB: np.ndarray, cb_type: str, severity: float) -> np.ndarray:
+    """
+    Vectorized Brettel.brettel, working on linear RGB so the gamma curve can be shared between types
+
+    Args:
+        lRGB: An (..., 3) array of colors in lRGB format [0, 1]
+        cb_type: color blindness type to account for
+        severity: the severity of the color blindness to account for
+
+    Returns:
+        An (..., 3) array of colors in sRGB space [0, 255] transformed to account for the color blindness type
+    """
+    rgb_cvd_from_rgb1, rgb_cvd_from_rgb2, separation_plane_normal = _BRETTEL_MATRICES[cb_type]
+
+    # pick the projection plane per color, then project every color onto both and select with the mask
+    on_first_plane = (lRGB @ separation_plane_normal) >= 0
+    rgb_cvd = np.where(on_first_plane[..., None], lRGB @ rgb_cvd_from_rgb1.T, lRGB @ rgb_cvd_from_rgb2.T)
+
+    # apply the severity factor as a linear interpolation
+    rgb_cvd = rgb_cvd * severity + lRGB * (1.0 - severity)
+
+    return lRGB_to_sRGB_array(rgb_cvd)
+
+
+# rgb_key -> simulated sRGB lookup tables by vision space, installed by lut.enable
+_cvd_tables = {}
+
+
+def use_cvd_tables(tables: Dict[str, np.ndarray]):
+    """
+    Installs lookup tables for simulate, replacing any installed before. See lut.py
+    """
+    global _cvd_tables
+    _cvd_tables = dict(tables)
+
+
+def simulate(sRGB: np.ndarray, vision_spaces: Union[str, Iterable[str]],
+             use_tables: bool = True, lRGB: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    Simulates a whole palette in one or more vision spaces at once. Only the requested spaces are computed
+
+    Usage:
+        > simulate(np.array([[255, 0, 0], [0, 0, 255]]), ['Protanopia', 'Tritanopia'])['Protanopia']
+
+    Args:
+        sRGB: An (N, 3) array of colors in sRGB format [0, 255]
+        vision_spaces: A Brettel attribute name, or several of them. See VISION_SPACES
+        use_tables: look the spaces up in the tables installed by lut.enable, where there is one.
+                    The lookup rounds colors to whole numbers first
+        lRGB: sRGB in linear RGB, if already known (e.g. looked up for 8-bit images)
+
+    Returns:
+        A dict of vision space -> (N, 3) array of simulated colors in sRGB space [0, 255]
+    """
+    if isinstance(vision_spaces, str):
+        vision_spaces = [vision_spaces]
+
+    sRGB = np.asarray(sRGB, dtype=float)
+    key = None
+    simulated = {}
+    for vision_space in vision_spaces:
+        try:
+            cb_type, severity = VISION_SPACES[vision_space]
+        except KeyError:
+            logging.warning(f'Expected attribute in Brettel class. Got {vision_space}')
+            raise
+        if use_tables and vision_space in _cvd_tables:
+            if key is None:
+                key = rgb_key(sRGB)
+            simulated[vision_space] = _cvd_tables[vision_space][key].astype(float)
+        elif cb_type is None:
+            simulated[vision_space] = sRGB
+        elif cb_type == 'achroma':
+            simulated[vision_space] = monochrome_with_severity_array(sRGB, severity)
+        else:
+            if lRGB is None:
+                lRGB = sRGB_to_lRGB_array(sRGB)
+            simulated[vision_space] = brettel_array(lRGB, cb_type, severity)
+    return simulated
+
+
 def corrected_color_distances(color_list: List[Color], vision_space = 'Normal') -> List[float]:
     """
     makes an array of distances between all points in a color list after applying the vision_space color transformation to it
@@ -158,14 +311,8 @@ def corrected_color_distances(color_list: List[Color], vision_space = 'Normal')
         A list of distances
     """
     # convert color space
-    try:
-        colors = [Color(*getattr(Brettel(c.rgb), vision_space)) for c in color_list]
-    except AttributeError:
-        logging.warning(f'Expected attribute in Brettel class. Got {vision_space}')
-        raise
-
-    # get combinations
-    color_combos = combinations(colors, 2)
+    simulated = simulate([c.rgb for c in color_list], vision_space)[vision_space]
+    lab = rgb_to_lab(np.clip(simulated, 0, 255))
 
-    # get distances between each combination of colors
-    return [color_distance(*c) for c in color_combos]
+    # get distances between each combination of colors, in itertools.combinations order
+    return delta_e_cie2000_matrix(lab).tolist()
@@ -0,0 +1,180 @@
+# Optional persistent cache of extended palettes.
+#
+# Results are stored in a SQLite database, keyed by a hash of everything that determines them: the normalized
+# input colors, result_count, objective weights, schedule parameters, seed and the lookup tables in use, if any
+# (lut.py rounds the simulated colors, so results with and without them differ). The least recently used results
+# are evicted once the stored results exceed a size limit.
+#
+# Usage:
+#     > cache = ResultCache()                      # or ResultCache(directory, max_bytes=...)
+#     > extend_palette(hex_colors, cache=cache)    # see cli.py
+#     > python cli.py extend '#00798c' '#d1495b' --cache ~/.cache/color_generator
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional
+
+import lut
+from color import hex_to_rgb, rgb_to_hex, rgb_to_lab
+from color_diff import delta_e_cie2000_cross
+from objective import DEFAULT_WEIGHTS
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'color_generator')
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# part of every key, bump it when a change to the annealing makes cached results stale
+CACHE_VERSION = 1
+
+
+class CachedResult(NamedTuple):
+    input: List[str]
+    colors: List[str]
+    cost: float
+
+
+def normalize_hex(hex_colors: List[str]) -> List[str]:
+    """
+    The canonical form of a palette for the cache: sorted lowercase '#rrggbb' values.
+    obj_fn doesn't depend on the order of the target colors, so neither does the key
+    """
+    return sorted(rgb_to_hex(np.array([hex_to_rgb(h) for h in hex_colors]).reshape(-1, 3)))
+
+
+def cache_key(hex_colors: List[str], result_count: int, weights: Optional[Dict[str, float]] = None,
+              seed: Optional[int] = None, **schedule) -> str:
+    """
+    The content address of an extension, in this process: the lookup tables it has installed are part of it
+
+    Args:
+        hex_colors: The palette to extend
+        result_count: How many colors are added
+        weights: Overrides for objective.DEFAULT_WEIGHTS
+        seed: The seed of the run
+        schedule: Any other parameters of the run, e.g. temperature, batch_size or max_evaluations
+
+    Returns:
+        A hex SHA-256 digest
+    """
+    content = {'version': CACHE_VERSION,
+               'input': normalize_hex(hex_colors),
+               'result_count': result_count,
+               'weights': {**DEFAULT_WEIGHTS, **(weights or {})},
+               'seed': seed,
+               'lut': lut.fingerprint(),
+               'schedule': schedule}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        A size-limited, least recently used cache of extension results in directory/results.sqlite.
+        Safe to share between processes, but open one ResultCache per process
+
+        Args:
+            directory: Where to keep the database
+            max_bytes: How much result data to keep before evicting the least recently used results
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'results.sqlite')
+        self.max_bytes = max_bytes
+        self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                input TEXT NOT NULL,
+                result_count INTEGER NOT NULL,
+                colors TEXT NOT NULL,
+                cost REAL NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL)""")
+        self._connection.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS results_result_count ON results (result_count)')
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """
+        Looks up a result by its cache_key, marking it as recently used
+
+        Returns:
+            The cached result, or None on a miss
+        """
+        row = self._connection.execute('SELECT input, colors, cost FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self._connection.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+        return CachedResult(json.loads(row[0]), json.loads(row[1]), row[2])
+
+    def put(self, key: str, hex_colors: List[str], colors: List[str], cost: float):
+        """
+        Stores a result, then evicts the least recently used results until the cache fits in max_bytes
+
+        Args:
+            key: The cache_key of the result
+            hex_colors: The palette that was extended
+            colors: The added colors as hex values
+            cost: The objective value of the result
+        """
+        input_json, colors_json = json.dumps(normalize_hex(hex_colors)), json.dumps(list(colors))
+        size = len(key) + len(input_json) + len(colors_json)
+        self._connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (key, input_json, len(colors), colors_json, float(cost), size, time.time()))
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used results until the rest fit in max_bytes
+        """
+        total = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._connection.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._connection.executemany('DELETE FROM results WHERE key = ?', stale)
+
+    def closest(self, hex_colors: List[str], result_count: int, limit: int = 1000) -> Optional[CachedResult]:
+        """
+        The cached result with result_count colors whose input palette is perceptually closest to hex_colors,
+        to warm start a new run from. Palettes are compared by the average CIEDE2000 distance from each color
+        to the closest color of the other palette, both ways
+
+        Args:
+            hex_colors: The palette to extend
+            result_count: How many colors are added
+            limit: Only compare against this many of the most recently used results
+
+        Returns:
+            The closest result, or None if nothing with result_count colors is cached
+        """
+        rows = self._connection.execute(
+            'SELECT input, colors, cost FROM results WHERE result_count = ? ORDER BY accessed DESC LIMIT ?',
+            (result_count, limit)).fetchall()
+        if not rows:
+            return None
+
+        lab = rgb_to_lab(np.array([hex_to_rgb(h) for h in hex_colors]).reshape(-1, 3))
+        best, best_distance = None, np.inf
+        for input_json, colors_json, cost in rows:
+            cached = json.loads(input_json)
+            cached_lab = rgb_to_lab(np.array([hex_to_rgb(h) for h in cached]).reshape(-1, 3))
+            distances = delta_e_cie2000_cross(lab, cached_lab)
+            distance = np.mean(distances.min(axis=1)) + np.mean(distances.min(axis=0))
+            if distance < best_distance:
+                best, best_distance = CachedResult(cached, json.loads(colors_json), cost), distance
+        return best
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def clear(self):
+        self._connection.execute('DELETE FROM results')
+
+    def close(self):
+        self._connection.close()
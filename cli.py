@@ -0,0 +1,329 @@
+# Command-line entry point for extending palettes, e.g. on headless workers:
+#
+#     > python cli.py extend '#00798c' '#d1495b' '#edae49' --count 5 --seed 0 --format json
+#     > python cli.py batch jobs.jsonl --output results.jsonl
+#     > python cli.py simulate-image Examples/extended_line.png --output-dir out
+#     > python cli.py sweep '#00798c' '#d1495b' --weight Target=0.5,1,2 --weight Range=0,1
+#     > python cli.py ladder '#00798c' '#d1495b' --sizes 5 8 12 --seed 0
+#     > python cli.py render results.jsonl --output-dir previews
+#     > python cli.py serve --unix /tmp/palettes.sock --workers 4
+#
+# The extension path only imports NumPy. matplotlib is only imported to parse color names that aren't hex
+# values, colormath only for Color.lab_color, and plotting (matplotlib, seaborn, pandas) and rich only for
+# --plot and --show.
+import argparse
+import json
+import sys
+import numpy as np
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+from annealing import anneal, anneal_many, obj_fn
+from color import Color, hex_list
+
+if TYPE_CHECKING:
+    from cache import ResultCache
+
+# the anneal_kwargs of extend_palette that restarts pass on to anneal_many
+RESTART_KWARGS = ('batch_size', 'max_seconds', 'max_evaluations')
+
+# the schedule a warm start continues with, unless given: it only refines the cached colors, as in
+# growth.grow_objective. At anneal's default temperature nearly every move is accepted, which would
+# randomize them before the schedule cools
+WARM_START_SCHEDULE = {'temperature': 5., 'cooling_rate': 0.95, 'cutoff': .01}
+
+# what `python -c "import cli"` should stay under, see the startup case of benchmark.py
+STARTUP_TARGET_SECONDS = 0.5
+
+
+def extend_palette(hex_colors: List[str], result_count: int = 5, seed: Optional[int] = None,
+                   restarts: int = 1, weights: Optional[Dict[str, float]] = None,
+                   cache: Optional['ResultCache'] = None, warm_start: bool = False, **anneal_kwargs) -> Dict:
+    """
+    Extends a palette given as hex values
+
+    Args:
+        hex_colors: The palette to extend, e.g. ['#00798c', '#d1495b']
+        result_count: How many colors to add
+        seed: Seeds the annealing, for reproducible results
+        restarts: Run this many restarts in parallel (see annealing.anneal_many) and keep the best
+        weights: Overrides for the objective weights, see objective.DEFAULT_WEIGHTS
+        cache: If given, return the cached result for the same parameters, or store the new one, see cache.py
+        warm_start: On a cache miss, start from the colors of the cached result for the most similar palette
+                    instead of random ones, with the short WARM_START_SCHEDULE unless a schedule is given.
+                    The result depends on what was cached, so it isn't stored. Ignored for restarts, which
+                    start from random colors
+        anneal_kwargs: Passed on to anneal, e.g. batch_size or max_seconds. Restarts only take RESTART_KWARGS,
+                       max_seconds for all of them together and max_evaluations for each
+
+    Returns:
+        A dict with the 'input' and resulting 'colors' hex values and the 'cost' of the result
+    """
+    warm_started = False
+    if cache is not None:
+        from cache import cache_key
+        schedule = {name: hex_list(value) if name == 'initial_colors' else value
+                    for name, value in anneal_kwargs.items()}
+        key = cache_key(hex_colors, result_count, weights, seed, restarts=restarts, **schedule)
+        cached = cache.get(key)
+        if cached is not None:
+            return {'input': list(hex_colors), 'colors': cached.colors, 'cost': cached.cost}
+        if warm_start and restarts <= 1 and 'initial_colors' not in anneal_kwargs:
+            closest = cache.closest(hex_colors, result_count)
+            if closest is not None:
+                anneal_kwargs = {**WARM_START_SCHEDULE, **anneal_kwargs,
+                                 'initial_colors': [Color.from_hex(c) for c in closest.colors]}
+                warm_started = True
+
+    target_colors = [Color.from_hex(c) for c in hex_colors]
+    if restarts > 1:
+        unsupported = set(anneal_kwargs) - set(RESTART_KWARGS)
+        if unsupported:
+            raise ValueError(f"Not supported with restarts: {', '.join(sorted(unsupported))}")
+        cost, colors = anneal_many(target_colors, result_count, restarts=restarts, seed=seed, weights=weights,
+                                   **anneal_kwargs)[0]
+    else:
+        rng = None if seed is None else np.random.RandomState(seed)
+        colors = anneal(target_colors, result_count, verbose=False, rng=rng, weights=weights, **anneal_kwargs)
+        cost = obj_fn(colors, target_colors, weights)
+
+    result = {'input': list(hex_colors), 'colors': hex_list(colors), 'cost': float(cost)}
+    if cache is not None and not warm_started:
+        cache.put(key, hex_colors, result['colors'], result['cost'])
+    return result
+
+
+def _extend(args: argparse.Namespace):
+    if args.lut:
+        import lut
+        lut.enable(args.lut)
+
+    anneal_kwargs = {'batch_size': args.batch_size}
+    if args.max_seconds is not None:
+        anneal_kwargs['max_seconds'] = args.max_seconds
+    if args.max_evaluations is not None:
+        anneal_kwargs['max_evaluations'] = args.max_evaluations
+
+    cache = None
+    if args.cache:
+        from cache import ResultCache
+        cache = ResultCache(args.cache)
+
+    result = extend_palette(args.colors, args.count, args.seed, args.restarts, cache=cache,
+                            warm_start=args.warm_start, **anneal_kwargs)
+
+    if args.format == 'json':
+        print(json.dumps(result))
+    else:
+        print('\n'.join(result['colors']))
+
+    if args.show:
+        from console import terminal_palette
+        terminal_palette(result['input'], message="Here is the initial color palette!")
+        terminal_palette(result['colors'] + result['input'], message="Here is the updated color palette!")
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        from plotting import comparison_palette_plots, line_plot, palette_plot
+        combined_colors = result['colors'] + result['input']
+        line_plot(combined_colors)
+        palette_plot(combined_colors)
+        comparison_palette_plots(result['input'], result['colors'])
+        plt.show()
+
+
+def _batch(args: argparse.Namespace):
+    from batch import run_batch
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    output = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        run_batch(source, output, workers=args.workers, max_pending=args.max_pending, lut_directory=args.lut,
+                  cache_directory=args.cache, warm_start=args.warm_start)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+def _simulate_image(args: argparse.Namespace):
+    from image import output_paths, simulate_image
+
+    for source in args.images:
+        outputs = output_paths(source, args.spaces, args.output_dir, args.extension)
+        simulate_image(source, outputs, tile_pixels=args.tile_pixels, workers=args.workers, lut_directory=args.lut)
+        print('\n'.join(outputs.values()))
+
+
+def _render(args: argparse.Namespace):
+    from render import render_many
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    try:
+        # result lines of failed batch jobs have no colors to preview
+        palettes = (palette for palette in map(json.loads, filter(str.strip, source)) if palette.get('colors'))
+        for paths in render_many(palettes, args.output_dir, args.previews, workers=args.workers,
+                                 data_home=args.data_home, extension=args.extension, dpi=args.dpi):
+            print('\n'.join(paths.values()))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def _serve(args: argparse.Namespace):
+    import asyncio
+    from service import PaletteService
+
+    async def serve():
+        service = PaletteService(args.workers, args.max_jobs, args.max_client_jobs, args.progress_seconds,
+                                 lut_directory=args.lut)
+        await service.start(args.host, args.port, args.unix)
+        try:
+            await service.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def _weight_values(text: str):
+    from objective import DEFAULT_WEIGHTS
+
+    name, _, values = text.partition('=')
+    if name not in DEFAULT_WEIGHTS:
+        raise argparse.ArgumentTypeError(f"Unknown weight '{name}', expected one of {', '.join(DEFAULT_WEIGHTS)}")
+    try:
+        return name, [float(value) for value in values.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE[,VALUE...], got '{text}'")
+
+
+def _sweep(args: argparse.Namespace):
+    from sweep import sweep_weights, weight_grid
+
+    target_colors = [Color.from_hex(c) for c in args.colors]
+    results = sweep_weights(target_colors, weight_grid(**dict(args.weight)), args.count, args.seed,
+                            workers=args.workers, batch_size=args.batch_size,
+                            max_evaluations=args.max_evaluations, lut_directory=args.lut, pareto=not args.all)
+    for result in results:
+        print(json.dumps({'weights': result.weights, 'cost': result.cost, 'scores': result.scores,
+                          'colors': hex_list(result.colors)}))
+
+
+def _ladder(args: argparse.Namespace):
+    from growth import palette_ladder
+
+    if args.lut:
+        import lut
+        lut.enable(args.lut)
+
+    target_colors = [Color.from_hex(c) for c in args.colors]
+    rng = None if args.seed is None else np.random.RandomState(args.seed)
+    ladder = palette_ladder(target_colors, args.sizes, drift=args.drift, rng=rng, batch_size=args.batch_size)
+    for size, colors in ladder.items():
+        print(json.dumps({'size': size, 'colors': hex_list(colors), 'cost': float(obj_fn(colors, target_colors))}))
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Extend color palettes')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    extend = commands.add_parser('extend', help='extend a palette and print the new colors')
+    extend.add_argument('colors', nargs='+', help="the palette to extend, e.g. '#00798c' '#d1495b'")
+    extend.add_argument('-n', '--count', type=int, default=5, help='how many colors to add')
+    extend.add_argument('--seed', type=int)
+    extend.add_argument('--restarts', type=int, default=1, help='parallel restarts to keep the best of')
+    extend.add_argument('--batch-size', type=int, default=1, help='candidate moves scored per step')
+    extend.add_argument('--max-seconds', type=float, help='wall-clock budget for the annealing')
+    extend.add_argument('--max-evaluations', type=int, help='objective evaluation budget for the annealing')
+    extend.add_argument('--format', choices=['hex', 'json'], default='hex')
+    extend.add_argument('--lut', metavar='DIRECTORY', help='use the lookup tables in this directory, see lut.py')
+    extend.add_argument('--cache', metavar='DIRECTORY', help='reuse and store results in this directory, see cache.py')
+    extend.add_argument('--warm-start', action='store_true',
+                        help='on a cache miss, start from the cached result for the most similar palette')
+    extend.add_argument('--show', action='store_true', help='print the palettes in the terminal (needs rich)')
+    extend.add_argument('--plot', action='store_true', help='show example plots (needs a display)')
+    extend.set_defaults(run=_extend)
+
+    batch = commands.add_parser('batch', help='extend a JSON lines stream of palettes, see batch.py')
+    batch.add_argument('input', nargs='?', default='-', help='the JSON lines file of jobs, - for stdin')
+    batch.add_argument('-o', '--output', help='where to write the JSON lines results, defaults to stdout')
+    batch.add_argument('--workers', type=int, help='worker processes, defaults to the number of CPUs')
+    batch.add_argument('--max-pending', type=int, help='jobs in flight at once, defaults to twice the workers')
+    batch.add_argument('--lut', metavar='DIRECTORY', help='use the lookup tables in this directory, see lut.py')
+    batch.add_argument('--cache', metavar='DIRECTORY', help='reuse and store results in this directory, see cache.py')
+    batch.add_argument('--warm-start', action='store_true',
+                       help='on a cache miss, start from the cached result for the most similar palette')
+    batch.set_defaults(run=_batch)
+
+    simulate = commands.add_parser('simulate-image', help='simulate images in color vision deficiency spaces')
+    simulate.add_argument('images', nargs='+', help='PNG (or other Pillow readable) images, or uint8 .npy arrays')
+    simulate.add_argument('--spaces', nargs='+', default=['Protanopia', 'Deuteranopia', 'Tritanopia'],
+                          help='the vision spaces to simulate, see bretel.VISION_SPACES')
+    simulate.add_argument('--output-dir', help='where to write the results, defaults to next to each image')
+    simulate.add_argument('--extension', choices=['.png', '.npy'], default='.png', help='the output format')
+    simulate.add_argument('--tile-pixels', type=int, default=1 << 18, help='pixels to simulate at once')
+    simulate.add_argument('--workers', type=int, default=1, help='worker processes to simulate tiles on')
+    simulate.add_argument('--lut', metavar='DIRECTORY', help='use the lookup tables in this directory, see lut.py')
+    simulate.set_defaults(run=_simulate_image)
+
+    sweep = commands.add_parser('sweep', help='extend a palette under a grid of weights, see sweep.py')
+    sweep.add_argument('colors', nargs='+', help="the palette to extend, e.g. '#00798c' '#d1495b'")
+    sweep.add_argument('-w', '--weight', type=_weight_values, action='append', default=[], metavar='NAME=VALUES',
+                       help='comma separated values of a weight to try, e.g. Target=0.5,1,2. Repeatable')
+    sweep.add_argument('-n', '--count', type=int, default=5, help='how many colors to add')
+    sweep.add_argument('--seed', type=int)
+    sweep.add_argument('--workers', type=int, default=1, help='worker processes to split the weightings between')
+    sweep.add_argument('--batch-size', type=int, default=1, help='candidate moves scored per step')
+    sweep.add_argument('--max-evaluations', type=int, help='objective evaluation budget for each weighting')
+    sweep.add_argument('--lut', metavar='DIRECTORY', help='use the lookup tables in this directory, see lut.py')
+    sweep.add_argument('--all', action='store_true', help='print every result, not just the Pareto front')
+    sweep.set_defaults(run=_sweep)
+
+    ladder = commands.add_parser('ladder', help='extend a palette to several sizes, each grown from the last, '
+                                                'see growth.py')
+    ladder.add_argument('colors', nargs='+', help="the palette to extend, e.g. '#00798c' '#d1495b'")
+    ladder.add_argument('--sizes', type=int, nargs='+', required=True, help='how many colors to add, increasing')
+    ladder.add_argument('--drift', type=float, default=0.,
+                        help='how far the colors of each size may move per channel for the next one, 0 locks them')
+    ladder.add_argument('--seed', type=int)
+    ladder.add_argument('--batch-size', type=int, default=1, help='candidate moves scored per step')
+    ladder.add_argument('--lut', metavar='DIRECTORY', help='use the lookup tables in this directory, see lut.py')
+    ladder.set_defaults(run=_ladder)
+
+    render = commands.add_parser('render', help='save preview plots of palettes to files, see render.py')
+    render.add_argument('input', nargs='?', default='-',
+                        help='JSON lines of {"id", "input", "colors"}, e.g. batch results, - for stdin')
+    render.add_argument('--output-dir', required=True, help='where to save the previews')
+    render.add_argument('--previews', nargs='+', default=['line', 'palette', 'joint', 'scatter', 'comparison'],
+                        help='which previews to save, see render.PREVIEWS')
+    render.add_argument('--workers', type=int, default=1, help='worker processes to render palettes on')
+    render.add_argument('--data-home', help="where the demo datasets are cached, defaults to seaborn's")
+    render.add_argument('--extension', default='.png', help='the image format, any matplotlib can save')
+    render.add_argument('--dpi', type=int, default=100)
+    render.set_defaults(run=_render)
+
+    serve = commands.add_parser('serve', help='extend palettes for clients over a socket, see service.py')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--unix', metavar='PATH', help='listen on a Unix socket at PATH instead of host:port')
+    serve.add_argument('--workers', type=int, help='jobs run at once, defaults to the number of CPUs')
+    serve.add_argument('--max-jobs', type=int, default=64, help='jobs in flight at once, beyond that they are rejected')
+    serve.add_argument('--max-client-jobs', type=int, default=8, help='jobs in flight at once per connection')
+    serve.add_argument('--progress-seconds', type=float, default=0.5, help='how often running jobs report progress')
+    serve.add_argument('--lut', metavar='DIRECTORY', help='use the lookup tables in this directory, see lut.py')
+    serve.set_defaults(run=_serve)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
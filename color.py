@@ -1,18 +1,162 @@
 from __future__ import annotations
 
+import re
 import numpy as np
-import matplotlib
 
-from colormath.color_objects import sRGBColor, LabColor
-from colormath.color_diff import delta_e_cie2000
-from colormath.color_conversions import convert_color
-
-from typing import Tuple, List
+from typing import Tuple, List, Optional, TYPE_CHECKING
 
+from color_diff import delta_e_cie2000_pairs, delta_e_cie2000_cross
 from common import clip_values
 
+if TYPE_CHECKING:
+    from colormath.color_objects import LabColor
+
+
+# sRGB -> XYZ working space matrix and d65 / 2° white point, as used by colormath's convert_color
+RGB_TO_XYZ = np.array([[0.412424, 0.357579, 0.180464],
+                       [0.212656, 0.715158, 0.0721856],
+                       [0.0193324, 0.119193, 0.950444]])
+D65_WHITE = np.array([0.95047, 1.00000, 1.08883])
+CIE_E = 216.0 / 24389.0
+
+# a 24-bit rgb_key -> Lab lookup table, installed by lut.enable
+_lab_table = None
+
+
+def rgb_key(rgb: np.ndarray) -> np.ndarray:
+    """
+    The 24-bit key of colors, i.e. 0xRRGGBB of their values rounded to whole numbers
+
+    Args:
+        rgb: An (..., 3) array of colors with values in [0, 255]
+
+    Returns:
+        An (...) integer array of keys
+    """
+    channels = np.rint(np.clip(rgb, 0, 255)).astype(np.int64)
+    return (channels[..., 0] << 16) | (channels[..., 1] << 8) | channels[..., 2]
+
+
+def use_lab_table(table: Optional[np.ndarray]):
+    """
+    Installs (or with None, removes) a lookup table for rgb_to_lab, see lut.py
+    """
+    global _lab_table
+    _lab_table = table
+
+
+def rgb_to_lab(rgb: np.ndarray, use_table: bool = True) -> np.ndarray:
+    """
+    Vectorized sRGB -> Lab conversion.
+
+    Reproduces convert_color(sRGBColor(*rgb), LabColor) exactly as Color has always called it,
+    i.e. with the [0, 255] values handed to colormath unscaled, so existing ΔE values are unchanged.
+
+    Args:
+        rgb: An (..., 3) array of colors with values in [0, 255]
+        use_table: look the values up in the table installed by lut.enable, if any.
+                   The lookup rounds colors to whole numbers first
+
+    Returns:
+        An (..., 3) array of [L, a, b] values
+    """
+    if use_table and _lab_table is not None:
+        return _lab_table[rgb_key(rgb)].astype(float)
+
+    rgb = np.asarray(rgb, dtype=float)
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((np.maximum(rgb, 0.04045) + 0.055) / 1.055) ** 2.4)
+    xyz = np.maximum(linear @ RGB_TO_XYZ.T, 0.0)
+
+    scaled = xyz / D65_WHITE
+    f = np.where(scaled > CIE_E, np.cbrt(scaled), (7.787 * scaled) + (16.0 / 116.0))
+
+    return np.stack([(116.0 * f[..., 1]) - 16.0,
+                     500.0 * (f[..., 0] - f[..., 1]),
+                     200.0 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+HEX_PATTERN = re.compile(r'#([0-9a-fA-F]{3,4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})')
+
+
+def hex_to_rgb(hex_value: str) -> np.ndarray:
+    """
+    Parses a hex value, e.g. '#ffffff' or '#fff', into [R, G, B] values in [0, 255]. An alpha channel is ignored.
+    Anything else matplotlib understands as a color (e.g. 'tab:blue') is handed over to it,
+    so matplotlib is only imported when it's needed
+
+    Args:
+         hex_value: A string containing a hex value
+
+    Returns:
+        An array of [R, G, B] floats
+    """
+    match = HEX_PATTERN.fullmatch(hex_value)
+    if match is None:
+        import matplotlib.colors
+        return np.array(matplotlib.colors.to_rgb(hex_value)) * 255
+
+    digits = match.group(1)
+    if len(digits) <= 4:
+        digits = ''.join(d * 2 for d in digits)
+    return np.array([int(digits[i:i + 2], 16) for i in (0, 2, 4)], dtype=float)
+
+
+def rgb_to_hex(rgb: np.ndarray) -> List[str]:
+    """
+    Batch version of Color.to_hex
+
+    Args:
+        rgb: An (N, 3) array of colors with values in [0, 255]
+
+    Returns:
+        A list of hex strings, i.e. ['#ffffff', '#000000']
+    """
+    channels = np.round(np.asarray(rgb, dtype=float)).astype(int)
+    return ['#%02x%02x%02x' % tuple(c) for c in channels.tolist()]
+
+
+def nearby_rgbs(rgb: np.ndarray, count: int, drift_control: float = 0.1,
+                rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+    """
+    Draws count independent nearby_rgb moves of the same color at once, or one move each of count colors
+
+    Args:
+        rgb: An array of [R, G, B] values in [0, 255], or a (count, 3) array of them. The result keeps its dtype
+        count: How many moves to draw
+        drift_control: How much to allow randomness to affect the value update
+        rng: The random state to draw from. Defaults to the global numpy one
+
+    Returns:
+        A (count, 3) array of new [R, G, B] values
+    """
+    rng = np.random if rng is None else rng
+    rows = np.arange(count)
+    index = rng.choice(range(3), count)
+    new_rgb = np.array(np.broadcast_to(rgb, (count, 3)))
+    new_val = (new_rgb[rows, index] / 255.) + rng.rand(count) * drift_control - 0.05
+
+    new_rgb[rows, index] = np.clip(new_val, 0, 1) * 255
+    return new_rgb
+
+
+def nearby_rgb(rgb: np.ndarray, drift_control: float = 0.1, rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+    """
+    The move behind Color.nearby_color: chooses a value in [R, G, B] and adds some random drift to it
+
+    Args:
+        rgb: An array of [R, G, B] values in [0, 255]. The result keeps its dtype
+        drift_control: How much to allow randomness to affect the value update
+        rng: The random state to draw from. Defaults to the global numpy one
+
+    Returns:
+        A new array of [R, G, B] values
+    """
+    return nearby_rgbs(rgb, 1, drift_control, rng)[0]
+
 
 class Color:
+    __slots__ = ('rgb', '_hex', '_lab', '_lab_color')
+
     def __init__(self, red: float, green: float, blue: float):
         """
         Represents a color. Provides functionality for using both RGB values in [0, 255]
@@ -25,10 +169,50 @@ class Color:
             green: A float in [0, 255] representing the amount of green in the color
             blue: A float in [0, 255] representing the amount of blue in the color
         """
-        self.rgb = np.array([red, green, blue])
         self.rgb = np.array([clip_values(val) for val in [red, green, blue]])
-        self.hex = self.to_hex()
-        self.lab_color = convert_color(sRGBColor(*self.rgb), LabColor)
+        # computed on first access, most colors made while annealing never need them
+        self._hex = None
+        self._lab = None
+        self._lab_color = None
+
+    @classmethod
+    def view(cls, rgb: np.ndarray, lab: Optional[np.ndarray] = None) -> Color:
+        """
+        A Color over already clipped values, e.g. a row of a Palette, skipping the per-value clipping.
+        Lab values computed in batch can be handed over as well
+
+        Args:
+            rgb: An array of [R, G, B] values in [0, 255]
+            lab: The matching [L, a, b] values, if already known
+
+        Returns:
+            A Color object for the given values
+        """
+        color = cls.__new__(cls)
+        color.rgb = rgb
+        color._hex = None
+        color._lab = lab
+        color._lab_color = None
+        return color
+
+    @property
+    def hex(self) -> str:
+        if self._hex is None:
+            self._hex = self.to_hex()
+        return self._hex
+
+    @property
+    def lab(self) -> np.ndarray:
+        if self._lab is None:
+            self._lab = rgb_to_lab(self.rgb)
+        return self._lab
+
+    @property
+    def lab_color(self) -> LabColor:
+        if self._lab_color is None:
+            from colormath.color_objects import LabColor
+            self._lab_color = LabColor(*self.lab, illuminant='d65')
+        return self._lab_color
 
     @classmethod
     def from_hex(cls, hex_value: str) -> Color:
@@ -41,25 +225,27 @@ class Color:
         Returns:
             A Color object for the given color
         """
-        rgb = np.array(matplotlib.colors.to_rgb(hex_value)) * 255
-        return Color(*rgb)
+        return Color(*hex_to_rgb(hex_value))
 
     @classmethod
-    def random_color(cls) -> Color:
+    def random_color(cls, rng: Optional[np.random.RandomState] = None) -> Color:
         """
         A classmethod that returns a random color
 
         Usage:
              > Color.random_color()
+
+        Args:
+            rng: The random state to draw from. Defaults to the global numpy one
         """
-        rgb = np.random.choice(range(1, 256), 3)
+        rgb = (np.random if rng is None else rng).choice(range(1, 256), 3)
         return Color(*rgb)
 
     def to_hex(self) -> str:
         """
         returns a hex value for the given RGB value
         """
-        return matplotlib.colors.to_hex(self.rgb / 255)
+        return rgb_to_hex(self.rgb[None, :])[0]
 
     def delta_e(self, other_color: Color) -> float:
         """
@@ -74,7 +260,7 @@ class Color:
         Notes:
             > https://en.wikipedia.org/wiki/Color_difference#CIEDE2000
         """
-        return delta_e_cie2000(self.lab_color, other_color.lab_color)
+        return float(delta_e_cie2000_pairs(self.lab, other_color.lab))
 
     def get_closest_color(self, color_list: List[Color]) -> Tuple[Color, float]:
         """
@@ -86,33 +272,23 @@ class Color:
         Returns:
              A tuple containing the closest color's Color object and the ΔE value
         """
-        distances = [self.delta_e(other_color) for other_color in color_list]
+        distances = delta_e_cie2000_cross(self.lab[None, :], [c.lab for c in color_list])[0]
         min_val = np.argmin(distances)
-        return color_list[min_val], distances[min_val]
+        return color_list[min_val], float(distances[min_val])
 
-    def nearby_color(self, drift_control: float = 0.1) -> Color:
+    def nearby_color(self, drift_control: float = 0.1, rng: Optional[np.random.RandomState] = None) -> Color:
         """
         Returns a 'nearby' color. Essentially takes a color, chooses a value in [R, G, B]
         and adds some random drift to it
 
         Args:
             drift_control: How much to allow randomness to affect the value update
+            rng: The random state to draw from. Defaults to the global numpy one
 
         Returns:
             Returns a new Color object that is slightly different from the current color
         """
-        index = np.random.choice(range(3), 1)
-        new_rgb = self.rgb.copy()
-        new_val = (new_rgb[index] / 255.) + np.random.rand() * drift_control - 0.05
-
-        if new_val > 1:
-            new_val = 1
-        elif new_val < 0:
-            new_val = 0
-
-        new_rgb[index] = new_val * 255
-
-        return Color(*new_rgb)
+        return Color(*nearby_rgb(self.rgb, drift_control, rng))
 
 def average_color_distances_from_target(color_list: List[Color], target_colors: List[Color]) -> float:
     """
@@ -125,8 +301,8 @@ def average_color_distances_from_target(color_list: List[Color], target_colors:
     Returns:
         The average distance value (ΔE)
     """
-    distances = list(map(lambda c: c.get_closest_color(target_colors)[1], color_list))
-    return np.average(distances)
+    distances = delta_e_cie2000_cross([c.lab for c in color_list], [c.lab for c in target_colors])
+    return np.average(np.min(distances, axis=1))
 
 def color_distance(color1: Color, color2: Color) -> float:
     """
@@ -138,7 +314,7 @@ def color_distance(color1: Color, color2: Color) -> float:
 
     Returns the ΔE distance
     """
-    return delta_e_cie2000(color1.lab_color, color2.lab_color)
+    return float(delta_e_cie2000_pairs(color1.lab, color2.lab))
 
 
 def hex_list(color_list: List[Color]) -> List[str]:
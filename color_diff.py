@@ -0,0 +1,168 @@
+# Vectorized color difference kernels, working on arrays of Lab values instead of colormath objects.
+# Mirrors colormath.color_diff_matrix so results match colormath.color_diff.delta_e_cie2000
+import numpy as np
+
+
+def delta_e_cie2000_pairs(lab1: np.ndarray, lab2: np.ndarray,
+                          Kl: float = 1, Kc: float = 1, Kh: float = 1) -> np.ndarray:
+    """
+    Element-wise CIEDE2000 between two broadcastable arrays of Lab colors
+
+    Args:
+        lab1: An (..., 3) array of Lab values
+        lab2: An (..., 3) array of Lab values, broadcastable against lab1
+
+    Returns:
+        An array of ΔE values with the broadcast shape of the inputs (minus the last axis)
+
+    Notes:
+        > https://en.wikipedia.org/wiki/Color_difference#CIEDE2000
+    """
+    lab1 = np.asarray(lab1, dtype=float)
+    lab2 = np.asarray(lab2, dtype=float)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    avg_Lp = (L1 + L2) / 2.0
+
+    C1 = np.sqrt(a1 ** 2 + b1 ** 2)
+    C2 = np.sqrt(a2 ** 2 + b2 ** 2)
+    avg_C1_C2 = (C1 + C2) / 2.0
+
+    G = 0.5 * (1 - np.sqrt(avg_C1_C2 ** 7.0 / (avg_C1_C2 ** 7.0 + 25.0 ** 7.0)))
+
+    a1p = (1.0 + G) * a1
+    a2p = (1.0 + G) * a2
+
+    C1p = np.sqrt(a1p ** 2 + b1 ** 2)
+    C2p = np.sqrt(a2p ** 2 + b2 ** 2)
+    avg_C1p_C2p = (C1p + C2p) / 2.0
+
+    h1p = np.degrees(np.arctan2(b1, a1p))
+    h1p += (h1p < 0) * 360
+    h2p = np.degrees(np.arctan2(b2, a2p))
+    h2p += (h2p < 0) * 360
+
+    avg_Hp = (((np.fabs(h1p - h2p) > 180) * 360) + h1p + h2p) / 2.0
+
+    T = (1 - 0.17 * np.cos(np.radians(avg_Hp - 30)) +
+         0.24 * np.cos(np.radians(2 * avg_Hp)) +
+         0.32 * np.cos(np.radians(3 * avg_Hp + 6)) -
+         0.2 * np.cos(np.radians(4 * avg_Hp - 63)))
+
+    diff_h2p_h1p = h2p - h1p
+    delta_hp = diff_h2p_h1p + (np.fabs(diff_h2p_h1p) > 180) * 360
+    delta_hp -= (h2p > h1p) * 720
+
+    delta_Lp = L2 - L1
+    delta_Cp = C2p - C1p
+    delta_Hp = 2 * np.sqrt(C2p * C1p) * np.sin(np.radians(delta_hp) / 2.0)
+
+    S_L = 1 + ((0.015 * (avg_Lp - 50) ** 2) / np.sqrt(20 + (avg_Lp - 50) ** 2.0))
+    S_C = 1 + 0.045 * avg_C1p_C2p
+    S_H = 1 + 0.015 * avg_C1p_C2p * T
+
+    delta_ro = 30 * np.exp(-(((avg_Hp - 275) / 25) ** 2.0))
+    R_C = np.sqrt((avg_C1p_C2p ** 7.0) / (avg_C1p_C2p ** 7.0 + 25.0 ** 7.0))
+    R_T = -2 * R_C * np.sin(2 * np.radians(delta_ro))
+
+    return np.sqrt(
+        (delta_Lp / (S_L * Kl)) ** 2 +
+        (delta_Cp / (S_C * Kc)) ** 2 +
+        (delta_Hp / (S_H * Kh)) ** 2 +
+        R_T * (delta_Cp / (S_C * Kc)) * (delta_Hp / (S_H * Kh)))
+
+
+def delta_e_cie2000_matrix(lab: np.ndarray, condensed: bool = True) -> np.ndarray:
+    """
+    Pairwise CIEDE2000 distances between all colors in a palette
+
+    Args:
+        lab: An (N, 3) array of Lab values
+        condensed: return the N * (N - 1) / 2 upper triangle distances, in the same order as
+                   itertools.combinations. Otherwise, return the symmetric (N, N) matrix
+
+    Returns:
+        The condensed distance vector or the square distance matrix
+    """
+    lab = np.asarray(lab, dtype=float)
+    n = len(lab)
+    rows, cols = np.triu_indices(n, k=1)
+    distances = delta_e_cie2000_pairs(lab[rows], lab[cols])
+    if condensed:
+        return distances
+
+    square = np.zeros((n, n))
+    square[rows, cols] = distances
+    square[cols, rows] = distances
+    return square
+
+
+def delta_e_cie2000_cross(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """
+    CIEDE2000 distances from every color in one palette to every color in another
+
+    Args:
+        lab1: An (N, 3) array of Lab values
+        lab2: An (M, 3) array of Lab values
+
+    Returns:
+        An (N, M) array where [i, j] is the ΔE between lab1[i] and lab2[j]
+    """
+    lab1 = np.asarray(lab1, dtype=float)
+    lab2 = np.asarray(lab2, dtype=float)
+    return delta_e_cie2000_pairs(lab1[:, None, :], lab2[None, :, :])
+
+
+def delta_e_cie76_pairs(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """
+    Element-wise CIE76, i.e. the Euclidean distance, between two broadcastable arrays of Lab colors
+
+    Args:
+        lab1: An (..., 3) array of Lab values
+        lab2: An (..., 3) array of Lab values, broadcastable against lab1
+
+    Returns:
+        An array of ΔE values with the broadcast shape of the inputs (minus the last axis)
+    """
+    difference = np.asarray(lab1, dtype=float) - np.asarray(lab2, dtype=float)
+    return np.sqrt(np.einsum('...i,...i->...', difference, difference))
+
+
+def delta_e_cie94_pairs(lab1: np.ndarray, lab2: np.ndarray,
+                        K_L: float = 1, K_C: float = 1, K_H: float = 1,
+                        K_1: float = 0.045, K_2: float = 0.015) -> np.ndarray:
+    """
+    Element-wise CIE94 between two broadcastable arrays of Lab colors, with colormath's (graphic arts) defaults.
+
+    CIE94 weighs the chroma and hue differences by the chroma of the first color, so it isn't symmetric.
+    This uses the mean chroma of both colors instead, so the distance matrices stay symmetric
+
+    Args:
+        lab1: An (..., 3) array of Lab values
+        lab2: An (..., 3) array of Lab values, broadcastable against lab1
+
+    Returns:
+        An array of ΔE values with the broadcast shape of the inputs (minus the last axis)
+
+    Notes:
+        > https://en.wikipedia.org/wiki/Color_difference#CIE94
+    """
+    lab1 = np.asarray(lab1, dtype=float)
+    lab2 = np.asarray(lab2, dtype=float)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    C1 = np.sqrt(a1 ** 2 + b1 ** 2)
+    C2 = np.sqrt(a2 ** 2 + b2 ** 2)
+    avg_C = (C1 + C2) / 2.0
+
+    delta_L = L1 - L2
+    delta_C = C1 - C2
+    # ΔH² = Δa² + Δb² - ΔC², which rounding can push just below zero
+    delta_H_sq = np.maximum((a1 - a2) ** 2 + (b1 - b2) ** 2 - delta_C ** 2, 0)
+
+    S_C = 1 + K_1 * avg_C
+    S_H = 1 + K_2 * avg_C
+
+    return np.sqrt((delta_L / K_L) ** 2 + (delta_C / (K_C * S_C)) ** 2 + delta_H_sq / (K_H * S_H) ** 2)
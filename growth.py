@@ -0,0 +1,178 @@
+# Growing palettes a few colors at a time, e.g. 5 colors, then 8, then 12, reusing the work done for the smaller ones.
+#
+# Each step keeps the colors found so far, locked in place or free to drift a few channel values, appends the new
+# colors to the same objective (see IncrementalObjective.extend: only the distances of the new colors are
+# computed) and continues with a short, low-temperature schedule. Each new color starts out as the best of a batch
+# of random candidates, all scored in one propose_many call, so the short schedule only has to refine it.
+#
+# Only the smallest size of a ladder gets a full schedule, so a whole ladder of sizes costs about as much as
+# one anneal call for the smallest size, rather than one per size.
+#
+# Usage:
+#     > colors = grow(target_colors, colors, 3)  # 3 more colors, the others locked
+#     > colors = grow(target_colors, colors, 3, drift=10)  # the others may move by up to 10 per channel
+#     > ladder = palette_ladder(target_colors, [5, 8, 12], rng=np.random.RandomState(0))
+#     > python cli.py ladder '#00798c' '#d1495b' --sizes 5 8 12 --seed 0
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional
+
+from annealing import ScheduleResult, make_objective, obj_fn, run_schedule
+from color import Color
+from moves import Moves
+from objective import LARGE_PALETTE_SIZE
+from palette import Palette
+
+
+def add_colors(objective, count: int, candidates: int = 64,
+               rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+    """
+    Appends count colors to an objective's state, one at a time, each the best of candidates random colors
+
+    Args:
+        objective: An objective from annealing.make_objective
+        count: How many colors to add
+        candidates: How many random colors to score for each new one
+        rng: The random state to draw from. Defaults to the global numpy one
+
+    Returns:
+        The indices of the new colors
+    """
+    start = len(objective.rgb)
+    for _ in range(count):
+        colors = Palette.random(max(candidates, 1), rng).srgb
+        objective.extend(colors[:1])
+        costs = objective.propose_many(len(objective.rgb) - 1, colors)
+        objective.commit(int(np.argmin(costs)))
+    return np.arange(start, start + count)
+
+
+def move_to(objective, state: np.ndarray):
+    """
+    Moves an objective to state one changed color at a time, e.g. back to the best state of a schedule.
+    Costs O(N) per changed color instead of the O(N²) of a new objective
+
+    Args:
+        objective: An objective from annealing.make_objective
+        state: An array of the same shape as the objective's state
+    """
+    for i in np.flatnonzero(np.any(objective.rgb != state, axis=1)):
+        objective.propose(i, state[i])
+        objective.commit()
+
+
+def grow_objective(objective, count: int, drift: Optional[float] = 0., locked: Optional[Iterable[int]] = None,
+                   temperature: float = 5., cooling_rate: float = 0.95, cutoff: float = .01,
+                   candidates: int = 64, rng: Optional[np.random.RandomState] = None,
+                   batch_size: int = 1, moves: Optional[Moves] = None, **schedule) -> ScheduleResult:
+    """
+    Adds count colors to an objective's state and anneals them in, leaving the objective at the best state found.
+    See grow
+
+    Args:
+        objective: An objective from annealing.make_objective
+        schedule: Passed on to run_schedule, e.g. max_evaluations or callback
+        The others: see grow
+
+    Returns:
+        The ScheduleResult of the short schedule
+    """
+    n = len(objective.rgb)
+    anchors = objective.rgb.copy()
+    new = add_colors(objective, count, candidates, rng)
+
+    # the new colors move freely, the others within drift of where they are, if at all
+    if drift is not None and drift <= 0:
+        indices = new
+    else:
+        locked = set() if locked is None else set(locked)
+        indices = np.array([i for i in range(n + count) if i not in locked])
+    bounds = None
+    if drift is not None and drift > 0:
+        low, high = np.zeros((n + count, 3)), np.full((n + count, 3), 255.)
+        low[:n], high[:n] = np.clip(anchors - drift, 0, 255), np.clip(anchors + drift, 0, 255)
+        bounds = (low, high)
+
+    result = run_schedule(objective, temperature, cooling_rate, cutoff, rng, batch_size=batch_size, moves=moves,
+                          indices=indices, bounds=bounds, **schedule)
+    move_to(objective, result.best_state)
+    return result
+
+
+def grow(input_colors: List[Color], colors: List[Color], count: int, drift: Optional[float] = 0.,
+         locked: Optional[Iterable[int]] = None, temperature: float = 5., cooling_rate: float = 0.95,
+         cutoff: float = .01, candidates: int = 64, objective_function: Callable = obj_fn,
+         rng: Optional[np.random.RandomState] = None, weights: Optional[Dict[str, float]] = None,
+         batch_size: int = 1, moves: Optional[Moves] = None, large_palette: Optional[bool] = None) -> List[Color]:
+    """
+    Extends an annealed result by count colors, without starting over
+
+    Args:
+        input_colors: A list of target colors to optimize toward
+        colors: A previous result of anneal (or grow) for input_colors
+        count: How many colors to add
+        drift: How far, per channel, the colors of the previous result may move. 0 locks them, None lets them
+               move freely
+        locked: Indices of colors of the previous result that stay put, whatever the drift
+        temperature, cooling_rate, cutoff: The short schedule the colors are annealed in with. The default
+                                           starts well below anneal's, as only the new colors start out random
+        candidates: Each new color starts out as the best of this many random colors
+        objective_function, rng, weights, batch_size, moves: see anneal
+        large_palette: see anneal. Defaults to the grown size
+
+    Returns:
+        The colors of the previous result (moved by no more than drift), followed by the new ones
+    """
+    if large_palette is None:
+        large_palette = len(colors) + count >= LARGE_PALETTE_SIZE
+    objective = make_objective(Palette.from_colors(colors), input_colors, objective_function, weights=weights,
+                               large_palette=large_palette, rng=rng)
+    grow_objective(objective, count, drift, locked, temperature, cooling_rate, cutoff, candidates, rng,
+                   batch_size, moves)
+    return objective.palette.to_colors()
+
+
+def palette_ladder(input_colors: List[Color], sizes: List[int], drift: Optional[float] = 0.,
+                   temperature: float = 1000., cooling_rate: float = 0.99, cutoff: float = .0001,
+                   growth_temperature: float = 5., growth_cooling_rate: float = 0.95, growth_cutoff: float = .01,
+                   candidates: int = 64, objective_function: Callable = obj_fn,
+                   rng: Optional[np.random.RandomState] = None, weights: Optional[Dict[str, float]] = None,
+                   batch_size: int = 1, moves: Optional[Moves] = None,
+                   large_palette: Optional[bool] = None) -> Dict[int, List[Color]]:
+    """
+    Palettes of increasing sizes, each grown from the one before. The smallest is annealed with the full
+    schedule, the others only with the short one of grow, all on the same objective
+
+    Usage:
+        > ladder = palette_ladder(target_colors, [5, 8, 12])
+        > ladder[8]  # the 5 colors of ladder[5], followed by 3 more
+
+    Args:
+        input_colors: A list of target colors to optimize toward
+        sizes: The palette sizes, increasing
+        drift: How far, per channel, the colors of each size may move when the next size is grown. See grow
+        temperature, cooling_rate, cutoff: The schedule of the smallest size, see anneal
+        growth_temperature, growth_cooling_rate, growth_cutoff: The schedule of every other size, see grow
+        candidates: see grow
+        objective_function, rng, weights, batch_size, moves: see anneal
+        large_palette: see anneal. Defaults to the largest size
+
+    Returns:
+        A dict of size -> colors, in the order of sizes
+    """
+    sizes = list(sizes)
+    if not sizes or sizes[0] < 1 or any(b <= a for a, b in zip(sizes, sizes[1:])):
+        raise ValueError(f'Expected increasing, positive sizes, got {sizes}')
+    if large_palette is None:
+        large_palette = sizes[-1] >= LARGE_PALETTE_SIZE
+
+    objective = make_objective(Palette.random(sizes[0], rng), input_colors, objective_function, weights=weights,
+                               large_palette=large_palette, rng=rng)
+    result = run_schedule(objective, temperature, cooling_rate, cutoff, rng, batch_size=batch_size, moves=moves)
+    move_to(objective, result.best_state)
+    ladder = {sizes[0]: objective.palette.to_colors()}
+
+    for previous, size in zip(sizes, sizes[1:]):
+        grow_objective(objective, size - previous, drift, None, growth_temperature, growth_cooling_rate,
+                       growth_cutoff, candidates, rng, batch_size, moves)
+        ladder[size] = objective.palette.to_colors()
+    return ladder
@@ -0,0 +1,410 @@
+# Color vision deficiency simulation for whole images, e.g. the chart renders in Examples/.
+#
+# Images are processed in bands of rows ("tiles") of a bounded number of pixels, and every output is written
+# band by band as soon as its turn comes, so memory use depends on the tile size and the number of tiles in
+# flight, not on the image size. Outputs are PNG files (written incrementally with zlib) or .npy files.
+#
+# Sources are read in tiles too: .npy arrays of shape (height, width, 3 or 4) and dtype uint8 are
+# memory-mapped, and 8-bit PNGs (the usual screenshots and chart renders) are inflated with zlib a band of rows
+# at a time, see PNGReader. Other images, including interlaced and 16-bit PNGs, are decoded whole by Pillow,
+# which needs the decoded 8-bit image in memory (4 bytes a pixel, ~130MB for 8K); convert them to .npy once to
+# keep memory flat. Either way the float math only ever sees one tile.
+#
+# Usage:
+#     > python cli.py simulate-image Examples/extended_line.png --output-dir out --workers 4
+#     > simulate_image('chart.png', output_paths('chart.png', ['Protanopia', 'Tritanopia']))
+import io
+import os
+import struct
+import zlib
+from contextlib import nullcontext
+import numpy as np
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, List, Optional, Tuple
+
+from bretel import simulate, sRGB_to_lRGB_array
+
+DEFAULT_VISION_SPACES = ('Protanopia', 'Deuteranopia', 'Tritanopia')
+DEFAULT_TILE_PIXELS = 1 << 18
+
+# every 8-bit sRGB value in linear RGB, so tiles skip the gamma curve
+_LRGB_TABLE = sRGB_to_lRGB_array(np.arange(256))
+
+
+class PNGReader:
+    def __init__(self, path: str):
+        """
+        Reads an 8-bit, non-interlaced PNG a band of rows at a time, without holding the image in memory.
+        The counterpart of PNGWriter
+
+        The compressed data is inflated with zlib as the bands are read. Pillow undoes the scanline filters in
+        C: each band is handed to it as a small PNG of its own, headed by the last row of the band before, which
+        the filters of the band's first row refer to
+
+        Usage:
+            > with PNGReader(path) as png:
+            >     rows = png.read(64)  # (64, width, 3 or 4) uint8, top to bottom
+
+        Args:
+            path: The PNG to read. See PNGReader.supports
+        """
+        self._file = open(path, 'rb')
+        try:
+            if self._file.read(8) != b'\x89PNG\r\n\x1a\n':
+                raise ValueError(f'Not a PNG: {path}')
+            self._chunks = []  # the chunks every band needs besides its pixels, e.g. the palette
+            self._remaining = 0  # the bytes left in the current IDAT chunk
+            while True:
+                length, kind = struct.unpack('>I4s', self._file.read(8))
+                if kind == b'IDAT':
+                    self._remaining = length
+                    break
+                data = self._file.read(length)
+                self._file.read(4)
+                if kind == b'IHDR':
+                    width, height, self._depth, self._color_type, _, _, self._interlace = \
+                        struct.unpack('>IIBBBBB', data)
+                elif kind in (b'PLTE', b'tRNS'):
+                    self._chunks.append((kind, data))
+                elif kind == b'IEND':
+                    raise ValueError(f'No image data in {path}')
+            if not self.supports(self._depth, self._interlace):
+                raise ValueError(f'Only 8-bit, non-interlaced PNGs can be read in bands: {path}')
+        except Exception:
+            self._file.close()
+            raise
+
+        samples = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[self._color_type]
+        has_alpha = self._color_type in (4, 6) or any(kind == b'tRNS' for kind, _ in self._chunks)
+        self.mode = 'RGBA' if has_alpha else 'RGB'
+        self.shape = (height, width, 4 if has_alpha else 3)
+        self.rows_read = 0
+        self._row_bytes = 1 + width * samples
+        self._decompressor = zlib.decompressobj()
+        self._buffer = bytearray()
+        self._previous = None  # the last unfiltered scanline read, which the next one can refer to
+
+    @staticmethod
+    def supports(depth: int, interlace: int) -> bool:
+        return depth == 8 and interlace == 0
+
+    def _next_data(self) -> Optional[bytes]:
+        """
+        The next piece of compressed image data, None at the end of the image
+        """
+        while not self._remaining:
+            length, kind = struct.unpack('>I4s', self._file.read(8))
+            if kind == b'IEND':
+                return None
+            if kind == b'IDAT':
+                self._remaining = length
+            else:
+                self._file.seek(length + 4, os.SEEK_CUR)
+        data = self._file.read(min(self._remaining, 1 << 16))
+        self._remaining -= len(data)
+        if not self._remaining:
+            self._file.read(4)
+        return data
+
+    def _chunk(self, kind: bytes, data: bytes) -> bytes:
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+    def read(self, rows: int) -> np.ndarray:
+        """
+        The next band of rows, fewer at the end of the image
+
+        Returns:
+            A (rows, width, 3 or 4) uint8 array
+        """
+        from PIL import Image
+
+        rows = min(rows, self.shape[0] - self.rows_read)
+        size = rows * self._row_bytes
+        while len(self._buffer) < size:
+            data = self._decompressor.unconsumed_tail or self._next_data()
+            if data is None:
+                raise ValueError('Truncated PNG')
+            self._buffer += self._decompressor.decompress(data, size - len(self._buffer))
+        scanlines = bytes(self._buffer[:size])
+        del self._buffer[:size]
+
+        header = 0 if self._previous is None else 1
+        if header:
+            scanlines = b'\x00' + self._previous + scanlines
+        height, width = rows + header, self.shape[1]
+        band = b''.join([b'\x89PNG\r\n\x1a\n',
+                         self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, self._color_type, 0, 0, 0)),
+                         *(self._chunk(kind, data) for kind, data in self._chunks),
+                         self._chunk(b'IDAT', zlib.compress(scanlines, 0)),
+                         self._chunk(b'IEND', b'')])
+        with Image.open(io.BytesIO(band)) as image:
+            self._previous = np.asarray(image)[-1].tobytes()
+            pixels = np.asarray(image.convert(self.mode))[header:]
+        self.rows_read += rows
+        return pixels
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArrayReader:
+    def __init__(self, image: np.ndarray):
+        """
+        Reads a (height, width, 3 or 4) uint8 array a band of rows at a time. Same interface as PNGReader
+        """
+        self._image = image
+        self.shape = image.shape
+        self.rows_read = 0
+
+    def read(self, rows: int) -> np.ndarray:
+        band = self._image[self.rows_read:self.rows_read + rows]
+        self.rows_read += len(band)
+        return band
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _png_header(path: str) -> Optional[Tuple[int, int]]:
+    """
+    The (bit depth, interlace method) of a PNG, None for other files
+    """
+    with open(path, 'rb') as f:
+        header = f.read(33)
+    if header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        return None
+    return header[24], header[28]
+
+
+def read_image(path: str) -> np.ndarray:
+    """
+    Reads a whole image. See open_image to read one a band of rows at a time
+
+    Args:
+        path: A .npy file of shape (height, width, 3 or 4) and dtype uint8, or any image Pillow can read
+
+    Returns:
+        A (height, width, 3 or 4) uint8 array, memory-mapped for .npy files. Alpha is kept, other modes
+        are converted to RGB
+    """
+    if path.endswith('.npy'):
+        image = np.load(path, mmap_mode='r')
+        if image.dtype != np.uint8 or image.ndim != 3 or image.shape[2] not in (3, 4):
+            raise ValueError(f'Expected a (height, width, 3 or 4) uint8 array in {path}, got {image.dtype} {image.shape}')
+        return image
+
+    from PIL import Image
+    with Image.open(path) as image:
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        return np.asarray(image.convert('RGBA' if has_alpha else 'RGB'))
+
+
+def open_image(path: str):
+    """
+    Opens an image for reading a band of rows at a time. Memory stays flat for .npy files and 8-bit,
+    non-interlaced PNGs, other images are decoded whole, see the top of this module
+
+    Args:
+        path: See read_image
+
+    Returns:
+        A PNGReader or ArrayReader, with the (height, width, 3 or 4) shape of the image and a read(rows) method
+    """
+    if not path.endswith('.npy'):
+        header = _png_header(path)
+        if header is not None and PNGReader.supports(*header):
+            return PNGReader(path)
+    return ArrayReader(read_image(path))
+
+
+def simulate_tile(tile: np.ndarray, vision_spaces: List[str]) -> Dict[str, np.ndarray]:
+    """
+    Simulates a tile of an image in each of the vision spaces
+
+    Args:
+        tile: A (rows, width, 3 or 4) uint8 array. Alpha is passed through unchanged
+        vision_spaces: Brettel attribute names, see bretel.VISION_SPACES
+
+    Returns:
+        A dict of vision space -> simulated tile, with the shape and dtype of tile
+    """
+    tile = np.asarray(tile)
+    rgb = tile[..., :3].reshape(-1, 3)
+    simulated = simulate(rgb, vision_spaces, lRGB=_LRGB_TABLE[rgb])
+
+    tiles = {}
+    for vision_space in vision_spaces:
+        result = np.empty_like(tile)
+        result[..., :3] = np.rint(np.clip(simulated[vision_space], 0, 255)).reshape(tile.shape[:-1] + (3,))
+        result[..., 3:] = tile[..., 3:]
+        tiles[vision_space] = result
+    return tiles
+
+
+class PNGWriter:
+    def __init__(self, path: str, width: int, height: int, channels: int, compression: int = 6):
+        """
+        Writes an 8-bit RGB or RGBA PNG a band of rows at a time, without holding the image in memory
+
+        Usage:
+            > with PNGWriter(path, width, height, 3) as png:
+            >     png.write(rows)  # (n, width, 3) uint8, top to bottom
+
+        Args:
+            path: Where to write the PNG
+            width, height: The size of the image in pixels
+            channels: 3 for RGB, 4 for RGBA
+            compression: The zlib compression level
+        """
+        self.shape = (height, width, channels)
+        self.rows_written = 0
+        self._file = open(path, 'wb')
+        self._compressor = zlib.compressobj(compression)
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2 if channels == 3 else 6, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self._file.write(struct.pack('>I', len(data)) + kind + data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+    def write(self, rows: np.ndarray):
+        """
+        Appends a band of rows to the image
+        """
+        rows = np.ascontiguousarray(rows, dtype=np.uint8)
+        # each scanline starts with its filter type, 0 (none)
+        scanlines = np.zeros((len(rows), 1 + rows.shape[1] * rows.shape[2]), dtype=np.uint8)
+        scanlines[:, 1:] = rows.reshape(len(rows), -1)
+        data = self._compressor.compress(scanlines.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+        self.rows_written += len(rows)
+
+    def close(self):
+        """
+        Finishes the image
+        """
+        try:
+            self._chunk(b'IDAT', self._compressor.flush())
+            self._chunk(b'IEND', b'')
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NpyWriter:
+    def __init__(self, path: str, width: int, height: int, channels: int):
+        """
+        Writes a (height, width, channels) uint8 .npy file a band of rows at a time, through a memory map.
+        Same interface as PNGWriter
+        """
+        self.shape = (height, width, channels)
+        self.rows_written = 0
+        self._array = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=self.shape)
+
+    def write(self, rows: np.ndarray):
+        self._array[self.rows_written:self.rows_written + len(rows)] = rows
+        self.rows_written += len(rows)
+
+    def close(self):
+        self._array.flush()
+        del self._array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def output_paths(source: str, vision_spaces: List[str] = DEFAULT_VISION_SPACES,
+                 directory: Optional[str] = None, extension: str = '.png') -> Dict[str, str]:
+    """
+    Output paths next to source (or in directory), e.g. chart.png -> chart.protanopia.png
+
+    Returns:
+        A dict of vision space -> path
+    """
+    stem = os.path.splitext(os.path.basename(source))[0]
+    directory = os.path.dirname(source) if directory is None else directory
+    return {space: os.path.join(directory, f'{stem}.{space.lower()}{extension}') for space in vision_spaces}
+
+
+def _init_worker(lut_directory: Optional[str]):
+    if lut_directory:
+        import lut
+        lut.enable(lut_directory)
+
+
+def simulate_image(source: str, outputs: Dict[str, str], tile_pixels: int = DEFAULT_TILE_PIXELS,
+                   workers: int = 1, max_pending: Optional[int] = None,
+                   lut_directory: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Simulates an image in several vision spaces, a tile at a time, writing each vision space to its own file
+
+    Args:
+        source: The image to simulate, see open_image
+        outputs: A dict of vision space -> output path. Paths ending in .npy are written as arrays, others as PNG
+        tile_pixels: Roughly how many pixels to simulate at once. Tiles are bands of whole rows
+        workers: Simulate this many tiles in parallel, on a process pool. 1 runs in this process
+        max_pending: How many tiles to have in flight at most, defaults to twice the workers
+        lut_directory: If given, simulate with the lookup tables in this directory, see lut.py
+
+    Returns:
+        The (width, height) of the image
+    """
+    with open_image(source) as image:
+        height, width, channels = image.shape
+        rows = max(1, tile_pixels // width)
+        vision_spaces = list(outputs)
+        max_pending = max(max_pending or 2 * workers, 1)
+
+        writers = {space: (NpyWriter if path.endswith('.npy') else PNGWriter)(path, width, height, channels)
+                   for space, path in outputs.items()}
+
+        def write(tiles: Dict[str, np.ndarray]):
+            for space, tile in tiles.items():
+                writers[space].write(tile)
+
+        try:
+            if workers <= 1:
+                # the tables are only enabled for this call, as this is the caller's process
+                import lut
+                with lut.using(lut_directory) if lut_directory else nullcontext():
+                    for _ in range(0, height, rows):
+                        write(simulate_tile(image.read(rows), vision_spaces))
+            else:
+                # tiles finish out of order but have to be written in order, so wait on the oldest one
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(lut_directory,)) as executor:
+                    pending: Deque[Future] = deque()
+                    for _ in range(0, height, rows):
+                        pending.append(executor.submit(simulate_tile, np.array(image.read(rows)), vision_spaces))
+                        if len(pending) >= max_pending:
+                            write(pending.popleft().result())
+                    while pending:
+                        write(pending.popleft().result())
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+    return width, height
@@ -0,0 +1,321 @@
+# Optional compiled kernels for the objective's hot path, built with Numba when it's installed.
+#
+# For the 5 to 15 color palettes anneal usually works on, a proposal is a handful of colors, and the NumPy
+# versions of the Brettel simulation, Lab conversion and CIEDE2000 spend most of their time dispatching a few
+# dozen tiny array operations. These kernels do the same math one color (pair) at a time in compiled loops:
+#
+#   - vision_space_labs: gamma curve, Brettel projection and Lab conversion, fused, for every vision space
+#   - delta_e_cross: CIEDE2000 between every color of one palette and every color of another, per vision space
+#   - delta_e_matrix: the symmetric pairwise CIEDE2000 matrix of a palette, computing each pair once
+#   - row_extremes_update / row_extremes_without: the bookkeeping of objective._RowExtremes for Range
+#
+# They reproduce color.rgb_to_lab, bretel.simulate and color_diff.delta_e_cie2000_pairs (and with them
+# colormath) to floating point rounding. IncrementalObjective and TargetIndex use them automatically when Numba
+# is installed, see enabled. Without Numba, this module still imports, and the NumPy versions are used.
+#
+# The kernels are compiled on first use and cached next to this file, so only the first process pays for it.
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# whether to use the kernels when Numba is installed, see enable / disable
+_enabled = True
+
+
+def _jit(function):
+    return numba.njit(cache=True, nogil=True)(function) if numba is not None else function
+
+
+def enabled() -> bool:
+    """
+    Whether the compiled kernels are available and switched on
+    """
+    return numba is not None and _enabled
+
+
+def enable():
+    """
+    Switches the compiled kernels (back) on, the default when Numba is installed
+    """
+    global _enabled
+    if numba is None:
+        raise ImportError('The compiled kernels need numba')
+    _enabled = True
+
+
+def disable():
+    """
+    Goes back to the NumPy versions, e.g. to compare against them
+    """
+    global _enabled
+    _enabled = False
+
+
+@_jit
+def _lab_into(r: float, g: float, b: float, rgb_to_xyz: np.ndarray, white: np.ndarray, out: np.ndarray):
+    """
+    color.rgb_to_lab of a single color, with its [0, 255] values unscaled like colormath is called with
+    """
+    linear = np.empty(3)
+    for c, value in enumerate((r, g, b)):
+        linear[c] = value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+    f = np.empty(3)
+    for c in range(3):
+        xyz = max(rgb_to_xyz[c, 0] * linear[0] + rgb_to_xyz[c, 1] * linear[1] + rgb_to_xyz[c, 2] * linear[2], 0.)
+        scaled = xyz / white[c]
+        f[c] = np.cbrt(scaled) if scaled > 216.0 / 24389.0 else 7.787 * scaled + 16.0 / 116.0
+
+    out[0] = 116.0 * f[1] - 16.0
+    out[1] = 500.0 * (f[0] - f[1])
+    out[2] = 200.0 * (f[1] - f[2])
+
+
+@_jit
+def _vision_space_labs(rgb: np.ndarray, matrices: np.ndarray, normals: np.ndarray,
+                       rgb_to_xyz: np.ndarray, white: np.ndarray, out: np.ndarray):
+    linear = np.empty(3)
+    simulated = np.empty(3)
+    for k in range(rgb.shape[0]):
+        _lab_into(min(max(rgb[k, 0], 0.), 255.), min(max(rgb[k, 1], 0.), 255.), min(max(rgb[k, 2], 0.), 255.),
+                  rgb_to_xyz, white, out[0, k])
+
+        # bretel.sRGB_to_lRGB_array
+        for c in range(3):
+            value = rgb[k, c] / 255.
+            linear[c] = value / 12.92 if value < 0.0404482362771082 else ((value + 0.055) / 1.055) ** 2.4
+
+        for space in range(matrices.shape[0]):
+            # bretel.brettel_array at full severity, then bretel.lRGB_to_sRGB_array clipped to [0, 255]
+            dot = normals[space, 0] * linear[0] + normals[space, 1] * linear[1] + normals[space, 2] * linear[2]
+            plane = 0 if dot >= 0 else 1
+            for c in range(3):
+                value = (matrices[space, plane, c, 0] * linear[0] + matrices[space, plane, c, 1] * linear[1] +
+                         matrices[space, plane, c, 2] * linear[2])
+                if value <= 0:
+                    simulated[c] = 0.
+                elif value >= 1:
+                    simulated[c] = 255.
+                elif value <= 0.00313066844250063:
+                    simulated[c] = 0.5 + value * 12.92 * 255
+                else:
+                    simulated[c] = 255 * value ** (1.0 / 2.4)
+            _lab_into(simulated[0], simulated[1], simulated[2], rgb_to_xyz, white, out[space + 1, k])
+
+
+@_jit
+def _delta_e(L1: float, a1: float, b1: float, L2: float, a2: float, b2: float) -> float:
+    """
+    color_diff.delta_e_cie2000_pairs of a single pair, with Kl = Kc = Kh = 1
+    """
+    avg_Lp = (L1 + L2) / 2.0
+
+    C1 = np.sqrt(a1 ** 2 + b1 ** 2)
+    C2 = np.sqrt(a2 ** 2 + b2 ** 2)
+    avg_C1_C2 = (C1 + C2) / 2.0
+
+    G = 0.5 * (1 - np.sqrt(avg_C1_C2 ** 7.0 / (avg_C1_C2 ** 7.0 + 25.0 ** 7.0)))
+
+    a1p = (1.0 + G) * a1
+    a2p = (1.0 + G) * a2
+
+    C1p = np.sqrt(a1p ** 2 + b1 ** 2)
+    C2p = np.sqrt(a2p ** 2 + b2 ** 2)
+    avg_C1p_C2p = (C1p + C2p) / 2.0
+
+    h1p = np.degrees(np.arctan2(b1, a1p))
+    if h1p < 0:
+        h1p += 360
+    h2p = np.degrees(np.arctan2(b2, a2p))
+    if h2p < 0:
+        h2p += 360
+
+    avg_Hp = ((360 if np.fabs(h1p - h2p) > 180 else 0) + h1p + h2p) / 2.0
+
+    T = (1 - 0.17 * np.cos(np.radians(avg_Hp - 30)) +
+         0.24 * np.cos(np.radians(2 * avg_Hp)) +
+         0.32 * np.cos(np.radians(3 * avg_Hp + 6)) -
+         0.2 * np.cos(np.radians(4 * avg_Hp - 63)))
+
+    diff_h2p_h1p = h2p - h1p
+    delta_hp = diff_h2p_h1p + (360 if np.fabs(diff_h2p_h1p) > 180 else 0)
+    if h2p > h1p:
+        delta_hp -= 720
+
+    delta_Lp = L2 - L1
+    delta_Cp = C2p - C1p
+    delta_Hp = 2 * np.sqrt(C2p * C1p) * np.sin(np.radians(delta_hp) / 2.0)
+
+    S_L = 1 + ((0.015 * (avg_Lp - 50) ** 2) / np.sqrt(20 + (avg_Lp - 50) ** 2.0))
+    S_C = 1 + 0.045 * avg_C1p_C2p
+    S_H = 1 + 0.015 * avg_C1p_C2p * T
+
+    delta_ro = 30 * np.exp(-(((avg_Hp - 275) / 25) ** 2.0))
+    R_C = np.sqrt((avg_C1p_C2p ** 7.0) / (avg_C1p_C2p ** 7.0 + 25.0 ** 7.0))
+    R_T = -2 * R_C * np.sin(2 * np.radians(delta_ro))
+
+    return np.sqrt(
+        (delta_Lp / S_L) ** 2 +
+        (delta_Cp / S_C) ** 2 +
+        (delta_Hp / S_H) ** 2 +
+        R_T * (delta_Cp / S_C) * (delta_Hp / S_H))
+
+
+@_jit
+def _delta_e_cross(lab1: np.ndarray, lab2: np.ndarray, out: np.ndarray):
+    for s in range(lab1.shape[0]):
+        for i in range(lab1.shape[1]):
+            for j in range(lab2.shape[1]):
+                out[s, i, j] = _delta_e(lab1[s, i, 0], lab1[s, i, 1], lab1[s, i, 2],
+                                        lab2[s, j, 0], lab2[s, j, 1], lab2[s, j, 2])
+
+
+@_jit
+def _delta_e_matrix(lab: np.ndarray, out: np.ndarray):
+    for s in range(lab.shape[0]):
+        for i in range(lab.shape[1]):
+            out[s, i, i] = 0
+            for j in range(i + 1, lab.shape[1]):
+                distance = _delta_e(lab[s, i, 0], lab[s, i, 1], lab[s, i, 2],
+                                    lab[s, j, 0], lab[s, j, 1], lab[s, j, 2])
+                out[s, i, j] = distance
+                out[s, j, i] = distance
+
+
+@_jit
+def _rescan_row(distances: np.ndarray, row: int, high: np.ndarray, high_index: np.ndarray,
+                low: np.ndarray, low_index: np.ndarray):
+    high[row, 0] = high[row, 1] = -np.inf
+    low[row, 0] = low[row, 1] = np.inf
+    high_index[row, 0] = high_index[row, 1] = low_index[row, 0] = low_index[row, 1] = -1
+    for column in range(distances.shape[1]):
+        if column == row:
+            continue
+        value = distances[row, column]
+        if value > high[row, 0]:
+            high[row, 1], high_index[row, 1] = high[row, 0], high_index[row, 0]
+            high[row, 0], high_index[row, 0] = value, column
+        elif value > high[row, 1]:
+            high[row, 1], high_index[row, 1] = value, column
+        if value < low[row, 0]:
+            low[row, 1], low_index[row, 1] = low[row, 0], low_index[row, 0]
+            low[row, 0], low_index[row, 0] = value, column
+        elif value < low[row, 1]:
+            low[row, 1], low_index[row, 1] = value, column
+
+
+@_jit
+def row_extremes_update(distances: np.ndarray, index: int, high: np.ndarray, high_index: np.ndarray,
+                        low: np.ndarray, low_index: np.ndarray):
+    """
+    objective._RowExtremes.update, on its arrays
+    """
+    for row in range(distances.shape[0]):
+        if (row == index or high_index[row, 0] == index or high_index[row, 1] == index or
+                low_index[row, 0] == index or low_index[row, 1] == index):
+            _rescan_row(distances, row, high, high_index, low, low_index)
+            continue
+        value = distances[row, index]
+        if value > high[row, 0]:
+            high[row, 1], high_index[row, 1] = high[row, 0], high_index[row, 0]
+            high[row, 0], high_index[row, 0] = value, index
+        elif value > high[row, 1]:
+            high[row, 1], high_index[row, 1] = value, index
+        if value < low[row, 0]:
+            low[row, 1], low_index[row, 1] = low[row, 0], low_index[row, 0]
+            low[row, 0], low_index[row, 0] = value, index
+        elif value < low[row, 1]:
+            low[row, 1], low_index[row, 1] = value, index
+
+
+@_jit
+def row_extremes_without(index: int, high: np.ndarray, high_index: np.ndarray,
+                         low: np.ndarray, low_index: np.ndarray):
+    """
+    objective._RowExtremes.without, on its arrays
+    """
+    highest, lowest = -np.inf, np.inf
+    for row in range(high.shape[0]):
+        if row == index:
+            continue
+        highest = max(highest, high[row, 1] if high_index[row, 0] == index else high[row, 0])
+        lowest = min(lowest, low[row, 1] if low_index[row, 0] == index else low[row, 0])
+    return highest, lowest
+
+
+def _constants():
+    """
+    The color math constants the kernels take as arguments, imported on first use
+    """
+    from bretel import _BRETTEL_MATRICES
+    from color import D65_WHITE, RGB_TO_XYZ
+    matrices = np.array([[_BRETTEL_MATRICES[cb_type][0], _BRETTEL_MATRICES[cb_type][1]]
+                         for cb_type in ('protan', 'deutan', 'tritan')])
+    normals = np.array([_BRETTEL_MATRICES[cb_type][2] for cb_type in ('protan', 'deutan', 'tritan')])
+    return matrices, normals, RGB_TO_XYZ, D65_WHITE
+
+
+_CONSTANTS = None
+
+
+def vision_space_labs(rgb: np.ndarray) -> np.ndarray:
+    """
+    objective.vision_space_labs, without lookup tables
+
+    Args:
+        rgb: An (N, 3) array of colors in [0, 255]
+
+    Returns:
+        An (4, N, 3) array of Lab values, in objective.VISION_SPACES order
+    """
+    global _CONSTANTS
+    if _CONSTANTS is None:
+        _CONSTANTS = _constants()
+    rgb = np.ascontiguousarray(rgb, dtype=float).reshape(-1, 3)
+    out = np.empty((4, len(rgb), 3))
+    _vision_space_labs(rgb, *_CONSTANTS, out)
+    return out
+
+
+def delta_e_cross(lab1: np.ndarray, lab2: np.ndarray, dtype: type = np.float64) -> np.ndarray:
+    """
+    color_diff.delta_e_cie2000_cross, for one or a stack of palette pairs
+
+    Args:
+        lab1: An (N, 3) or (S, N, 3) array of Lab values
+        lab2: An (M, 3) or (S, M, 3) array of Lab values
+        dtype: The dtype of the result
+
+    Returns:
+        An (N, M) or (S, N, M) array where [..., i, j] is the ΔE between lab1[..., i, :] and lab2[..., j, :]
+    """
+    lab1, lab2 = np.asarray(lab1, dtype=float), np.asarray(lab2, dtype=float)
+    stacked = lab1.ndim == 3
+    if not stacked:
+        lab1, lab2 = lab1[None], lab2[None]
+    out = np.empty((lab1.shape[0], lab1.shape[1], lab2.shape[1]), dtype=dtype)
+    _delta_e_cross(lab1, lab2, out)
+    return out if stacked else out[0]
+
+
+def delta_e_matrix(lab: np.ndarray, dtype: type = np.float64) -> np.ndarray:
+    """
+    color_diff.delta_e_cie2000_matrix(lab, condensed=False), for one or a stack of palettes
+
+    Args:
+        lab: An (N, 3) or (S, N, 3) array of Lab values
+        dtype: The dtype of the result
+
+    Returns:
+        An (N, N) or (S, N, N) symmetric distance matrix
+    """
+    lab = np.asarray(lab, dtype=float)
+    stacked = lab.ndim == 3
+    if not stacked:
+        lab = lab[None]
+    out = np.empty((lab.shape[0], lab.shape[1], lab.shape[1]), dtype=dtype)
+    _delta_e_matrix(lab, out)
+    return out if stacked else out[0]
@@ -0,0 +1,152 @@
+# Optional precomputed lookup tables for the color math.
+#
+# Every 24-bit color gets its Lab value (float32) and its simulated color in each CVD vision space (uint8),
+# stored as .npy files and memory-mapped, so a process pays for the conversions once per machine instead of
+# once per run, and all processes using the same directory share the same pages.
+#
+# Lookups round colors to whole numbers. anneal keeps its colors whole already, so only the simulated colors
+# are affected, by at most half a unit per channel.
+#
+# Usage:
+#     > python lut.py [directory]     # build the tables once (~400MB)
+#     > lut.enable([directory])       # at startup, in each process
+import os
+import sys
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+import bretel
+import color
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'color_generator', 'lut')
+DEFAULT_VISION_SPACES = ('Protanopia', 'Deuteranopia', 'Tritanopia')
+TABLE_SIZE = 256 ** 3
+# part of cache.cache_key while tables are in use, bump it when a change to build_tables changes their values
+TABLE_VERSION = 1
+
+
+def _table_path(directory: str, name: str) -> str:
+    return os.path.join(directory, f'{name}.npy')
+
+
+def build_tables(directory: str = DEFAULT_DIRECTORY,
+                 vision_spaces: Iterable[str] = DEFAULT_VISION_SPACES,
+                 chunk_size: int = 1 << 20):
+    """
+    Computes the lookup tables and writes them to disk, a chunk at a time
+
+    Args:
+        directory: Where to write the tables
+        vision_spaces: The Brettel vision spaces to build simulation tables for
+        chunk_size: How many colors to convert at once
+
+    Side Effect:
+        Writes lab.npy and one <vision space>.npy per vision space into directory
+    """
+    os.makedirs(directory, exist_ok=True)
+    vision_spaces = [v for v in vision_spaces if v != 'Normal']
+
+    tables = {'lab': ((TABLE_SIZE, 3), np.float32)}
+    tables.update({v: ((TABLE_SIZE, 3), np.uint8) for v in vision_spaces})
+
+    # write under temporary names so a half-written table is never picked up
+    outputs = {name: np.lib.format.open_memmap(_table_path(directory, name) + '.tmp', mode='w+',
+                                               dtype=dtype, shape=shape)
+               for name, (shape, dtype) in tables.items()}
+
+    for start in range(0, TABLE_SIZE, chunk_size):
+        keys = np.arange(start, min(start + chunk_size, TABLE_SIZE))
+        rgb = np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=-1).astype(float)
+
+        outputs['lab'][start:start + len(keys)] = color.rgb_to_lab(rgb, use_table=False)
+        simulated = bretel.simulate(rgb, vision_spaces, use_tables=False)
+        for v in vision_spaces:
+            outputs[v][start:start + len(keys)] = np.rint(np.clip(simulated[v], 0, 255))
+
+    for table in outputs.values():
+        table.flush()
+    del outputs
+
+    for name in tables:
+        os.replace(_table_path(directory, name) + '.tmp', _table_path(directory, name))
+
+
+def load_tables(directory: str = DEFAULT_DIRECTORY) -> Dict[str, np.ndarray]:
+    """
+    Memory-maps the tables found in directory
+
+    Returns:
+        A dict of 'lab' or vision space -> read-only (2 ** 24, 3) memory-mapped table
+    """
+    names = [f[:-len('.npy')] for f in sorted(os.listdir(directory)) if f.endswith('.npy')]
+    if 'lab' not in names:
+        raise FileNotFoundError(f'No lookup tables in {directory}. Build them with lut.build_tables')
+    return {name: np.load(_table_path(directory, name), mmap_mode='r') for name in names}
+
+
+def enable(directory: str = DEFAULT_DIRECTORY, build: bool = False) -> Dict[str, np.ndarray]:
+    """
+    Makes color.rgb_to_lab and bretel.simulate use the tables in directory
+
+    Args:
+        directory: Where the tables are
+        build: build the tables first if they are missing
+
+    Returns:
+        The memory-mapped tables
+    """
+    if build and not os.path.exists(_table_path(directory, 'lab')):
+        build_tables(directory)
+
+    tables = load_tables(directory)
+    color.use_lab_table(tables['lab'])
+    bretel.use_cvd_tables({name: table for name, table in tables.items() if name != 'lab'})
+    return tables
+
+
+def enabled() -> bool:
+    """
+    Whether lookup tables are installed
+    """
+    return color._lab_table is not None or bool(bretel._cvd_tables)
+
+
+def fingerprint() -> Optional[Dict]:
+    """
+    What determines how the installed tables change results, for cache.cache_key: the table version and
+    resolution and which tables are installed. None without tables
+    """
+    if not enabled():
+        return None
+    names = (['lab'] if color._lab_table is not None else []) + sorted(bretel._cvd_tables)
+    return {'version': TABLE_VERSION, 'size': TABLE_SIZE, 'tables': names}
+
+
+def disable():
+    """
+    Goes back to computing the color math
+    """
+    color.use_lab_table(None)
+    bretel.use_cvd_tables({})
+
+
+@contextmanager
+def using(directory: str = DEFAULT_DIRECTORY) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Enables the tables in directory for a with block, then puts back whatever was installed before
+
+    Usage:
+        > with lut.using(directory):
+        >     simulate(rgb, VISION_SPACES)
+    """
+    previous = color._lab_table, dict(bretel._cvd_tables)
+    try:
+        yield enable(directory)
+    finally:
+        color.use_lab_table(previous[0])
+        bretel.use_cvd_tables(previous[1])
+
+
+if __name__ == '__main__':
+    build_tables(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DIRECTORY)
@@ -0,0 +1,98 @@
+# The color difference metrics the objective can measure distances with.
+#
+# CIEDE2000 is what obj_fn is defined with. The others are cheaper approximations for the hot early part of an
+# annealing schedule, where nearly every move is accepted anyway. Each metric is scaled to match CIEDE2000
+# distances on average (see calibrate), so the objective keeps its magnitude, and with it the meaning of the
+# temperature, when anneal switches metrics part way through.
+import numpy as np
+from typing import Callable, Dict, NamedTuple
+
+from bretel import sRGB_to_lRGB_array
+from color import rgb_to_lab
+from color_diff import delta_e_cie2000_pairs, delta_e_cie76_pairs, delta_e_cie94_pairs
+
+# linear sRGB -> LMS and cube-rooted LMS -> OKLab, see https://bottosson.github.io/posts/oklab/
+OKLAB_M1 = np.array([[0.4122214708, 0.5363325363, 0.0514459929],
+                     [0.2119034982, 0.6806995451, 0.1073969566],
+                     [0.0883024619, 0.2817188376, 0.6299787005]])
+OKLAB_M2 = np.array([[0.2104542553, 0.7936177850, -0.0040720468],
+                     [1.9779984951, -2.4285922050, 0.4505937099],
+                     [0.0259040371, 0.7827717662, -0.8086757660]])
+OKLAB_M1_INV = np.linalg.inv(OKLAB_M1)
+OKLAB_M2_INV = np.linalg.inv(OKLAB_M2)
+
+
+def rgb_to_oklab(rgb: np.ndarray) -> np.ndarray:
+    """
+    Converts sRGB colors to OKLab
+
+    Args:
+        rgb: An (..., 3) array of colors with values in [0, 255]
+
+    Returns:
+        An (..., 3) array of [L, a, b] values, L in [0, 1]
+    """
+    lms = sRGB_to_lRGB_array(rgb) @ OKLAB_M1.T
+    return np.cbrt(lms) @ OKLAB_M2.T
+
+
+def oklab_to_lrgb(oklab: np.ndarray) -> np.ndarray:
+    """
+    Converts OKLab colors to linear sRGB, the inverse of rgb_to_oklab before its gamma curve.
+    Colors outside the sRGB gamut come out with channels outside [0, 1]
+
+    Args:
+        oklab: An (..., 3) array of [L, a, b] values
+
+    Returns:
+        An (..., 3) array of linear RGB values
+    """
+    return (np.asarray(oklab, dtype=float) @ OKLAB_M2_INV.T) ** 3 @ OKLAB_M1_INV.T
+
+
+class Metric(NamedTuple):
+    """
+    A color difference metric: the color space it measures in and the distance within it
+    """
+    convert: Callable[[np.ndarray], np.ndarray]  # (..., 3) sRGB in [0, 255] -> (..., 3) coordinates
+    pairs: Callable[[np.ndarray, np.ndarray], np.ndarray]  # element-wise, broadcasting distance between coordinates
+    scale: float  # multiplies the distances onto CIEDE2000's magnitude
+    lab: bool  # whether the coordinates are colormath Lab values, like Color.lab
+
+
+METRICS: Dict[str, Metric] = {
+    'ciede2000': Metric(rgb_to_lab, delta_e_cie2000_pairs, 1.0, True),
+    'cie94': Metric(rgb_to_lab, delta_e_cie94_pairs, 0.0495, True),
+    'cie76': Metric(rgb_to_lab, delta_e_cie76_pairs, 0.0128, True),
+    'oklab': Metric(rgb_to_oklab, delta_e_cie76_pairs, 292.0, False),
+}
+
+
+def distance_function(name: str) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+    """
+    The scaled, element-wise distance function of a metric
+
+    Args:
+        name: A key of METRICS
+    """
+    metric = METRICS[name]
+    if metric.scale == 1:
+        return metric.pairs
+    return lambda coordinates1, coordinates2: metric.scale * metric.pairs(coordinates1, coordinates2)
+
+
+def calibrate(name: str, samples: int = 100000, seed: int = 0) -> float:
+    """
+    The scale that makes a metric's median distance between random colors match CIEDE2000's.
+    Used to set the scales in METRICS
+
+    Args:
+        name: A key of METRICS
+        samples: How many random pairs of colors to compare
+        seed: Seeds the random colors
+    """
+    rgb = np.random.RandomState(seed).randint(0, 256, (2, samples, 3)).astype(float)
+    metric = METRICS[name]
+    reference = delta_e_cie2000_pairs(rgb_to_lab(rgb[0]), rgb_to_lab(rgb[1]))
+    distances = metric.pairs(metric.convert(rgb[0]), metric.convert(rgb[1]))
+    return float(np.median(reference) / np.median(distances))
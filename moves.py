@@ -0,0 +1,202 @@
+# Move generators for run_schedule and anneal: how a color of the state is changed for a proposal.
+#
+# RGBMoves is the original move, see color.nearby_rgbs: a random channel drifts by -5% to +5%, clipped to
+# [0, 255]. Equal RGB steps are perceptually very uneven, and clipping pins a lot of proposals on the edges of the
+# gamut, where they often repeat the current color.
+#
+# OKLabMoves steps in OKLab instead, where a step of a given length is about equally visible anywhere. Steps
+# shrink with the temperature, and a running acceptance rate nudges their size towards target_acceptance. A step
+# that leaves the sRGB gamut keeps its lightness and hue and has its chroma reduced until it fits, rather than
+# having its channels clipped.
+#
+# Usage:
+#     > moves = OKLabMoves()
+#     > colors = anneal(target_colors, moves=moves)
+#     > moves.acceptance_rate
+import numpy as np
+from abc import ABC, abstractmethod
+from typing import Optional, Union
+
+from color import nearby_rgbs
+from metrics import oklab_to_lrgb, rgb_to_oklab
+
+
+def lrgb_to_rgb(lrgb: np.ndarray) -> np.ndarray:
+    """
+    The exact inverse of bretel.sRGB_to_lRGB_array
+
+    Args:
+        lrgb: An array of linear RGB values in [0, 1]
+
+    Returns:
+        An array of the same shape of sRGB values in [0, 255]
+    """
+    lrgb = np.clip(lrgb, 0, 1)
+    return 255 * np.where(lrgb <= 0.0031306684425, lrgb * 12.92, 1.055 * lrgb ** (1 / 2.4) - 0.055)
+
+
+def gamut_map(oklab: np.ndarray, iterations: int = 12) -> np.ndarray:
+    """
+    Maps OKLab colors into the sRGB gamut by reducing their chroma at constant lightness and hue.
+    Colors already in the gamut are left as they are
+
+    Args:
+        oklab: An (N, 3) array of [L, a, b] values
+        iterations: Bisection steps, each halves the error of the chroma
+
+    Returns:
+        An (N, 3) array of sRGB colors in [0, 255]
+    """
+    oklab = np.array(oklab, dtype=float)
+    oklab[:, 0] = np.clip(oklab[:, 0], 0, 1)
+
+    def in_gamut(scale: np.ndarray) -> np.ndarray:
+        lrgb = oklab_to_lrgb(np.column_stack([oklab[:, 0], oklab[:, 1:] * scale[:, None]]))
+        return np.all((lrgb >= -1e-9) & (lrgb <= 1 + 1e-9), axis=1)
+
+    # the largest fraction of the chroma that fits, between 0 (gray, always in gamut) and 1
+    scale = np.ones(len(oklab))
+    outside = ~in_gamut(scale)
+    if np.any(outside):
+        low, high = np.zeros(len(oklab)), np.ones(len(oklab))
+        for _ in range(iterations):
+            middle = (low + high) / 2
+            fits = in_gamut(middle)
+            low, high = np.where(fits, middle, low), np.where(fits, high, middle)
+        scale = np.where(outside, low, 1)
+
+    return lrgb_to_rgb(oklab_to_lrgb(np.column_stack([oklab[:, 0], oklab[:, 1:] * scale[:, None]])))
+
+
+class Moves(ABC):
+    def __init__(self):
+        """
+        The interface run_schedule draws proposals from, with the acceptance statistics of the moves drawn.
+        Subclasses implement propose, and can override propose_batch with a vectorized version
+        """
+        self.proposals = 0
+        self.accepted = 0
+
+    @abstractmethod
+    def propose(self, rgb: np.ndarray, count: int, temperature: float,
+                rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+        """
+        Draws count alternatives for a color
+
+        Args:
+            rgb: The current [R, G, B] values, in [0, 255]
+            count: How many alternatives to draw
+            temperature: The current temperature of the schedule
+            rng: The random state to draw from. Defaults to the global numpy one
+
+        Returns:
+            A (count, 3) array of [R, G, B] values in [0, 255]
+        """
+
+    def propose_batch(self, rgbs: np.ndarray, temperatures: np.ndarray,
+                      rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+        """
+        Draws one alternative for each of several colors, each at its own temperature. See tempering.py
+
+        Args:
+            rgbs: An (R, 3) array of [R, G, B] values, in [0, 255]
+            temperatures: An (R,) array of temperatures
+            rng: The random state to draw from. Defaults to the global numpy one
+
+        Returns:
+            An (R, 3) array of [R, G, B] values in [0, 255]
+        """
+        return np.concatenate([self.propose(rgb, 1, temperature, rng)
+                               for rgb, temperature in zip(rgbs, temperatures)])
+
+    def record(self, proposals: int, accepted: int):
+        """
+        Counts how many proposals were tried, and how many of them were accepted. run_schedule accepts at
+        most the last of the proposals for a color
+        """
+        self.proposals += proposals
+        self.accepted += accepted
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposals if self.proposals else 0.
+
+
+class RGBMoves(Moves):
+    def __init__(self, drift_control: float = 0.1):
+        """
+        The original move, color.nearby_rgbs. run_schedule's default
+
+        Args:
+            drift_control: see color.nearby_rgbs
+        """
+        super().__init__()
+        self.drift_control = drift_control
+
+    def propose(self, rgb: np.ndarray, count: int, temperature: float,
+                rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+        return nearby_rgbs(rgb, count, self.drift_control, rng)
+
+    def propose_batch(self, rgbs: np.ndarray, temperatures: np.ndarray,
+                      rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+        return nearby_rgbs(rgbs, len(rgbs), self.drift_control, rng)
+
+
+class OKLabMoves(Moves):
+    def __init__(self, step: float = 0.03, min_step: float = 0.01, max_step: float = 0.3,
+                 temperature_scale: float = 1., target_acceptance: float = 0.3, adapt_every: int = 100):
+        """
+        Gaussian steps in OKLab, mapped back into the sRGB gamut. See the top of this module
+
+        The standard deviation of a step along each axis is step * sqrt(temperature / temperature_scale),
+        times an adaptive factor, kept within [min_step, max_step]. OKLab lightness spans [0, 1], and
+        one unit of an 8-bit channel is a step of about 0.003
+
+        Args:
+            step: The step size at temperature_scale
+            min_step: The smallest step size, so rounding to whole channel values rarely undoes a step
+            max_step: The largest step size
+            temperature_scale: The temperature step is defined at
+            target_acceptance: The acceptance rate the adaptive factor steers towards
+            adapt_every: How many proposals to count between updates of the adaptive factor
+        """
+        super().__init__()
+        self.step = step
+        self.min_step = min_step
+        self.max_step = max_step
+        self.temperature_scale = temperature_scale
+        self.target_acceptance = target_acceptance
+        self.adapt_every = adapt_every
+        self.adaptation = 1.
+        self._window = [0, 0]  # proposals and acceptances since the last update of the adaptive factor
+
+    def step_size(self, temperature: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """
+        The standard deviation of a step along each OKLab axis at temperature, or at each of an array of them
+        """
+        size = self.step * np.sqrt(np.maximum(temperature, 0) / self.temperature_scale) * self.adaptation
+        size = np.clip(size, self.min_step, self.max_step)
+        return float(size) if np.ndim(size) == 0 else size
+
+    def propose(self, rgb: np.ndarray, count: int, temperature: float,
+                rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+        rng = np.random if rng is None else rng
+        steps = rng.randn(count, 3) * self.step_size(temperature)
+        return np.rint(gamut_map(rgb_to_oklab(np.asarray(rgb, dtype=float)) + steps))
+
+    def propose_batch(self, rgbs: np.ndarray, temperatures: np.ndarray,
+                      rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+        rng = np.random if rng is None else rng
+        steps = rng.randn(len(rgbs), 3) * self.step_size(np.asarray(temperatures, dtype=float))[:, None]
+        return np.rint(gamut_map(rgb_to_oklab(np.asarray(rgbs, dtype=float)) + steps))
+
+    def record(self, proposals: int, accepted: int):
+        super().record(proposals, accepted)
+        self._window[0] += proposals
+        self._window[1] += accepted
+        if self._window[0] >= self.adapt_every:
+            rate = self._window[1] / self._window[0]
+            # larger steps are accepted less often. The factor stays within a decade either way
+            factor = 1.2 if rate > self.target_acceptance else 1 / 1.2
+            self.adaptation = float(np.clip(self.adaptation * factor, 0.1, 10))
+            self._window = [0, 0]
@@ -0,0 +1,562 @@
+import copy
+import importlib.util
+import time
+import numpy as np
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import lut
+from bretel import simulate
+from color import Color, rgb_to_lab
+from metrics import METRICS, distance_function
+from palette import Palette
+from target_index import TargetIndex
+
+# the weights annealing.obj_fn combines its scores with
+DEFAULT_WEIGHTS = {'Normal': 1,
+                   'Range': 1,
+                   'Target': 1,
+                   'Protanopia': 0.33,
+                   'Deuteranopia': 0.33,
+                   'Tritanopia': 0.33}
+
+# the vision spaces obj_fn measures pairwise distances in
+VISION_SPACES = ['Normal', 'Protanopia', 'Deuteranopia', 'Tritanopia']
+
+# anneal measures palettes of this many colors or more in the large palette mode: float32 distance matrices,
+# and proposals estimated from LARGE_PALETTE_SAMPLE other colors. See IncrementalObjective
+LARGE_PALETTE_SIZE = 100
+LARGE_PALETTE_SAMPLE = 48
+
+
+def vision_space_labs(rgb: np.ndarray) -> np.ndarray:
+    """
+    Simulates colors in each of the objective's vision spaces and converts them to Lab
+
+    Args:
+        rgb: An (N, 3) array of colors in [0, 255]
+
+    Returns:
+        An (len(VISION_SPACES), N, 3) array of Lab values, in VISION_SPACES order
+    """
+    simulated = simulate(rgb, VISION_SPACES)
+    return rgb_to_lab(np.clip(np.stack([simulated[space] for space in VISION_SPACES]), 0, 255))
+
+
+def compiled_kernels():
+    """
+    The kernels module if Numba is installed and the kernels are enabled, otherwise None. Numba is only
+    imported once an objective is built, so importing this module stays cheap. See kernels.py
+    """
+    if importlib.util.find_spec('numba') is None:
+        return None
+    import kernels
+    return kernels if kernels.enabled() else None
+
+
+class Timings:
+    def __init__(self):
+        """
+        Accumulates the time spent in, and the number of calls to, the stages of the objective
+        """
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def timed(self, stage: str, function: Callable) -> Callable:
+        """
+        Wraps function so its calls are counted towards stage
+        """
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+                self.calls[stage] += 1
+        return timed_function
+
+
+def _top_two(rows: np.ndarray, columns: np.ndarray, exclude: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The two largest values of each row, leaving out one column per row
+
+    Args:
+        rows: An (R, N) array
+        columns: The (N,) column indices of rows
+        exclude: The (R,) column to leave out of each row, e.g. the diagonal
+
+    Returns:
+        (R, 2) arrays of the values, largest first, and of their column indices
+    """
+    values = np.array(rows, dtype=float)
+    values[np.arange(len(values)), exclude] = -np.inf
+    if values.shape[1] < 2:
+        values = np.concatenate([values, np.full((len(values), 2 - values.shape[1]), -np.inf)], axis=1)
+        columns = np.concatenate([columns, np.full(2 - len(columns), -1)])
+    top = np.argpartition(values, -2, axis=1)[:, -2:]
+    top_values = np.take_along_axis(values, top, axis=1)
+    order = np.argsort(-top_values, axis=1)
+    return np.take_along_axis(top_values, order, axis=1), columns[np.take_along_axis(top, order, axis=1)]
+
+
+class _RowExtremes:
+    def __init__(self, distances: np.ndarray, kernels=None):
+        """
+        The two largest and two smallest distances of every row of a symmetric distance matrix, off the
+        diagonal. Gives the max and min over all pairs that don't involve a given color in O(N), where a
+        scan of the pairs is O(N²). Kept up to date in O(N) per moved color, plus an O(N) rescan of each row
+        whose top two involved it, typically a handful
+
+        Args:
+            distances: An (N, N) distance matrix
+            kernels: If given, the kernels module to do the bookkeeping in compiled loops, see compiled_kernels
+        """
+        n = len(distances)
+        self._columns = np.arange(n)
+        self._kernels = kernels
+        self.high, self.high_index = _top_two(distances, self._columns, self._columns)
+        low, self.low_index = _top_two(-distances, self._columns, self._columns)
+        self.low = -low
+
+    def copy(self) -> '_RowExtremes':
+        extremes = copy.copy(self)
+        extremes.high, extremes.high_index = self.high.copy(), self.high_index.copy()
+        extremes.low, extremes.low_index = self.low.copy(), self.low_index.copy()
+        return extremes
+
+    def without(self, index: int) -> Tuple[float, float]:
+        """
+        The largest and smallest distance over the pairs that don't involve index
+        """
+        if self._kernels is not None:
+            return self._kernels.row_extremes_without(index, self.high, self.high_index, self.low, self.low_index)
+        rows = np.arange(len(self.high)) != index
+        high = np.where(self.high_index[rows, 0] == index, self.high[rows, 1], self.high[rows, 0])
+        low = np.where(self.low_index[rows, 0] == index, self.low[rows, 1], self.low[rows, 0])
+        if not len(high):
+            return -np.inf, np.inf
+        return np.max(high), np.min(low)
+
+    def update(self, distances: np.ndarray, index: int):
+        """
+        Catches up with a change to the row and column of index, given the updated matrix
+        """
+        if self._kernels is not None:
+            self._kernels.row_extremes_update(distances, index, self.high, self.high_index, self.low, self.low_index)
+            return
+        row = distances[index]
+        rows = self._columns[self._columns != index]
+        values = row[rows]
+
+        # rows whose top two included the old value are rescanned, the others take the new one in if it ranks
+        stale = np.any(self.high_index[rows] == index, axis=1) | np.any(self.low_index[rows] == index, axis=1)
+        fresh = rows[~stale]
+        for sign, top, top_index in ((1, self.high, self.high_index), (-1, self.low, self.low_index)):
+            value = sign * values[~stale]
+            first, second = sign * top[fresh, 0], sign * top[fresh, 1]
+            new_first, new_second = value > first, (value > second) & (value <= first)
+            top[fresh[new_first], 1] = top[fresh[new_first], 0]
+            top_index[fresh[new_first], 1] = top_index[fresh[new_first], 0]
+            top[fresh[new_first], 0] = sign * value[new_first]
+            top_index[fresh[new_first], 0] = index
+            top[fresh[new_second], 1] = sign * value[new_second]
+            top_index[fresh[new_second], 1] = index
+
+        rescan = np.append(rows[stale], index)
+        self.high[rescan], self.high_index[rescan] = _top_two(distances[rescan], self._columns, rescan)
+        low, self.low_index[rescan] = _top_two(-distances[rescan], self._columns, rescan)
+        self.low[rescan] = -low
+
+
+class IncrementalObjective:
+    def __init__(self, state: Union[Palette, List[Color]], target_colors: List[Color],
+                 weights: Optional[Dict[str, float]] = None, timings: Optional[Timings] = None,
+                 metric: str = 'ciede2000', dtype: type = np.float64, sample_size: Optional[int] = None,
+                 rng: Optional[np.random.RandomState] = None):
+        """
+        obj_fn for a state that changes one color at a time.
+
+        Keeps the pairwise distance matrix of every vision space, the distance of every color to its closest
+        target and the extremes of every row (for Range), so a proposal that moves a single color only computes
+        that color's distances: O(N) per proposal.
+
+        For large palettes, proposals can estimate the pairwise terms from a random sample of the other colors
+        instead, O(sample_size) per proposal. The error of each estimate is bounded in self.bounds, and a committed
+        proposal is recomputed exactly, so errors never pile up. See LARGE_PALETTE_SIZE
+
+        Usage:
+            > cost = objective.propose(i, new_rgb)
+            > objective.commit()  # or objective.rollback()
+
+        Args:
+            state: A list of colors representing the current state of the optimization
+            target_colors: A list of colors representing the goal to work towards
+            weights: Overrides for DEFAULT_WEIGHTS
+            timings: If given, the time spent in the Brettel simulation, the color space conversion and ΔE
+                     is accumulated into it as 'brettel', 'lab' and 'delta_e'
+            metric: The color difference to measure distances with, a key of metrics.METRICS.
+                    obj_fn itself is 'ciede2000', see set_metric
+            dtype: The dtype to store the distance matrices in, e.g. np.float32 to halve their memory
+            sample_size: Estimate proposals from this many other colors, when there are more
+            rng: The random state to draw the samples from. Defaults to the global numpy one
+        """
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.timings = timings
+        self._simulate = simulate if timings is None else timings.timed('brettel', simulate)
+
+        self.target_colors = target_colors
+        self.palette = state.copy() if isinstance(state, Palette) else Palette.from_colors(state)
+        self.dtype = dtype
+        self.sample_size = sample_size
+        self._rng = np.random if rng is None else rng
+
+        n = len(self.palette)
+        self.pair_count = n * (n - 1) / 2
+
+        self.set_metric(metric)
+
+    def set_metric(self, metric: str):
+        """
+        Switches the color difference the objective measures distances with, rebuilding the cached distances.
+        Other metrics than 'ciede2000' are cheaper approximations of obj_fn, scaled to its magnitude
+
+        Args:
+            metric: A key of metrics.METRICS
+        """
+        self.metric = metric
+        self._metric = METRICS[metric]
+        convert, delta_e = self._metric.convert, distance_function(metric)
+
+        # (S, K, 3) x (S, M, 3) coordinates -> (S, K, M) distances
+        def cross(coordinates1, coordinates2):
+            return delta_e(coordinates1[:, :, None, :], coordinates2[:, None, :, :])
+
+        # the compiled kernels reproduce the CIEDE2000 path without lookup tables, see kernels.py
+        kernels = compiled_kernels() if metric == 'ciede2000' else None
+        self._fused = kernels is not None and not lut.enabled()
+        if kernels is not None:
+            cross = kernels.delta_e_cross
+            convert = kernels.vision_space_labs if self._fused else convert
+
+        if metric == 'ciede2000':
+            # built once per objective, i.e. once per anneal call
+            self.targets = TargetIndex([c.lab for c in self.target_colors],
+                                       cross=kernels.delta_e_cross if kernels is not None else None)
+            target_distances = self.targets.distances
+        else:
+            target_coordinates = convert(np.array([c.rgb for c in self.target_colors], dtype=float).reshape(-1, 3))
+            def target_distances(coordinates):
+                return np.min(delta_e(coordinates[:, None, :], target_coordinates[None, :, :]), axis=1)
+
+        # the hot path stages, only wrapped when they are timed
+        timings = self.timings
+        self._convert = convert if timings is None else timings.timed('lab', convert)
+        self._cross = cross if timings is None else timings.timed('delta_e', cross)
+        self._target_distances = target_distances if timings is None else timings.timed('delta_e', target_distances)
+
+        # one (N, 3) array of coordinates (Lab for CIEDE2000) / (N, N) distance matrix per vision space,
+        # stacked in VISION_SPACES order. Computed a block of rows at a time, to bound the temporaries
+        self.lab = self._vision_space_labs(self.palette.srgb)
+        n = len(self.palette)
+        if kernels is not None:
+            # every pair once, straight into the matrix
+            self.distances = kernels.delta_e_matrix(self.lab, self.dtype)
+        else:
+            self.distances = np.empty((len(VISION_SPACES), n, n), dtype=self.dtype)
+            block = max(1, (1 << 16) // max(n, 1))
+            for start in range(0, n, block):
+                self.distances[:, start:start + block] = self._cross(self.lab[:, start:start + block], self.lab)
+        self.sums = self.distances.sum(axis=(1, 2), dtype=float) / 2
+        self.target_distances = self._target_distances(self.lab[0])
+        self._extremes = _RowExtremes(self.distances[0], kernels)
+        highest, lowest = self._extremes.without(-1)
+        self.range = highest - lowest
+
+        self.cost = self.combine(self.scores())
+        self.bounds = None
+        self._pending = None
+
+    def copy(self, weights: Optional[Dict[str, float]] = None,
+             rng: Optional[np.random.RandomState] = None) -> 'IncrementalObjective':
+        """
+        An independent objective for the same state, reusing the distances this one has already computed.
+        Only the cost is recomputed, so re-weighting a state is O(1) rather than O(N²) distance computations.
+        The target index is shared, as it never changes
+
+        Args:
+            weights: Overrides for DEFAULT_WEIGHTS. Defaults to the weights of this objective
+            rng: The random state the copy draws its samples from. Defaults to this objective's
+
+        Returns:
+            An IncrementalObjective
+        """
+        objective = copy.copy(self)
+        objective.weights = dict(self.weights) if weights is None else {**DEFAULT_WEIGHTS, **weights}
+        objective._rng = self._rng if rng is None else rng
+        objective.palette = self.palette.copy()
+        objective.lab = self.lab.copy()
+        objective.distances = self.distances.copy()
+        objective.sums = self.sums.copy()
+        objective.target_distances = self.target_distances.copy()
+        objective._extremes = self._extremes.copy()
+        objective.cost = objective.combine(objective.scores())
+        objective.bounds = None
+        objective._pending = None
+        return objective
+
+    def extend(self, rgbs: np.ndarray):
+        """
+        Appends colors to the state. Only the distances that involve the new colors are computed, the ones
+        between the colors already in the state are kept: growing N colors by K is O(K·N) distance computations
+        rather than O(N²). See growth.py
+
+        Args:
+            rgbs: A (K, 3) array of colors in [0, 255]
+        """
+        rgbs = np.clip(np.asarray(rgbs, dtype=float).reshape(-1, 3), 0, 255)
+        lab = self._vision_space_labs(rgbs)
+        n, count = len(self.palette), len(rgbs)
+        self.palette.append(rgbs, lab[0] if self._metric.lab else None)
+        self.lab = np.concatenate([self.lab, lab], axis=1)
+        self.pair_count = (n + count) * (n + count - 1) / 2
+
+        # (S, K, N + K) distances from the new colors to all of them
+        rows = self._cross(lab, self.lab)
+        rows[:, np.arange(count), n + np.arange(count)] = 0
+        distances = np.empty((len(VISION_SPACES), n + count, n + count), dtype=self.dtype)
+        distances[:, :n, :n] = self.distances
+        distances[:, n:] = rows
+        distances[:, :n, n:] = rows[:, :, :n].transpose(0, 2, 1)
+        self.distances = distances
+
+        self.sums = self.distances.sum(axis=(1, 2), dtype=float) / 2
+        self.target_distances = np.concatenate([self.target_distances, self._target_distances(lab[0])])
+        self._extremes = _RowExtremes(self.distances[0], self._extremes._kernels)
+        highest, lowest = self._extremes.without(-1)
+        self.range = highest - lowest
+
+        self.cost = self.combine(self.scores())
+        self.bounds = None
+        self._pending = None
+
+    @property
+    def rgb(self) -> np.ndarray:
+        return self.palette.srgb
+
+    def _vision_space_labs(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        vision_space_labs, through the (possibly timed) stages and the metric of this objective.
+        The compiled kernels do it in a single stage, timed as 'lab'
+        """
+        if self._fused:
+            return self._convert(rgb)
+        simulated = self._simulate(rgb, VISION_SPACES)
+        return self._convert(np.clip(np.stack([simulated[space] for space in VISION_SPACES]), 0, 255))
+
+    def scores(self, sums: Optional[np.ndarray] = None, distance_range: Optional[float] = None,
+               target_distances: Optional[np.ndarray] = None) -> Dict[str, float]:
+        """
+        The unweighted obj_fn scores, for the current state unless replacement values are given.
+        Replacement values can have an extra axis for a batch of states, see propose_many
+
+        Returns:
+            A dict of score name -> value, keyed like DEFAULT_WEIGHTS
+        """
+        sums = self.sums if sums is None else sums
+        distance_range = self.range if distance_range is None else distance_range
+        target_distances = self.target_distances if target_distances is None else target_distances
+        return {
+            **{space: 100 - total / self.pair_count for space, total in zip(VISION_SPACES, sums)},
+            'Range': distance_range,
+            'Target': np.average(target_distances, axis=-1)}
+
+    def combine(self, scores: Dict[str, float]) -> float:
+        """
+        Weighted sum of the scores
+        """
+        return sum(self.weights[name] * score for name, score in scores.items())
+
+    def propose(self, index: int, rgb: np.ndarray) -> float:
+        """
+        Scores the current state with the color at index replaced by rgb. Follow up with commit or rollback
+
+        Args:
+            index: The index of the color to replace
+            rgb: The replacement color as [R, G, B] in [0, 255]
+
+        Returns:
+            The objective value of the proposed state
+        """
+        return self.propose_many(index, np.asarray(rgb, dtype=float)[None, :])[0]
+
+    def propose_many(self, index: int, rgbs: np.ndarray) -> np.ndarray:
+        """
+        Scores a batch of alternative replacements for the color at index in one go.
+        Follow up with commit(candidate) or rollback
+
+        With a sample_size smaller than the palette, the pairwise scores of each candidate are estimated from
+        its distances to a random sample of the other colors, and self.bounds holds three standard errors of
+        each estimate (in cost units). The candidate's contribution to Range is taken from the sample too,
+        which can only narrow it. Otherwise the scores are exact and the bounds are zero. See confirm
+
+        Args:
+            index: The index of the color to replace
+            rgbs: A (K, 3) array of replacement colors in [0, 255]
+
+        Returns:
+            A (K,) array of the objective values of the proposed states
+        """
+        rgbs = np.asarray(rgbs, dtype=float)
+        lab = self._vision_space_labs(rgbs)
+        n = len(self.palette)
+        others = n - 1
+        sampled = self.sample_size is not None and others > self.sample_size
+
+        # (S, K, N) distances from every candidate to every other color (or to the sample), in every vision
+        # space at once
+        if sampled:
+            columns = self._rng.choice(others, self.sample_size, replace=False)
+            columns += columns >= index
+        else:
+            columns = np.flatnonzero(np.arange(n) != index)
+        rows = self._cross(lab, self.lab[:, columns])
+
+        row_sums = rows.sum(axis=2)
+        if sampled:
+            row_sums *= others / self.sample_size
+            # standard error of a sampled sum, without replacement
+            errors = rows.std(axis=2, ddof=1) * others / np.sqrt(self.sample_size) * \
+                np.sqrt(1 - self.sample_size / others)
+            weights = np.array([self.weights[space] for space in VISION_SPACES])
+            self.bounds = 3 * np.sum(weights[:, None] * errors, axis=0) / self.pair_count
+        else:
+            self.bounds = np.zeros(len(rgbs))
+        sums = (self.sums - self.distances[:, index].sum(axis=1, dtype=float))[:, None] + row_sums
+
+        # the range over the pairs that don't involve the moved color, extended by each candidate's pairs
+        highest, lowest = self._extremes.without(index)
+        if len(columns):
+            highest = np.maximum(highest, np.max(rows[0], axis=1))
+            lowest = np.minimum(lowest, np.min(rows[0], axis=1))
+        distance_range = highest - lowest
+
+        target_distances = np.repeat(self.target_distances[None, :], len(rgbs), axis=0)
+        target_distances[:, index] = self._target_distances(lab[0])
+
+        costs = self.combine(self.scores(sums, distance_range, target_distances))
+        self._pending = (index, rgbs, lab, None if sampled else rows, sums, distance_range, target_distances, costs)
+        return costs
+
+    def confirm(self, candidate: int = 0) -> float:
+        """
+        Scores a candidate of the last proposal exactly, if it was estimated from a sample, e.g. when its estimate
+        is too close to call. Its cost and bound are updated in place
+
+        Args:
+            candidate: Which of the proposed replacements to score, for propose_many
+
+        Returns:
+            The exact objective value of the candidate's state
+        """
+        index, rgbs, lab, rows, sums, distance_range, target_distances, costs = self._pending
+        if rows is not None or not self.bounds[candidate]:
+            return costs[candidate]
+
+        row = self._cross(lab[:, candidate:candidate + 1], self.lab)[:, 0]
+        row[:, index] = 0
+        sums[:, candidate] = self.sums - self.distances[:, index].sum(axis=1, dtype=float) + row.sum(axis=1)
+        highest, lowest = self._extremes.without(index)
+        others = np.arange(len(self.palette)) != index
+        distance_range[candidate] = (max(highest, np.max(row[0, others], initial=-np.inf)) -
+                                     min(lowest, np.min(row[0, others], initial=np.inf)))
+        costs[candidate] = self.combine(self.scores(sums[:, candidate], distance_range[candidate],
+                                                    target_distances[candidate]))
+        self.bounds[candidate] = 0
+        return costs[candidate]
+
+    def commit(self, candidate: int = 0):
+        """
+        Accepts the last proposal, making it the current state. An estimated proposal is recomputed exactly
+
+        Args:
+            candidate: Which of the proposed replacements to accept, for propose_many
+        """
+        index, rgbs, lab, rows, sums, distance_range, target_distances, costs = self._pending
+        if rows is None:
+            row = self._cross(lab[:, candidate:candidate + 1], self.lab)[:, 0]
+        else:
+            row = np.insert(rows[:, candidate], index, 0, axis=1)
+        row[:, index] = 0
+
+        old_sums = self.distances[:, index].sum(axis=1, dtype=float)
+        self.palette.set(index, rgbs[candidate], lab[0, candidate] if self._metric.lab else None)
+        self.lab[:, index] = lab[:, candidate]
+        self.distances[:, index, :] = row
+        self.distances[:, :, index] = row
+        self._extremes.update(self.distances[0], index)
+        self.target_distances = target_distances[candidate]
+
+        if rows is None:
+            self.sums = self.sums - old_sums + row.sum(axis=1)
+            highest, lowest = self._extremes.without(-1)
+            self.range = highest - lowest
+            self.cost = self.combine(self.scores())
+        else:
+            self.sums = sums[:, candidate]
+            self.range = distance_range[candidate]
+            self.cost = costs[candidate]
+        self._pending = None
+
+    def rollback(self):
+        """
+        Discards the last proposal
+        """
+        self._pending = None
+
+
+class FunctionObjective:
+    def __init__(self, state: Union[Palette, List[Color]], objective_function: Callable[[List[Color]], float]):
+        """
+        The propose / commit / rollback interface of IncrementalObjective for an arbitrary objective function.
+        The whole state is re-scored for each proposal, but the current cost is only computed once.
+
+        Args:
+            state: A list of colors representing the current state of the optimization
+            objective_function: A function taking a list of colors and returning its score
+        """
+        self.objective_function = objective_function
+        self.timings = None
+        self.metric = 'ciede2000'  # the function is only ever measured as it is
+        self.palette = state.copy() if isinstance(state, Palette) else Palette.from_colors(state)
+        self.cost = objective_function(self.palette.to_colors())
+        self._pending = None
+
+    @property
+    def rgb(self) -> np.ndarray:
+        return self.palette.srgb
+
+    def extend(self, rgbs: np.ndarray):
+        self.palette.append(rgbs)
+        self.cost = self.objective_function(self.palette.to_colors())
+        self._pending = None
+
+    def propose(self, index: int, rgb: np.ndarray) -> float:
+        return self.propose_many(index, np.asarray(rgb, dtype=float)[None, :])[0]
+
+    def propose_many(self, index: int, rgbs: np.ndarray) -> np.ndarray:
+        palettes, costs = [], []
+        for rgb in rgbs:
+            palette = self.palette.copy()
+            palette.set(index, rgb)
+            palettes.append(palette)
+            costs.append(self.objective_function(palette.to_colors()))
+        self._pending = (palettes, costs)
+        return np.array(costs)
+
+    def commit(self, candidate: int = 0):
+        palettes, costs = self._pending
+        self.palette, self.cost = palettes[candidate], costs[candidate]
+        self._pending = None
+
+    def rollback(self):
+        self._pending = None
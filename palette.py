@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import numpy as np
+from typing import Iterator, List, Optional, Union
+
+from bretel import sRGB_to_lRGB_array
+from color import Color, rgb_to_hex, rgb_to_lab
+
+
+class Palette:
+    __slots__ = ('srgb', 'lrgb', '_lab')
+
+    def __init__(self, srgb: np.ndarray):
+        """
+        An array-backed list of colors. Holds the sRGB and linear RGB values of the whole palette as
+        contiguous (N, 3) float arrays, and computes Lab values and hex codes for all colors at once, on demand.
+
+        Indexing gives Color objects, so a Palette can stand in for a list of colors.
+
+        Args:
+            srgb: An (N, 3) array of colors with values in [0, 255]
+        """
+        self.srgb = np.ascontiguousarray(np.clip(srgb, 0, 255), dtype=float)
+        self.lrgb = sRGB_to_lRGB_array(self.srgb)
+        self._lab = None
+
+    @classmethod
+    def from_colors(cls, color_list: List[Color]) -> Palette:
+        """
+        Initialize a palette from a list of Color objects
+        """
+        return Palette(np.array([c.rgb for c in color_list], dtype=float).reshape(-1, 3))
+
+    @classmethod
+    def from_hex(cls, hex_values: List[str]) -> Palette:
+        """
+        Initialize a palette from hex values, e.g. ['#ffffff', '#000000']
+        """
+        return Palette.from_colors([Color.from_hex(h) for h in hex_values])
+
+    @classmethod
+    def random(cls, count: int, rng: Optional[np.random.RandomState] = None) -> Palette:
+        """
+        A palette of random colors, drawn like Color.random_color
+
+        Args:
+            count: How many colors to draw
+            rng: The random state to draw from. Defaults to the global numpy one
+        """
+        return Palette((np.random if rng is None else rng).choice(range(1, 256), (count, 3)))
+
+    @property
+    def lab(self) -> np.ndarray:
+        """
+        (N, 3) array of the Lab values of the palette
+        """
+        if self._lab is None:
+            self._lab = rgb_to_lab(self.srgb)
+        return self._lab
+
+    @property
+    def hex(self) -> List[str]:
+        return rgb_to_hex(self.srgb)
+
+    def set(self, index: int, rgb: np.ndarray, lab: Optional[np.ndarray] = None):
+        """
+        Replaces a single color in place
+
+        Args:
+            index: The index of the color to replace
+            rgb: The new [R, G, B] values in [0, 255]
+            lab: The matching [L, a, b] values, if already known
+        """
+        self.srgb[index] = np.clip(rgb, 0, 255)
+        self.lrgb[index] = sRGB_to_lRGB_array(self.srgb[index])
+        if self._lab is not None:
+            self._lab[index] = rgb_to_lab(self.srgb[index]) if lab is None else lab
+
+    def append(self, srgb: np.ndarray, lab: Optional[np.ndarray] = None):
+        """
+        Adds colors to the end of the palette, in place
+
+        Args:
+            srgb: A (K, 3) array of colors with values in [0, 255]
+            lab: The matching (K, 3) Lab values, if already known
+        """
+        srgb = np.clip(np.asarray(srgb, dtype=float).reshape(-1, 3), 0, 255)
+        self.srgb = np.concatenate([self.srgb, srgb])
+        self.lrgb = np.concatenate([self.lrgb, sRGB_to_lRGB_array(srgb)])
+        if self._lab is not None:
+            self._lab = np.concatenate([self._lab, rgb_to_lab(srgb) if lab is None else lab])
+
+    def copy(self) -> Palette:
+        palette = Palette.__new__(Palette)
+        palette.srgb = self.srgb.copy()
+        palette.lrgb = self.lrgb.copy()
+        palette._lab = None if self._lab is None else self._lab.copy()
+        return palette
+
+    def to_colors(self) -> List[Color]:
+        """
+        The palette as a list of Color objects
+        """
+        lab = self.lab
+        return [Color.view(self.srgb[i].copy(), lab[i].copy()) for i in range(len(self))]
+
+    def __len__(self) -> int:
+        return len(self.srgb)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Color, Palette]:
+        if isinstance(index, slice):
+            return Palette(self.srgb[index])
+        return Color.view(self.srgb[index].copy(), None if self._lab is None else self._lab[index].copy())
+
+    def __iter__(self) -> Iterator[Color]:
+        return iter(self.to_colors())
+
+    def __repr__(self) -> str:
+        return f"Palette({self.hex})"
@@ -1,33 +1,67 @@
+# Example plots of a palette. Nothing here picks a backend: run.py and `python plotting.py` show the plots
+# interactively, render.py saves them to files with the non-interactive Agg backend.
+#
+# The demo dataset is read from seaborn's local cache (downloaded on the first use only) and, like the
+# synthetic line data, loaded once per process.
+import os
 import random
 import matplotlib
-matplotlib.use('tkAgg')
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import numpy as np
 import pandas as pd
 import seaborn as sns
 from datetime import datetime
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
 
 from common import letter_range, EXAMPLE_COLORS, EXTENDED_COLORS
 
+# where the demo datasets are cached, seaborn's own default unless SEABORN_DATA says otherwise
+DATA_HOME = os.environ.get('SEABORN_DATA', os.path.join(os.path.expanduser('~'), 'seaborn-data'))
 
-def line_plot(color_palette: List[str]):
-    date = datetime.today()
-    date_str = f"{date.day} {date.month} {date.year}"
-    num_colors = len(color_palette)
 
-    sns.set_theme(style="whitegrid")
+@lru_cache(maxsize=None)
+def _dataset(name: str, data_home: str) -> pd.DataFrame:
+    return sns.load_dataset(name, cache=True, data_home=data_home)
+
+
+def load_dataset(name: str, data_home: Optional[str] = None) -> pd.DataFrame:
+    """
+    A seaborn example dataset, read from data_home and only downloaded if it isn't there yet.
+    Parsed once per process
+
+    Args:
+        name: The dataset, e.g. 'planets'
+        data_home: The dataset cache directory, defaults to DATA_HOME
+
+    Returns:
+        A copy of the dataset, free to modify
+    """
+    return _dataset(name, data_home or DATA_HOME).copy()
+
 
+@lru_cache(maxsize=None)
+def _line_data(num_colors: int, date_str: str) -> pd.DataFrame:
     rs = np.random.RandomState(365)
     values = rs.randn(365, num_colors).cumsum(axis=0)
     dates = pd.date_range(date_str, periods=365, freq="D")
     data = pd.DataFrame(values, dates, columns=letter_range(num_colors))
-    data = data.rolling(7).mean()
+    return data.rolling(7).mean()
+
+
+def line_plot(color_palette: List[str], ax=None):
+    date = datetime.today()
+    date_str = f"{date.day} {date.month} {date.year}"
+    num_colors = len(color_palette)
+
+    sns.set_theme(style="whitegrid")
+
+    data = _line_data(num_colors, date_str)
 
     sns.set_palette(sns.color_palette(color_palette))
 
-    sns.lineplot(data=data, linewidth=2.5)
+    return sns.lineplot(data=data, linewidth=2.5, ax=ax).figure
 
 
 def palette_plot(pal: List[str], size: int = 1, ax=None):
@@ -44,20 +78,22 @@ def palette_plot(pal: List[str], size: int = 1, ax=None):
     ax.set_xticklabels(["" for _ in range(n)])
     # set no ticks
     ax.yaxis.set_major_locator(ticker.NullLocator())
+    return ax.figure
 
 
 def comparison_palette_plots(palette1: List[str], palette2: List[str]):
     fig, (ax1, ax2) = plt.subplots(nrows=2, ncols=1)
-    palette_plot(sns.color_palette(EXAMPLE_COLORS), ax=ax1)
-    palette_plot(sns.color_palette(EXTENDED_COLORS), ax=ax2)
+    palette_plot(sns.color_palette(palette1), ax=ax1)
+    palette_plot(sns.color_palette(palette2), ax=ax2)
+    return fig
 
 
-def joint_and_marginal_histogram(color_palette: List[str]):
+def joint_and_marginal_histogram(color_palette: List[str], data_home: Optional[str] = None):
     sns.set_theme(style="ticks")
     sns.set_palette(sns.color_palette(color_palette))
 
     # Load the planets dataset and initialize the figure
-    planets = sns.load_dataset("planets")
+    planets = load_dataset("planets", data_home)
 
     # add binned colors
     palette_len = len(color_palette)
@@ -74,14 +110,15 @@ def joint_and_marginal_histogram(color_palette: List[str]):
     # Add the joint and marginal histogram plots
     g.plot_joint(sns.histplot, discrete=(True, False), hue=planets['distance_bin'])
     g.plot_marginals(sns.histplot, element="step", color=random.choice(color_palette))
+    return g.figure
 
 
-def scatter_plot(color_palette):
+def scatter_plot(color_palette, data_home: Optional[str] = None):
     sns.set_theme(style="whitegrid")
     c_pal_len = len(color_palette)
 
     # Load the example planets dataset
-    planets = sns.load_dataset("planets")
+    planets = load_dataset("planets", data_home)
     planets['distance_bin'] = pd.qcut(planets['distance'], c_pal_len, labels=letter_range(c_pal_len))
 
     g = sns.relplot(
@@ -94,9 +131,11 @@ def scatter_plot(color_palette):
     g.ax.xaxis.grid(True, "minor", linewidth=.25)
     g.ax.yaxis.grid(True, "minor", linewidth=.25)
     g.despine(left=True, bottom=True)
+    return g.figure
 
 
 if __name__ == '__main__':
+    matplotlib.use('tkAgg')
     line_plot(EXAMPLE_COLORS)
     line_plot(EXTENDED_COLORS)
     comparison_palette_plots(EXAMPLE_COLORS, EXTENDED_COLORS)
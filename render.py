@@ -0,0 +1,131 @@
+# Headless previews: saves the example plots of many palettes to image files, on a pool of worker processes.
+#
+# Each worker switches matplotlib to the non-interactive Agg backend and imports plotting (matplotlib, seaborn,
+# pandas) and the demo dataset once, then renders palette after palette. No display or network is needed once
+# the dataset is in its local cache (see plotting.DATA_HOME), and every figure is closed as soon as it is saved.
+#
+# Palettes are given as {"id", "input", "colors"} dicts of hex values, e.g. the result lines of `cli.py batch`:
+#
+#     > python cli.py batch jobs.jsonl --output results.jsonl
+#     > python cli.py render results.jsonl --output-dir previews --workers 4
+import os
+import re
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, Iterable, List, Optional
+
+# the previews render_previews can save, see the plotting function of each in _figure
+PREVIEWS = ('line', 'palette', 'joint', 'scatter', 'comparison')
+
+
+def _init_worker(data_home: Optional[str] = None):
+    """
+    Runs once in each worker process, so the imports and the dataset are loaded per worker instead of per palette
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import plotting
+    plotting.load_dataset('planets', data_home)
+
+
+def _figure(preview: str, input_colors: List[str], colors: List[str], data_home: Optional[str]):
+    import matplotlib.pyplot as plt
+    import plotting
+
+    combined_colors = list(colors) + list(input_colors)
+    if preview == 'line':
+        return plotting.line_plot(combined_colors, ax=plt.figure().gca())
+    if preview == 'palette':
+        return plotting.palette_plot(combined_colors)
+    if preview == 'joint':
+        return plotting.joint_and_marginal_histogram(combined_colors, data_home)
+    if preview == 'scatter':
+        return plotting.scatter_plot(combined_colors, data_home)
+    return plotting.comparison_palette_plots(input_colors, colors)
+
+
+def preview_stem(palette: Dict, number: int) -> str:
+    """
+    The file name stem of a palette's previews: its id made safe for file names, or palette-<number>
+    """
+    if palette.get('id') is None:
+        return f'palette-{number}'
+    return re.sub(r'[^\w.-]', '_', str(palette['id']))
+
+
+def render_previews(input_colors: List[str], colors: List[str], directory: str, stem: str,
+                    previews: Iterable[str] = PREVIEWS, data_home: Optional[str] = None,
+                    extension: str = '.png', dpi: int = 100) -> Dict[str, str]:
+    """
+    Saves the previews of an extended palette, e.g. directory/stem.line.png
+
+    Args:
+        input_colors: The palette that was extended, as hex values
+        colors: The added colors, as hex values
+        directory: Where to save the previews
+        stem: The file name stem of the previews
+        previews: Which previews to save, see PREVIEWS
+        data_home: The dataset cache directory, see plotting.load_dataset
+        extension: The image format, any matplotlib can save
+        dpi: The resolution of the images
+
+    Returns:
+        A dict of preview -> path
+    """
+    import matplotlib.pyplot as plt
+
+    previews = list(previews)
+    unknown = set(previews) - set(PREVIEWS)
+    if unknown:
+        raise ValueError(f"Unknown previews: {', '.join(sorted(unknown))}")
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for preview in previews:
+        figure = _figure(preview, input_colors, colors, data_home)
+        paths[preview] = os.path.join(directory, f'{stem}.{preview}{extension}')
+        try:
+            figure.savefig(paths[preview], dpi=dpi)
+        finally:
+            plt.close(figure)
+    return paths
+
+
+def render_many(palettes: Iterable[Dict], directory: str, previews: Iterable[str] = PREVIEWS,
+                workers: int = 1, max_pending: Optional[int] = None, data_home: Optional[str] = None,
+                extension: str = '.png', dpi: int = 100) -> List[Dict[str, str]]:
+    """
+    Saves the previews of many palettes, in parallel worker processes
+
+    Args:
+        palettes: {"id", "input", "colors"} dicts of hex values, only "colors" is required. See the top of
+                  this module
+        directory: Where to save the previews, named after preview_stem
+        previews, data_home, extension, dpi: see render_previews
+        workers: Render this many palettes in parallel, on a process pool. 1 renders in this process,
+                 switching it to the Agg backend
+        max_pending: How many palettes to have in flight at most, defaults to twice the workers
+
+    Returns:
+        A dict of preview -> path per palette, in the order of palettes
+    """
+    previews = list(previews)
+    max_pending = max(max_pending or 2 * workers, 1)
+    jobs = ((palette.get('input') or [], palette['colors'], directory, preview_stem(palette, number), previews,
+             data_home, extension, dpi)
+            for number, palette in enumerate(palettes, start=1))
+
+    if workers <= 1:
+        _init_worker(data_home)
+        return [render_previews(*job) for job in jobs]
+
+    paths = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data_home,)) as executor:
+        pending: Deque[Future] = deque()
+        for job in jobs:
+            pending.append(executor.submit(render_previews, *job))
+            if len(pending) >= max_pending:
+                paths.append(pending.popleft().result())
+        while pending:
+            paths.append(pending.popleft().result())
+    return paths
@@ -16,7 +16,7 @@ if __name__ == '__main__':
     combined_colors = result_colors + your_colors
     line_plot(combined_colors)
     palette_plot(combined_colors)
-    comparison_palette_plots(target_colors, result_colors)
+    comparison_palette_plots(your_colors, result_colors)
     joint_and_marginal_histogram(combined_colors)
     scatter_plot(combined_colors)
     plt.show()
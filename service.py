@@ -0,0 +1,410 @@
+# Palette extension service: an asyncio server that takes jobs over a TCP or Unix socket and anneals them on a
+# bounded pool of worker processes.
+#
+# The protocol is JSON lines both ways, so it can be driven with nothing but a socket (see ServiceClient).
+# Requests are the job lines of batch.py with an "op" added:
+#
+#     {"op": "extend", "id": "a", "colors": ["#00798c", "#d1495b"], "result_count": 5, "seed": 0}
+#     {"op": "cancel", "id": "a"}
+#
+# and every job is answered with events carrying the client's id:
+#
+#     {"id": "a", "event": "queued", "merged": false}
+#     {"id": "a", "event": "progress", "sweep": 120, "temperature": 299.4, "best_cost": 41.2, "colors": [...]}
+#     {"id": "a", "event": "result", "input": [...], "colors": [...], "cost": 12.3}
+#
+# or "cancelled" / "error" instead of "result". Ids only have to be unique within a connection.
+#
+# Jobs with the same cache.cache_key are merged while in flight: the job runs once, and every client that asked
+# for it gets its progress and result. A running job is only stopped once every one of its clients has
+# cancelled it (or disconnected). Progress is sent at most every progress_seconds and dropped, never queued up,
+# for clients that don't keep up reading. The pool runs at most `workers` jobs at once, at most max_jobs can be
+# in flight (running or waiting for a worker) and at most max_client_jobs per connection: beyond that a job is
+# rejected with an error right away, rather than queued without bound.
+#
+# Usage:
+#     > python cli.py serve --unix /tmp/palettes.sock --workers 4
+#     > async with await ServiceClient.connect(path='/tmp/palettes.sock') as client:
+#     >     async for event in client.extend(['#00798c', '#d1495b'], seed=0):
+#     >         print(event)
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from batch import JOB_KEYS
+from cache import cache_key
+from cli import extend_palette
+from color import rgb_to_hex
+
+# events that end a job for a client
+FINAL_EVENTS = ('result', 'cancelled', 'error')
+
+# the worker's progress queue and cancellation flags (one per slot), set up by _init_worker
+_progress = None
+_cancel_flags = None
+
+
+def _init_worker(progress, cancel_flags, lut_directory: Optional[str]):
+    """
+    Runs once in each worker process, so shared state is set up per worker instead of per job
+    """
+    global _progress, _cancel_flags
+    _progress, _cancel_flags = progress, cancel_flags
+    if lut_directory:
+        import lut
+        lut.enable(lut_directory)
+
+
+def _run_job(job: Dict, key: str, slot: int, progress_seconds: float) -> Dict:
+    """
+    Extends a palette in a worker process, reporting progress on the progress queue and stopping early once
+    the job's cancellation flag is set
+    """
+    last_progress = time.monotonic()
+
+    def callback(stats) -> bool:
+        nonlocal last_progress
+        if _cancel_flags[slot]:
+            return True
+        now = time.monotonic()
+        if now - last_progress >= progress_seconds:
+            last_progress = now
+            _progress.put((key, {'sweep': stats.sweep, 'temperature': stats.temperature,
+                                 'best_cost': stats.best_cost, 'colors': rgb_to_hex(stats.best_state)}))
+        return False
+
+    return extend_palette(job['colors'], callback=callback, **{name: job[name] for name in JOB_KEYS if name in job})
+
+
+def job_key(job: Dict) -> str:
+    """
+    What identical jobs have in common, see cache.cache_key
+    """
+    schedule = {name: job[name] for name in JOB_KEYS if name in job and
+                name not in ('result_count', 'seed', 'weights')}
+    return cache_key(job['colors'], job.get('result_count', 5), job.get('weights'), job.get('seed'), **schedule)
+
+
+class _Connection:
+    def __init__(self, writer: asyncio.StreamWriter, max_backlog: int):
+        """
+        A client connection: its running jobs by the client's ids, and the messages waiting to be written to it
+        """
+        self.writer = writer
+        self.max_backlog = max_backlog
+        self.jobs: Dict[str, '_Job'] = {}
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.sender = asyncio.ensure_future(self._send_all())
+
+    def send(self, message: Dict, droppable: bool = False):
+        """
+        Queues a message. Droppable ones (progress) are dropped if the client has fallen behind reading
+        """
+        if droppable and self.outbox.qsize() >= self.max_backlog:
+            return
+        self.outbox.put_nowait(message)
+
+    async def _send_all(self):
+        while True:
+            message = await self.outbox.get()
+            if message is None:
+                break
+            self.writer.write(json.dumps(message).encode() + b'\n')
+            await self.writer.drain()
+
+    async def close(self):
+        self.outbox.put_nowait(None)
+        try:
+            await self.sender
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        self.writer.close()
+
+
+class _Job:
+    def __init__(self, key: str, job: Dict):
+        """
+        A job in flight and the (connection, id) pairs waiting for it
+        """
+        self.key = key
+        self.job = job
+        self.subscribers: Dict[Tuple[_Connection, str], None] = {}
+        self.slot: Optional[int] = None
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self, event: str, droppable: bool = False, **message):
+        for connection, job_id in list(self.subscribers):
+            connection.send({'id': job_id, 'event': event, **message}, droppable)
+
+
+class PaletteService:
+    def __init__(self, workers: Optional[int] = None, max_jobs: int = 64, max_client_jobs: int = 8,
+                 progress_seconds: float = 0.5, max_backlog: int = 32, lut_directory: Optional[str] = None):
+        """
+        The server side of the service, see the top of this module
+
+        Usage:
+            > service = PaletteService(workers=4)
+            > await service.start(path='/tmp/palettes.sock')  # or host='127.0.0.1', port=8765
+            > await service.serve_forever()
+
+        Args:
+            workers: How many jobs to run at once, each in its own worker process. Defaults to the number of CPUs
+            max_jobs: How many distinct jobs can be in flight at once, running or waiting for a worker
+            max_client_jobs: How many jobs a single connection can have in flight at once
+            progress_seconds: How often a running job reports its best palette so far
+            max_backlog: How many unsent messages a connection can have before its progress is dropped
+            lut_directory: If given, each worker uses the lookup tables in this directory, see lut.py
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.max_client_jobs = max_client_jobs
+        self.progress_seconds = progress_seconds
+        self.max_backlog = max_backlog
+        self.lut_directory = lut_directory
+        self.jobs: Dict[str, _Job] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Set[asyncio.Task] = set()
+
+    async def start(self, host: Optional[str] = None, port: Optional[int] = None,
+                    path: Optional[str] = None) -> asyncio.AbstractServer:
+        """
+        Starts the worker pool and listens on a Unix socket at path, or on host:port
+        """
+        self._loop = asyncio.get_running_loop()
+        self._progress = multiprocessing.Queue()
+        self._cancel_flags = multiprocessing.RawArray('b', self.workers)
+        self._slots: asyncio.Queue = asyncio.Queue()
+        for slot in range(self.workers):
+            self._slots.put_nowait(slot)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self._progress, self._cancel_flags, self.lut_directory))
+        # the progress queue blocks, so it's read on a thread of its own
+        self._progress_thread = threading.Thread(target=self._read_progress, daemon=True)
+        self._progress_thread.start()
+
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening, disconnects the clients, stops the running jobs and shuts the worker pool down
+        """
+        if self._server is not None:
+            self._server.close()
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        jobs = list(self.jobs.values())
+        for job in jobs:
+            self._stop(job)
+        await asyncio.gather(*(job.task for job in jobs), return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._progress.put(None)
+        self._progress_thread.join()
+
+    def _read_progress(self):
+        for key, progress in iter(self._progress.get, None):
+            self._loop.call_soon_threadsafe(self._publish_progress, key, progress)
+
+    def _publish_progress(self, key: str, progress: Dict):
+        job = self.jobs.get(key)
+        if job is not None and not job.cancelled:
+            job.publish('progress', droppable=True, **progress)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = _Connection(writer, self.max_backlog)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    self._request(connection, line)
+        except (ConnectionError, asyncio.CancelledError):
+            # the client is gone, or the service is closing
+            pass
+        finally:
+            # a client that's gone doesn't need its jobs anymore
+            for job_id in list(connection.jobs):
+                self._unsubscribe(connection, job_id)
+            await connection.close()
+            self._handlers.discard(asyncio.current_task())
+
+    def _request(self, connection: _Connection, line: bytes):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('A request must be a JSON object')
+        except ValueError as e:
+            connection.send({'id': None, 'event': 'error', 'error': f'{type(e).__name__}: {e}'})
+            return
+
+        job_id, op = request.pop('id', None), request.pop('op', 'extend')
+        try:
+            if op == 'extend':
+                self._submit(connection, job_id, request)
+            elif op == 'cancel':
+                if job_id not in connection.jobs:
+                    raise ValueError(f'No job {job_id!r} in flight')
+                self._unsubscribe(connection, job_id)
+                connection.send({'id': job_id, 'event': 'cancelled'})
+            else:
+                raise ValueError(f'Unknown op {op!r}')
+        except (TypeError, ValueError) as e:
+            connection.send({'id': job_id, 'event': 'error', 'error': f'{type(e).__name__}: {e}'})
+
+    def _submit(self, connection: _Connection, job_id: str, request: Dict):
+        unknown = set(request) - set(JOB_KEYS) - {'colors'}
+        if unknown:
+            raise ValueError(f"Unknown job keys: {', '.join(sorted(unknown))}")
+        if not request.get('colors'):
+            raise ValueError("A job needs a non-empty list of 'colors'")
+        if job_id in connection.jobs:
+            raise ValueError(f'Job {job_id!r} is already in flight')
+        if len(connection.jobs) >= self.max_client_jobs:
+            raise ValueError(f'Busy: this connection already has {self.max_client_jobs} jobs in flight')
+
+        key = job_key(request)
+        job = self.jobs.get(key)
+        merged = job is not None
+        if not merged:
+            if len(self.jobs) >= self.max_jobs:
+                raise ValueError(f'Busy: {self.max_jobs} jobs are already in flight')
+            job = self.jobs[key] = _Job(key, request)
+            job.task = asyncio.ensure_future(self._run(job))
+
+        job.subscribers[(connection, job_id)] = None
+        connection.jobs[job_id] = job
+        connection.send({'id': job_id, 'event': 'queued', 'merged': merged})
+
+    def _unsubscribe(self, connection: _Connection, job_id: str):
+        job = connection.jobs.pop(job_id)
+        job.subscribers.pop((connection, job_id), None)
+        if not job.subscribers:
+            self._stop(job)
+
+    def _stop(self, job: _Job):
+        """
+        Stops a job nobody waits for anymore: a waiting one is dropped, a running one stops after its sweep
+        """
+        job.cancelled = True
+        if self.jobs.get(job.key) is job:
+            # identical requests from now on start afresh
+            del self.jobs[job.key]
+        if job.slot is None:
+            job.task.cancel()
+        else:
+            self._cancel_flags[job.slot] = 1
+
+    async def _run(self, job: _Job):
+        slot = await self._slots.get()
+        try:
+            self._cancel_flags[slot] = 0
+            job.slot = slot
+            try:
+                result = await self._loop.run_in_executor(self._executor, _run_job, job.job, job.key, slot,
+                                                          self.progress_seconds)
+            except Exception as e:
+                if not job.cancelled:
+                    job.publish('error', error=f'{type(e).__name__}: {e}')
+            else:
+                if not job.cancelled:
+                    job.publish('result', **result)
+        finally:
+            self._slots.put_nowait(slot)
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            for connection, job_id in job.subscribers:
+                if connection.jobs.get(job_id) is job:
+                    del connection.jobs[job_id]
+
+
+class ServiceClient:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        A connection to a PaletteService, see connect. Several jobs can be in flight on it at once
+        """
+        self._reader = reader
+        self._writer = writer
+        self._events: Dict[str, asyncio.Queue] = {}
+        self._ids = itertools.count()
+        self._receiver = asyncio.ensure_future(self._receive())
+
+    @classmethod
+    async def connect(cls, host: Optional[str] = None, port: Optional[int] = None,
+                      path: Optional[str] = None) -> 'ServiceClient':
+        """
+        Connects to a service listening on a Unix socket at path, or on host:port
+        """
+        if path is not None:
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def _receive(self):
+        async for line in self._reader:
+            event = json.loads(line)
+            queue = self._events.get(event.get('id'))
+            if queue is not None:
+                queue.put_nowait(event)
+        for queue in self._events.values():
+            queue.put_nowait({'event': 'error', 'error': 'ConnectionError: the service closed the connection'})
+
+    async def _send(self, request: Dict):
+        self._writer.write(json.dumps(request).encode() + b'\n')
+        await self._writer.drain()
+
+    async def extend(self, colors: List[str], job_id: Optional[str] = None, **job) -> AsyncIterator[Dict]:
+        """
+        Submits a job and yields its events, up to and including the final one
+
+        Args:
+            colors: The palette to extend, as hex values
+            job_id: The id of the job on this connection, to cancel it with. Defaults to a fresh one
+            job: Any other job keys, see batch.JOB_KEYS
+
+        Returns:
+            An async iterator of the job's events, see the top of this module
+        """
+        job_id = str(next(self._ids)) if job_id is None else job_id
+        queue = self._events[job_id] = asyncio.Queue()
+        try:
+            await self._send({'op': 'extend', 'id': job_id, 'colors': colors, **job})
+            while True:
+                event = await queue.get()
+                yield event
+                if event['event'] in FINAL_EVENTS:
+                    break
+        finally:
+            del self._events[job_id]
+
+    async def cancel(self, job_id: str):
+        """
+        Cancels a job of this connection. Its events end with 'cancelled'
+        """
+        await self._send({'op': 'cancel', 'id': job_id})
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._receiver.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,178 @@
+# Weight sweeps: anneals the same palette under many objective weightings and keeps the Pareto front.
+#
+# Every weighting starts from the same random palette, and all of them are annealed together as the replicas of
+# one tempering.ReplicaObjective, each replica with its own weights: every step simulates and converts the R
+# candidate colors in one call and computes their ΔE rows as one block, and the weightings cool in lockstep.
+# That shares the per-step overhead that dominates small palettes, so a sweep costs far less than one anneal per
+# weighting. With several workers, each one anneals a share of the weightings this way.
+#
+# The results are compared on their unweighted obj_fn scores, all of which are lower-is-better, and only the
+# non-dominated ones are kept: those no other result matches or beats on every score.
+#
+# Usage:
+#     > results = sweep_weights(target_colors, weight_grid(Target=[0.5, 1, 2], Range=[0, 1]), seed=0)
+#     > python cli.py sweep '#00798c' '#d1495b' --weight Target=0.5,1,2 --weight Range=0,1 --workers 4
+import itertools
+import os
+from contextlib import nullcontext
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+from annealing import make_objective
+from color import Color
+from moves import RGBMoves
+from objective import DEFAULT_WEIGHTS
+from palette import Palette
+from tempering import ReplicaObjective
+
+
+class SweepResult(NamedTuple):
+    weights: Dict[str, float]  # the full weights, DEFAULT_WEIGHTS with the weighting's overrides
+    cost: float  # the weighted obj_fn value
+    scores: Dict[str, float]  # the unweighted obj_fn scores, keyed like DEFAULT_WEIGHTS
+    colors: List[Color]
+
+
+def weight_grid(**values: List[float]) -> List[Dict[str, float]]:
+    """
+    Every combination of the given weight values
+
+    Usage:
+        > weight_grid(Target=[0.5, 1, 2], Range=[0, 1])  # 6 weightings
+
+    Args:
+        values: Weight name (a key of DEFAULT_WEIGHTS) -> the values to try
+
+    Returns:
+        A list of weight overrides
+    """
+    unknown = set(values) - set(DEFAULT_WEIGHTS)
+    if unknown:
+        raise ValueError(f"Unknown weights: {', '.join(sorted(unknown))}")
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def pareto_front(results: List[SweepResult]) -> List[SweepResult]:
+    """
+    The results that no other result matches or beats on every score while beating on at least one
+
+    Args:
+        results: Results from sweep_weights
+
+    Returns:
+        The non-dominated results, in their original order
+    """
+    if not results:
+        return []
+    names = list(results[0].scores)
+    scores = np.array([[result.scores[name] for name in names] for result in results])
+    dominated = np.any(np.all(scores[:, None, :] <= scores[None, :, :], axis=2) &
+                       np.any(scores[:, None, :] < scores[None, :, :], axis=2), axis=0)
+    return [result for result, is_dominated in zip(results, dominated) if not is_dominated]
+
+
+def _init_worker(lut_directory: Optional[str]):
+    """
+    Runs once in each worker process
+    """
+    if lut_directory:
+        import lut
+        lut.enable(lut_directory)
+
+
+def _run_weightings(input_colors: List[Color], state: np.ndarray, weightings: List[Dict[str, float]],
+                    rng: np.random.RandomState, temperature: float, cooling_rate: float, cutoff: float,
+                    batch_size: int, max_evaluations: Optional[int],
+                    large_palette: Optional[bool]) -> List[SweepResult]:
+    """
+    Anneals state under every weighting at once, as the replicas of one ReplicaObjective. Follows run_schedule:
+    each color of each replica gets up to batch_size tries per sweep, the first accepted one is taken
+    """
+    replicas = len(weightings)
+    weights = {name: np.array([{**DEFAULT_WEIGHTS, **w}[name] for w in weightings], dtype=float)
+               for name in DEFAULT_WEIGHTS}
+    objective = ReplicaObjective(np.repeat(state[None], replicas, axis=0), input_colors, weights)
+    moves = RGBMoves()
+    temperatures = np.full(replicas, temperature)
+    best_costs, best_states = objective.cost.copy(), objective.rgb.copy()
+
+    evaluations = 0
+    while temperature > cutoff:
+        for i in range(objective.rgb.shape[1]):
+            if max_evaluations is not None and evaluations + batch_size > max_evaluations:
+                break
+            trying = np.ones(replicas, dtype=bool)
+            for _ in range(batch_size):
+                # replicas that took a move already propose their current color, which is never taken
+                new_rgbs = objective.rgb[:, i].copy()
+                new_rgbs[trying] = np.trunc(moves.propose_batch(new_rgbs[trying], temperatures[trying], rng))
+                deltas = objective.propose(i, new_rgbs) - objective.cost
+                accepted = trying & (rng.rand(replicas) < np.exp(np.minimum(-deltas / temperature, 0)))
+                objective.commit(accepted)
+                trying &= ~accepted
+
+            better = objective.cost < best_costs
+            best_costs[better], best_states[better] = objective.cost[better], objective.rgb[better]
+            evaluations += batch_size
+        else:
+            temperature *= cooling_rate
+            temperatures[:] = temperature
+            continue
+        break
+
+    results = []
+    for weighting, best_state in zip(weightings, best_states):
+        exact = make_objective(Palette(best_state), input_colors, weights=weighting, large_palette=large_palette)
+        scores = {name: float(score) for name, score in exact.scores().items()}
+        results.append(SweepResult(exact.weights, float(exact.cost), scores, exact.palette.to_colors()))
+    return results
+
+
+def sweep_weights(input_colors: List[Color], weightings: List[Dict[str, float]], result_count: int = 5,
+                  seed: Optional[int] = None, workers: Optional[int] = 1,
+                  temperature: float = 1000., cooling_rate: float = 0.99, cutoff: float = .0001,
+                  batch_size: int = 1, max_evaluations: Optional[int] = None,
+                  large_palette: Optional[bool] = None, lut_directory: Optional[str] = None,
+                  pareto: bool = True) -> List[SweepResult]:
+    """
+    Anneals the same starting palette under each weighting, all weightings at once as one batched objective
+
+    Args:
+        input_colors: A list of target colors to optimize toward
+        weightings: Overrides for DEFAULT_WEIGHTS, one per run, e.g. from weight_grid
+        result_count: How many colors to add
+        seed: Seeds the starting palette and the random stream of every worker, for reproducible results
+        workers: Split the weightings between this many processes, on a process pool. 1 runs in this
+                 process, None uses every core
+        temperature, cooling_rate, cutoff, batch_size, max_evaluations: The schedule of each run, see anneal
+        large_palette: see anneal
+        lut_directory: If given, every run uses the lookup tables in this directory, see lut.py
+        pareto: Only return the non-dominated results, see pareto_front
+
+    Returns:
+        A SweepResult per weighting (or per non-dominated weighting), in the order of weightings
+    """
+    workers = os.cpu_count() if workers is None else workers
+    workers = max(min(workers, len(weightings)), 1)
+    streams = np.random.SeedSequence(seed).spawn(workers + 1)
+    rngs = [np.random.RandomState(np.random.MT19937(s)) for s in streams]
+    state = Palette.random(result_count, rngs[0]).srgb
+    # a contiguous share of the weightings per worker, so the results stay in order
+    shares = [list(share) for share in np.array_split(np.arange(len(weightings)), workers)]
+    schedule = (temperature, cooling_rate, cutoff, batch_size, max_evaluations, large_palette)
+
+    if workers <= 1:
+        import lut
+        with lut.using(lut_directory) if lut_directory else nullcontext():
+            results = _run_weightings(input_colors, state, weightings, rngs[1], *schedule)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(lut_directory,)) as executor:
+            futures = [executor.submit(_run_weightings, input_colors, state, [weightings[i] for i in share], rng,
+                                       *schedule)
+                       for share, rng in zip(shares, rngs[1:])]
+            results = [result for future in futures for result in future.result()]
+
+    return pareto_front(results) if pareto else results
@@ -0,0 +1,176 @@
+# Nearest-target lookups for large target palettes.
+#
+# CIEDE2000 divides the lightness, chroma and hue differences by weights that grow with lightness and chroma,
+# so on colormath's Lab scale it behaves like a distance between log-scaled lightness and chroma and a
+# chroma-compressed hue. TargetIndex embeds colors into that space once, where plain Euclidean distances are
+# cheap to compute for all targets at once, and computes the exact CIEDE2000 for the closest candidates.
+#
+# The embedding only suggests candidates, it doesn't bound CIEDE2000. The result is confirmed with
+# delta_e_lower_bound, a true lower bound that skips CIEDE2000's trigonometry: every
+# target whose bound is below the best candidate's distance is measured exactly too, so the closest target is
+# always the exact one. The candidates are usually close enough that few targets are left to measure.
+# Target palettes up to INDEX_THRESHOLD colors are always searched exhaustively.
+#
+# IncrementalObjective builds one index per objective. The public helpers in color.py, Color.get_closest_color
+# and average_color_distances_from_target, scan exactly without one: build a TargetIndex once instead to query
+# many palettes against the same large set of targets.
+import numpy as np
+from typing import Callable, Optional, Tuple
+
+from color_diff import delta_e_cie2000_cross, delta_e_cie2000_pairs
+
+# target palettes up to this size are cheaper to scan exactly than to index
+INDEX_THRESHOLD = 128
+
+# an upper bound on CIEDE2000's hue weighting function T, whose maximum over all hues is 1.5725
+T_MAX = 1.58
+
+
+def embed(lab: np.ndarray) -> np.ndarray:
+    """
+    Maps Lab values into the space TargetIndex measures Euclidean distances in
+
+    Args:
+        lab: An (N, 3) array of Lab values
+
+    Returns:
+        An (N, 4) array
+    """
+    lab = np.asarray(lab, dtype=float)
+    L, a, b = lab[..., 0], lab[..., 1], lab[..., 2]
+    chroma = np.hypot(a, b)
+    lightness = L - 50
+    scale = 1 / (1 + 0.015 * chroma)
+    return np.stack([np.sign(lightness) * np.log1p(0.015 * np.abs(lightness)) / 0.015,
+                     np.log1p(0.045 * chroma) / 0.045,
+                     a * scale,
+                     b * scale], axis=-1)
+
+
+def delta_e_lower_bound(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """
+    A lower bound on color_diff.delta_e_cie2000_pairs, without its trigonometry.
+
+    CIEDE2000² is x² + y² + R_T x y + (ΔL'/S_L)², with x = ΔC'/S_C and y = ΔH'/S_H. ΔH'² is the squared
+    distance between the two colors in the a'b' plane minus ΔC'², S_H is at most 1 + 0.015 C' T_MAX, and
+    |R_T| <= 2 R_C, so |y| is at least some y_min and x² + y² + R_T x y is at least x² + y_min² - 2 R_C |x| y_min,
+    or x² (1 - R_C²) if y_min is below R_C |x|, where that minimizes it
+
+    Args:
+        lab1: An (..., 3) array of Lab values
+        lab2: An (..., 3) array of Lab values, broadcastable against lab1
+
+    Returns:
+        An array of bounds with the broadcast shape of the inputs (minus the last axis)
+    """
+    lab1 = np.asarray(lab1, dtype=float)
+    lab2 = np.asarray(lab2, dtype=float)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    lightness = (L1 + L2) / 2 - 50
+    S_L = 1 + 0.015 * lightness ** 2 / np.sqrt(20 + lightness ** 2)
+
+    avg_C7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2) ** 7
+    G = 0.5 * (1 - np.sqrt(avg_C7 / (avg_C7 + 25. ** 7)))
+    a1p, a2p = (1 + G) * a1, (1 + G) * a2
+    C1p, C2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+    avg_Cp = (C1p + C2p) / 2
+    avg_Cp7 = avg_Cp ** 7
+    R_C = np.sqrt(avg_Cp7 / (avg_Cp7 + 25. ** 7))
+
+    x = np.abs(C2p - C1p) / (1 + 0.045 * avg_Cp)
+    delta_Hp = np.sqrt(np.maximum((a2p - a1p) ** 2 + (b2 - b1) ** 2 - (C2p - C1p) ** 2, 0))
+    y = delta_Hp / (1 + 0.015 * avg_Cp * T_MAX)
+    chroma_hue = np.where(y >= R_C * x, x ** 2 + y ** 2 - 2 * R_C * x * y, x ** 2 * (1 - R_C ** 2))
+
+    return np.sqrt((((L2 - L1) / S_L) ** 2 + np.maximum(chroma_hue, 0)))
+
+
+class TargetIndex:
+    def __init__(self, target_lab: np.ndarray, candidates: int = 16, threshold: int = INDEX_THRESHOLD,
+                 cross: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None):
+        """
+        An index of target colors for nearest-target CIEDE2000 lookups, built once and queried many times.
+        See the top of this module
+
+        Usage:
+            > index = TargetIndex(np.array([c.lab for c in target_colors]))
+            > indices, distances = index.closest(lab)
+
+        Args:
+            target_lab: An (M, 3) array of the Lab values of the targets
+            candidates: How many targets closest in the embedding to measure first, see closest
+            threshold: Scan up to this many targets exactly instead of indexing them
+            cross: The exact scan, defaults to color_diff.delta_e_cie2000_cross. See kernels.delta_e_cross
+        """
+        self.lab = np.ascontiguousarray(target_lab, dtype=float).reshape(-1, 3)
+        self._cross = delta_e_cie2000_cross if cross is None else cross
+        self.candidates = candidates
+        self.exact = len(self.lab) <= max(threshold, candidates)
+        if not self.exact:
+            self._points = embed(self.lab)
+            self._norms = np.einsum('ij,ij->i', self._points, self._points)
+            self._order = np.argsort(self.lab[:, 0], kind='stable')
+            self._lightness = self.lab[self._order, 0]
+
+    def __len__(self) -> int:
+        return len(self.lab)
+
+    def closest(self, lab: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the closest target to each color
+
+        Args:
+            lab: An (N, 3) array of Lab values
+
+        Returns:
+            The (N,) indices of the closest targets and the (N,) CIEDE2000 distances to them
+        """
+        lab = np.asarray(lab, dtype=float).reshape(-1, 3)
+        if self.exact:
+            distances = self._cross(lab, self.lab)
+            indices = np.argmin(distances, axis=1)
+            return indices, distances[np.arange(len(lab)), indices]
+
+        points = embed(lab)
+        # squared Euclidean distances to every target as one matrix product
+        squared = self._norms[None, :] - 2 * points @ self._points.T
+        candidates = np.argpartition(squared, self.candidates - 1, axis=1)[:, :self.candidates]
+
+        distances = delta_e_cie2000_pairs(lab[:, None, :], self.lab[candidates])
+        best = np.argmin(distances, axis=1)
+        rows = np.arange(len(lab))
+        indices, nearest = candidates[rows, best], distances[rows, best]
+
+        # any other target whose lower bound doesn't rule it out could be closer, and is measured exactly. Only
+        # targets within the best distance times S_L in lightness can be. S_L is at most 1 + 0.015 |L - 50| at the
+        # mean lightness L, which is at most |ΔL| / 2 from the color's, so sorted lightness finds them. The margins
+        # keep rounding in the bounds from ruling out a target that is closer by less than them
+        slack = 1 - 0.0075 * nearest
+        margin = np.where(slack > 0, nearest * (1 + 0.015 * np.abs(lab[:, 0] - 50)) / np.maximum(slack, 1e-12),
+                          np.inf) + 1e-9
+        low = np.searchsorted(self._lightness, lab[:, 0] - margin, side='left')
+        high = np.searchsorted(self._lightness, lab[:, 0] + margin, side='right')
+        counts = high - low
+        queries = np.repeat(rows, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        targets = self._order[np.repeat(low, counts) + offsets]
+        keep = delta_e_lower_bound(lab[queries], self.lab[targets]) < nearest[queries] + 1e-9
+        queries, targets = queries[keep], targets[keep]
+
+        exact = delta_e_cie2000_pairs(lab[queries], self.lab[targets])
+        closer = exact < nearest[queries]
+        queries, targets, exact = queries[closer], targets[closer], exact[closer]
+        # the closest of them for each query, which comes first sorted by query, then distance
+        order = np.lexsort((exact, queries))
+        first = order[np.r_[True, queries[order][1:] != queries[order][:-1]]] if len(order) else order
+        indices[queries[first]], nearest[queries[first]] = targets[first], exact[first]
+        return indices, nearest
+
+    def distances(self, lab: np.ndarray) -> np.ndarray:
+        """
+        The CIEDE2000 distance from each color to its closest target
+        """
+        return self.closest(lab)[1]
+
@@ -0,0 +1,300 @@
+# Parallel tempering: many replicas of the palette at a ladder of temperatures, held and moved as one array.
+#
+# anneal walks a single chain, color by color, in a Python loop. Here the R replicas are an (R, N, 3) array, and
+# every step moves the same color of all of them at once: the R candidate colors are simulated and converted to
+# Lab in one call, their distances to the other colors of their own replica are one (S, R, N) block of ΔE, and
+# the R Metropolis tests are one comparison. The per-step overhead of the Python loop is shared by all replicas.
+#
+# The temperatures stay fixed. After every sweep, replicas at neighboring temperatures trade them with the
+# usual exchange criterion, alternating between the even and odd pairs of the ladder: a state that is better
+# than its colder neighbor's always moves down, so what the hot replicas find reaches the cold end, and a cold
+# replica stuck in a local minimum is heated out of it.
+#
+# Only obj_fn is batched, see ReplicaObjective.
+#
+# Usage:
+#     > colors = temper(target_colors, 5, replicas=16, rng=np.random.RandomState(0))
+import time
+import numpy as np
+from textwrap import dedent
+from typing import Callable, Dict, List, Optional, Tuple
+
+import lut
+from annealing import SweepStats
+from color import Color, hex_list
+from color_diff import delta_e_cie2000_pairs
+from moves import Moves, OKLabMoves
+from objective import DEFAULT_WEIGHTS, VISION_SPACES, compiled_kernels, vision_space_labs
+from palette import Palette
+from target_index import TargetIndex
+
+
+class ReplicaObjective:
+    def __init__(self, states: np.ndarray, target_colors: List[Color],
+                 weights: Optional[Dict[str, float]] = None):
+        """
+        obj_fn for R palettes of N colors at once, each changing one color at a time.
+
+        Keeps the pairwise distance matrices of every vision space of every replica, so a step that moves
+        color i of every replica only computes the R new rows, like IncrementalObjective does for one palette.
+
+        Usage:
+            > costs = objective.propose(i, new_rgbs)
+            > objective.commit(accepted)
+
+        Args:
+            states: An (R, N, 3) array of colors in [0, 255]
+            target_colors: A list of colors representing the goal to work towards
+            weights: Overrides for DEFAULT_WEIGHTS
+        """
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.target_colors = target_colors
+        self.rgb = np.clip(np.array(states, dtype=float), 0, 255)
+        replicas, n = self.rgb.shape[:2]
+        self.pair_count = n * (n - 1) / 2
+
+        # the compiled kernels reproduce the CIEDE2000 path without lookup tables, see kernels.py
+        self._kernels = compiled_kernels()
+        self._fused = self._kernels is not None and not lut.enabled()
+        self.targets = TargetIndex([c.lab for c in target_colors],
+                                   cross=None if self._kernels is None else self._kernels.delta_e_cross)
+
+        # (S, R, N, 3) Lab values and (S, R, N, N) distance matrices, in VISION_SPACES order
+        self.lab = self._labs(self.rgb.reshape(-1, 3)).reshape(len(VISION_SPACES), replicas, n, 3)
+        if self._kernels is not None:
+            self.distances = self._kernels.delta_e_matrix(self.lab.reshape(-1, n, 3)).reshape(
+                len(VISION_SPACES), replicas, n, n)
+        else:
+            self.distances = delta_e_cie2000_pairs(self.lab[:, :, :, None, :], self.lab[:, :, None, :, :])
+        self.sums = self.distances.sum(axis=(2, 3)) / 2
+        self.target_distances = self.targets.distances(self.lab[0].reshape(-1, 3)).reshape(replicas, n)
+
+        # pairs that don't involve a given color, off the diagonal
+        self._off_diagonal = ~np.eye(n, dtype=bool)
+        highest, lowest = self._extremes(self.distances[0])
+        self.range = highest - lowest
+        self.cost = self.combine(self.scores())
+        self._pending = None
+
+    def __len__(self) -> int:
+        return len(self.rgb)
+
+    def _labs(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        objective.vision_space_labs, compiled when the kernels are available
+        """
+        return self._kernels.vision_space_labs(rgb) if self._fused else vision_space_labs(rgb)
+
+    def _extremes(self, distances: np.ndarray, index: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The largest and smallest of each replica's (N, N) distances off the diagonal, over the pairs that don't
+        involve index if given
+        """
+        pairs = self._off_diagonal
+        if index is not None:
+            pairs = pairs.copy()
+            pairs[index] = pairs[:, index] = False
+        values = distances[:, pairs]
+        return values.max(axis=1, initial=-np.inf), values.min(axis=1, initial=np.inf)
+
+    def scores(self, sums: Optional[np.ndarray] = None, distance_range: Optional[np.ndarray] = None,
+               target_distances: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        The unweighted obj_fn scores of every replica, for the current states unless replacement values are given
+
+        Returns:
+            A dict of score name -> (R,) array, keyed like DEFAULT_WEIGHTS
+        """
+        sums = self.sums if sums is None else sums
+        distance_range = self.range if distance_range is None else distance_range
+        target_distances = self.target_distances if target_distances is None else target_distances
+        return {
+            **{space: 100 - total / self.pair_count for space, total in zip(VISION_SPACES, sums)},
+            'Range': distance_range,
+            'Target': np.average(target_distances, axis=-1)}
+
+    def combine(self, scores: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Weighted sum of the scores
+        """
+        return sum(self.weights[name] * score for name, score in scores.items())
+
+    def propose(self, index: int, rgbs: np.ndarray) -> np.ndarray:
+        """
+        Scores every replica with its color at index replaced. Follow up with commit
+
+        Args:
+            index: The index of the color to replace
+            rgbs: An (R, 3) array of replacement colors in [0, 255], one per replica
+
+        Returns:
+            An (R,) array of the objective values of the proposed states
+        """
+        rgbs = np.asarray(rgbs, dtype=float)
+        lab = self._labs(rgbs)
+        replicas, n = self.rgb.shape[:2]
+
+        # (S, R, N) distances from each replica's candidate to the colors of the same replica
+        if self._kernels is not None:
+            rows = self._kernels.delta_e_cross(lab.reshape(-1, 1, 3), self.lab.reshape(-1, n, 3)).reshape(
+                len(VISION_SPACES), replicas, n)
+        else:
+            rows = delta_e_cie2000_pairs(lab[:, :, None, :], self.lab)
+        rows[:, :, index] = 0
+
+        sums = self.sums - self.distances[:, :, index].sum(axis=2) + rows.sum(axis=2)
+        highest, lowest = self._extremes(self.distances[0], index)
+        others = np.arange(n) != index
+        distance_range = (np.maximum(highest, rows[0][:, others].max(axis=1, initial=-np.inf)) -
+                          np.minimum(lowest, rows[0][:, others].min(axis=1, initial=np.inf)))
+        target_distances = self.target_distances.copy()
+        target_distances[:, index] = self.targets.distances(lab[0])
+
+        costs = self.combine(self.scores(sums, distance_range, target_distances))
+        self._pending = (index, rgbs, lab, rows, sums, distance_range, target_distances, costs)
+        return costs
+
+    def commit(self, accepted: np.ndarray):
+        """
+        Accepts the last proposal for some of the replicas, and discards it for the others
+
+        Args:
+            accepted: An (R,) boolean array, which replicas take their proposed color
+        """
+        index, rgbs, lab, rows, sums, distance_range, target_distances, costs = self._pending
+        self.rgb[accepted, index] = rgbs[accepted]
+        self.lab[:, accepted, index] = lab[:, accepted]
+        self.distances[:, :, index][:, accepted] = rows[:, accepted]
+        self.distances[:, :, :, index][:, accepted] = rows[:, accepted]
+        self.sums[:, accepted] = sums[:, accepted]
+        self.range[accepted] = distance_range[accepted]
+        self.target_distances[accepted] = target_distances[accepted]
+        self.cost[accepted] = costs[accepted]
+        self._pending = None
+
+
+def temperature_ladder(replicas: int, min_temperature: float, max_temperature: float) -> np.ndarray:
+    """
+    Geometrically spaced temperatures, coldest first, so neighbors trade states about equally often
+    along the whole ladder
+    """
+    if replicas == 1:
+        return np.array([float(min_temperature)])
+    return np.geomspace(min_temperature, max_temperature, replicas)
+
+
+def temper(input_colors: List[Color], result_count: int = 5, replicas: int = 16,
+           min_temperature: float = .01, max_temperature: float = 30., sweeps: int = 500,
+           verbose: bool = True,
+           rng: Optional[np.random.RandomState] = None,
+           initial_colors: Optional[List[Color]] = None,
+           max_seconds: Optional[float] = None, max_evaluations: Optional[int] = None,
+           callback: Optional[Callable[[SweepStats], Optional[bool]]] = None,
+           weights: Optional[Dict[str, float]] = None,
+           moves: Optional[Moves] = None) -> List[Color]:
+    """
+    Parallel tempering: minimizes obj_fn like anneal, with replicas of the palette at a fixed ladder of
+    temperatures that trade states. See the top of this module
+
+    Args:
+        input_colors: A list of target colors to optimize toward
+        result_count: How many colors to return
+        replicas: How many replicas to run, i.e. rungs of the temperature ladder
+        min_temperature: The temperature of the coldest replica, where the result is refined
+        max_temperature: The temperature of the hottest replica, hot enough to leave any local minimum
+        sweeps: How many times to move every color of every replica
+        verbose: print out the best cost and the exchange rate of every sweep?
+                 Also prints out the (target, final) color lists and the final cost
+        rng: The random state to draw from, e.g. np.random.RandomState(seed). Defaults to the global numpy one
+        initial_colors: start every replica from these colors instead of result_count random ones each
+        max_seconds: wall-clock budget in seconds
+        max_evaluations: budget of objective evaluations, counting one per replica and move
+        callback: Called with the SweepStats of every sweep, for the coldest replica. Returning True stops early
+        weights: Overrides for the obj_fn weights, see objective.DEFAULT_WEIGHTS
+        moves: How colors are moved, see moves.py. Defaults to moves.OKLabMoves, whose steps shrink with the
+               temperature of each replica
+
+    Side Effect:
+        If verbose, prints to the console
+
+    Returns:
+        A list of the best colors found by any replica (in Color objects)
+    """
+    rng = np.random if rng is None else rng
+    moves = OKLabMoves() if moves is None else moves
+    if initial_colors is None:
+        states = np.stack([Palette.random(result_count, rng).srgb for _ in range(replicas)])
+    else:
+        states = np.repeat(Palette.from_colors(initial_colors).srgb[None], replicas, axis=0)
+
+    objective = ReplicaObjective(states, input_colors, weights)
+    # the temperature of each replica, and which replica is at each rung of the ladder
+    ladder = temperature_ladder(replicas, min_temperature, max_temperature)
+    temperatures, rungs = ladder.copy(), np.arange(replicas)
+    best = int(np.argmin(objective.cost))
+    best_cost, best_state = float(objective.cost[best]), objective.rgb[best].copy()
+
+    start = time.perf_counter()
+    deadline = None if max_seconds is None else start + max_seconds
+    evaluations = accepted_moves = exchanges = 0
+    n = objective.rgb.shape[1]
+
+    for sweep in range(sweeps):
+        stop = False
+        for i in range(n):
+            if max_evaluations is not None and evaluations + replicas > max_evaluations or \
+                    deadline is not None and time.perf_counter() >= deadline:
+                stop = True
+                break
+
+            # channels stay whole numbers, as in run_schedule
+            new_rgbs = np.trunc(moves.propose_batch(objective.rgb[:, i], temperatures, rng))
+            deltas = objective.propose(i, new_rgbs) - objective.cost
+            evaluations += replicas
+            accepted = rng.rand(replicas) < np.exp(np.minimum(-deltas / temperatures, 0))
+            moves.record(replicas, int(np.sum(accepted)))
+            objective.commit(accepted)
+            accepted_moves += int(np.sum(accepted))
+
+            best = int(np.argmin(objective.cost))
+            if objective.cost[best] < best_cost:
+                best_cost, best_state = float(objective.cost[best]), objective.rgb[best].copy()
+
+        # neighbors on the ladder trade temperatures: (k, k + 1) for even k on even sweeps, odd k on odd ones
+        lower = rungs[sweep % 2:-1:2]
+        upper = rungs[sweep % 2 + 1::2]
+        criterion = (1 / temperatures[lower] - 1 / temperatures[upper]) * (objective.cost[lower] -
+                                                                           objective.cost[upper])
+        trade = rng.rand(len(lower)) < np.exp(np.minimum(criterion, 0))
+        lower, upper = lower[trade], upper[trade]
+        temperatures[lower], temperatures[upper] = temperatures[upper], temperatures[lower].copy()
+        rungs[np.searchsorted(ladder, temperatures[lower])] = lower
+        rungs[np.searchsorted(ladder, temperatures[upper])] = upper
+        exchanges += len(lower)
+
+        if verbose:
+            print(f"best cost:\t\t{best_cost}")
+            print(f"exchange rate:\t\t{len(lower) / max(len(trade), 1)}")
+
+        if callback is not None:
+            coldest = rungs[0]
+            stats = SweepStats(sweep, float(ladder[0]), float(objective.cost[coldest]), best_cost,
+                               accepted_moves / max(evaluations, 1), evaluations, time.perf_counter() - start,
+                               {}, best_state)
+            if callback(stats):
+                stop = True
+
+        if stop:
+            break
+
+    colors = Palette(best_state).to_colors()
+
+    if verbose:
+        print(dedent(f"""
+                      Original Colors:\t{hex_list(input_colors)}
+                      Final Colors:\t\t{hex_list(colors)}
+                      Final Cost:\t\t{best_cost}
+                      Exchanges:\t\t{exchanges}
+                      """))
+
+    return colors
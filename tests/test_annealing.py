@@ -0,0 +1,41 @@
+# Budgeted anneal and anneal_many return the best palette they saw, not the one they stopped at
+import numpy as np
+import pytest
+
+from annealing import anneal, anneal_many, make_objective, obj_fn, run_schedule
+from color import Color
+from palette import Palette
+
+TARGETS = [Color.from_hex(h) for h in ['#00798c', '#d1495b', '#edae49']]
+
+
+def test_anneal_returns_the_best_state_within_its_budget():
+    best_costs = []
+    colors = anneal(TARGETS, 5, verbose=False, rng=np.random.RandomState(0), max_evaluations=2000,
+                    callback=lambda stats: best_costs.append(stats.best_cost))
+    assert obj_fn(colors, TARGETS) == pytest.approx(min(best_costs))
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_anneal_many_returns_the_best_state_within_its_budget(seed):
+    # the same stream anneal_many gives its only restart
+    stream = np.random.SeedSequence(seed).spawn(1)[0]
+    rng = np.random.RandomState(np.random.MT19937(stream))
+    objective = make_objective(Palette.random(5, rng), TARGETS, rng=rng)
+    result = run_schedule(objective, 1000., 0.99, .0001, rng, max_evaluations=2000)
+    # the budget runs out while the schedule is still hot, well past its best state
+    assert result.stop_reason == 'max_evaluations'
+    assert result.best_cost < objective.cost
+
+    cost, colors = anneal_many(TARGETS, 5, restarts=1, seed=seed, workers=1, max_evaluations=2000)[0]
+    assert cost == pytest.approx(result.best_cost)
+    assert obj_fn(colors, TARGETS) == pytest.approx(cost)
+
+
+def test_anneal_many_ranks_culled_restarts_by_their_best_state():
+    results = anneal_many(TARGETS, 5, restarts=3, top_k=3, seed=0, workers=1, max_evaluations=1500,
+                          cull_margin=1e9, cull_every=3)
+    costs = [cost for cost, _ in results]
+    assert costs == sorted(costs)
+    for cost, colors in results:
+        assert obj_fn(colors, TARGETS) == pytest.approx(cost)
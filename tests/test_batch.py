@@ -0,0 +1,81 @@
+# Request handling of batch mode and the service: validation, error lines and merged jobs
+import asyncio
+import io
+import json
+import pytest
+
+from batch import run_batch, run_job
+from service import PaletteService, ServiceClient
+
+PALETTE = ['#00798c', '#d1495b']
+
+
+@pytest.mark.parametrize('job, message', [
+    ({'colors': PALETTE, 'temperature': 5}, 'Unknown job keys: temperature'),
+    ({'colors': []}, "non-empty list of 'colors'"),
+    ({}, "non-empty list of 'colors'"),
+])
+def test_run_job_rejects_bad_jobs(job, message):
+    with pytest.raises(ValueError, match=message):
+        run_job(job)
+
+
+def test_run_job_extends_the_palette():
+    result = run_job({'id': 'a', 'line': 3, 'colors': PALETTE, 'result_count': 2, 'seed': 0,
+                      'max_evaluations': 200})
+    assert result['id'] == 'a' and result['line'] == 3
+    assert result['input'] == PALETTE and len(result['colors']) == 2
+
+
+def test_run_batch_reports_every_line():
+    lines = [json.dumps({'id': 'ok', 'colors': PALETTE, 'result_count': 2, 'seed': 0, 'max_evaluations': 200}),
+             '',
+             'not json',
+             '[1, 2]',
+             json.dumps({'id': 'unknown', 'colors': PALETTE, 'speed': 11})]
+    output = io.StringIO()
+    assert run_batch(lines, output, workers=1) == 3
+
+    results = {result['line']: result for result in map(json.loads, output.getvalue().splitlines())}
+    assert sorted(results) == [1, 3, 4, 5]
+    assert len(results[1]['colors']) == 2 and 'error' not in results[1]
+    assert results[3]['error'].startswith('JSONDecodeError')
+    assert results[4]['error'] == 'ValueError: A job must be a JSON object'
+    assert results[5] == {'id': 'unknown', 'line': 5, 'error': 'ValueError: Unknown job keys: speed'}
+
+
+async def _collect(events):
+    return [event async for event in events]
+
+
+async def _events(client: ServiceClient, **job):
+    return await _collect(client.extend(PALETTE, **job))
+
+
+def test_service_answers_merges_and_rejects_requests(tmp_path):
+    async def scenario():
+        service = PaletteService(workers=1, max_client_jobs=2)
+        path = str(tmp_path / 'service.sock')
+        await service.start(path=path)
+        try:
+            async with await ServiceClient.connect(path=path) as first, \
+                    await ServiceClient.connect(path=path) as second:
+                job = {'result_count': 2, 'seed': 0, 'max_evaluations': 2000}
+                # the second client asks once the first job is in flight
+                events = first.extend(PALETTE, job_id='a', **job)
+                queued = await events.__anext__()
+                rest, b = await asyncio.gather(_collect(events), _events(second, job_id='b', **job))
+                a = [queued, *rest]
+
+                unknown = await _events(first, job_id='c', speed=11)
+                return a, b, unknown
+        finally:
+            await service.close()
+
+    a, b, unknown = asyncio.run(scenario())
+    assert a[0] == {'id': 'a', 'event': 'queued', 'merged': False}
+    assert b[0] == {'id': 'b', 'event': 'queued', 'merged': True}
+    # the identical job ran once, and both clients got its result
+    assert a[-1]['event'] == b[-1]['event'] == 'result'
+    assert a[-1]['colors'] == b[-1]['colors'] and len(a[-1]['colors']) == 2
+    assert unknown == [{'id': 'c', 'event': 'error', 'error': 'ValueError: Unknown job keys: speed'}]
@@ -0,0 +1,69 @@
+# What a cached result is keyed on, and when extend_palette reuses or stores one
+import pytest
+
+import lut
+from cache import ResultCache, cache_key
+from cli import extend_palette
+from objective import DEFAULT_WEIGHTS
+
+PALETTE = ['#00798c', '#d1495b', '#edae49']
+
+
+def test_key_ignores_order_and_spelling_of_the_palette():
+    key = cache_key(PALETTE, 5, seed=0)
+    assert cache_key(['#EDAE49', '#00798C', '#d1495b'], 5, seed=0) == key
+    assert cache_key(PALETTE, 5, weights=dict(DEFAULT_WEIGHTS), seed=0) == key
+
+
+@pytest.mark.parametrize('change', [
+    {'result_count': 6},
+    {'seed': 1},
+    {'weights': {'Target': 2}},
+    {'max_evaluations': 1000},
+    {'restarts': 4},
+])
+def test_key_changes_with_the_run(change):
+    run = {'result_count': 5, 'seed': 0, **change}
+    assert cache_key(PALETTE, **run) != cache_key(PALETTE, 5, seed=0)
+
+
+def test_key_changes_with_the_lookup_tables(monkeypatch):
+    exact = cache_key(PALETTE, 5, seed=0)
+    monkeypatch.setattr(lut, 'fingerprint', lambda: {'version': lut.TABLE_VERSION, 'size': lut.TABLE_SIZE,
+                                                     'tables': ['lab']})
+    assert cache_key(PALETTE, 5, seed=0) != exact
+
+
+def test_get_put_and_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=400)
+    key = cache_key(PALETTE, 2, seed=0)
+    assert cache.get(key) is None
+
+    cache.put(key, PALETTE, ['#000000', '#ffffff'], 12.5)
+    hit = cache.get(key)
+    assert hit.colors == ['#000000', '#ffffff'] and hit.cost == 12.5
+    assert hit.input == sorted(PALETTE)
+
+    # the least recently used results go first once the cache outgrows max_bytes
+    for seed in range(1, 6):
+        cache.put(cache_key(PALETTE, 2, seed=seed), PALETTE, ['#000000', '#ffffff'], 1.)
+    assert 0 < len(cache) < 6
+    assert cache.get(cache_key(PALETTE, 2, seed=5)) is not None
+    cache.close()
+
+
+def test_extend_palette_reuses_and_stores_results(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    first = extend_palette(PALETTE, 3, seed=0, cache=cache, max_evaluations=300)
+    assert len(cache) == 1
+    assert extend_palette(list(reversed(PALETTE)), 3, seed=0, cache=cache, max_evaluations=300)['colors'] == \
+        first['colors']
+
+    # a miss for another seed is stored under its own key
+    extend_palette(PALETTE, 3, seed=1, cache=cache, max_evaluations=300)
+    assert len(cache) == 2
+
+    # warm-started results depend on what was cached, so they aren't stored
+    extend_palette(PALETTE, 3, seed=2, cache=cache, warm_start=True, max_evaluations=300)
+    assert len(cache) == 2
+    cache.close()
@@ -0,0 +1,55 @@
+# PNGWriter and PNGReader round trips, a band at a time, checked against Pillow
+import numpy as np
+import pytest
+
+from image import ArrayReader, PNGReader, PNGWriter, open_image, read_image
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def _image(height: int, width: int, channels: int, seed: int = 0) -> np.ndarray:
+    # smooth gradients with noise, so the filters Pillow picks when saving vary between rows
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[:height, :width]
+    base = np.stack([(x * 3 + y) % 256, (y * 5) % 256, (x * y) % 256, 255 - (x + y) % 256][:channels], axis=-1)
+    return ((base + rng.randint(0, 8, base.shape)) % 256).astype(np.uint8)
+
+
+def _read_bands(path: str, rows: int) -> np.ndarray:
+    with open_image(path) as image:
+        bands = []
+        while image.rows_read < image.shape[0]:
+            bands.append(image.read(rows))
+        return np.concatenate(bands)
+
+
+@pytest.mark.parametrize('channels', [3, 4])
+@pytest.mark.parametrize('band', [1, 7, 64])
+def test_writer_and_reader_round_trip(tmp_path, channels, band):
+    pixels = _image(50, 37, channels)
+    path = str(tmp_path / 'image.png')
+    with PNGWriter(path, 37, 50, channels) as png:
+        for start in range(0, 50, band):
+            png.write(pixels[start:start + band])
+
+    with Image.open(path) as decoded:
+        assert np.array_equal(np.asarray(decoded), pixels)
+    with PNGReader(path) as png:
+        assert png.shape == pixels.shape
+    assert np.array_equal(_read_bands(path, band), pixels)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'L', 'LA', 'P'])
+@pytest.mark.parametrize('optimize', [False, True])
+def test_reader_matches_pillow_for_filtered_pngs(tmp_path, mode, optimize):
+    path = str(tmp_path / 'image.png')
+    Image.fromarray(_image(40, 33, 3)).convert(mode).save(path, optimize=optimize)
+    assert isinstance(open_image(path), PNGReader)
+    assert np.array_equal(_read_bands(path, 6), read_image(path))
+
+
+def test_16_bit_pngs_are_decoded_whole(tmp_path):
+    path = str(tmp_path / 'image.png')
+    Image.fromarray(_image(20, 20, 1)[..., 0].astype(np.uint16) * 257).save(path)
+    assert isinstance(open_image(path), ArrayReader)
+    assert np.array_equal(_read_bands(path, 6), read_image(path))
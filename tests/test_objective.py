@@ -0,0 +1,72 @@
+# IncrementalObjective against obj_fn, which it has to reproduce after any sequence of moves
+import numpy as np
+import pytest
+
+from annealing import make_objective, obj_fn
+from color import Color
+from objective import IncrementalObjective
+from palette import Palette
+
+TARGETS = [Color.from_hex(h) for h in ['#00798c', '#d1495b', '#edae49']]
+
+
+def _proposed_cost(objective, index: int, rgb: np.ndarray) -> float:
+    palette = objective.palette.copy()
+    palette.set(index, rgb)
+    return obj_fn(palette.to_colors(), TARGETS)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_commit_and_rollback_track_obj_fn(seed):
+    rng = np.random.RandomState(seed)
+    objective = make_objective(Palette.random(6, rng), TARGETS)
+    assert isinstance(objective, IncrementalObjective)
+    assert objective.cost == pytest.approx(obj_fn(objective.palette.to_colors(), TARGETS))
+
+    for _ in range(40):
+        index = rng.randint(6)
+        rgb = rng.randint(0, 256, 3).astype(float)
+        cost = objective.propose(index, rgb)
+        assert cost == pytest.approx(_proposed_cost(objective, index, rgb))
+        if rng.rand() < 0.5:
+            objective.commit()
+        else:
+            objective.rollback()
+        assert objective.cost == pytest.approx(obj_fn(objective.palette.to_colors(), TARGETS))
+
+
+def test_propose_many_commits_the_chosen_candidate():
+    rng = np.random.RandomState(0)
+    objective = make_objective(Palette.random(5, rng), TARGETS)
+    for _ in range(10):
+        index = rng.randint(5)
+        rgbs = rng.randint(0, 256, (8, 3)).astype(float)
+        costs = objective.propose_many(index, rgbs)
+        assert costs == pytest.approx([_proposed_cost(objective, index, rgb) for rgb in rgbs])
+        candidate = rng.randint(8)
+        objective.commit(candidate)
+        assert np.array_equal(objective.rgb[index], rgbs[candidate])
+        assert objective.cost == pytest.approx(costs[candidate])
+
+
+def test_sampled_mode_stays_exact_after_commits():
+    # more than objective.LARGE_PALETTE_SIZE colors: proposals are estimated from a sample, commits are exact
+    rng = np.random.RandomState(0)
+    objective = make_objective(Palette.random(110, rng), TARGETS, rng=rng)
+    assert objective.sample_size is not None and objective.sample_size < 109
+    assert objective.cost == pytest.approx(obj_fn(objective.palette.to_colors(), TARGETS), rel=1e-5)
+
+    for _ in range(15):
+        index = rng.randint(110)
+        rgbs = rng.randint(0, 256, (4, 3)).astype(float)
+        estimates = objective.propose_many(index, rgbs)
+        candidate = rng.randint(4)
+        exact = _proposed_cost(objective, index, rgbs[candidate])
+        # the estimate is within its bound, and confirm replaces it by the exact value
+        assert abs(estimates[candidate] - exact) <= objective.bounds[candidate] + 1e-3 * abs(exact)
+        assert objective.confirm(candidate) == pytest.approx(exact, rel=1e-5)
+        if rng.rand() < 0.7:
+            objective.commit(candidate)
+        else:
+            objective.rollback()
+        assert objective.cost == pytest.approx(obj_fn(objective.palette.to_colors(), TARGETS), rel=1e-5)
@@ -0,0 +1,30 @@
+# TargetIndex finds the exact CIEDE2000-nearest target, however many targets it indexes
+import numpy as np
+import pytest
+
+from color import rgb_to_lab
+from color_diff import delta_e_cie2000_cross, delta_e_cie2000_pairs
+from target_index import TargetIndex, delta_e_lower_bound
+
+
+def _lab(rng: np.random.RandomState, count: int) -> np.ndarray:
+    return rgb_to_lab(rng.randint(0, 256, (count, 3)).astype(float))
+
+
+def test_lower_bound_never_exceeds_ciede2000():
+    rng = np.random.RandomState(0)
+    lab1 = _lab(rng, 5000)
+    # far apart, nearby and same-hue pairs
+    lab2 = np.concatenate([_lab(rng, 3000), lab1[3000:4000] + rng.randn(1000, 3) * 3,
+                           lab1[4000:] * (1 + rng.randn(1000, 1) * .01)])
+    assert np.all(delta_e_lower_bound(lab1, lab2) <= delta_e_cie2000_pairs(lab1, lab2) + 1e-9)
+
+
+@pytest.mark.parametrize('targets', [100, 500, 3000])
+def test_closest_matches_an_exhaustive_scan(targets):
+    rng = np.random.RandomState(targets)
+    target_lab, lab = _lab(rng, targets), _lab(rng, 200)
+    indices, distances = TargetIndex(target_lab).closest(lab)
+    exhaustive = delta_e_cie2000_cross(lab, target_lab)
+    assert distances == pytest.approx(exhaustive.min(axis=1))
+    assert exhaustive[np.arange(len(lab)), indices] == pytest.approx(exhaustive.min(axis=1))